@@ -0,0 +1,353 @@
+"""
+Offline benchmark of the Phoenix ClinVar transfer path. Serves a synthetic
+ClinVar weekly directory from a loopback FTP server in a separate process,
+runs the fetcher against it with DNAnexus replaced by a local directory,
+and reports wall time, throughput and peak memory per stage
+
+Example:
+    python benchmarks/bench_transfer.py --size-mb 500 --segments 4
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(REPO_DIR, "bin"), REPO_DIR]
+
+import clinvar_file_fetcher  # noqa: E402
+from utils import util  # noqa: E402
+from utils.bgzf import BGZF_MAGIC, BGZFWriter  # noqa: E402
+from utils.ftp_pool import FTP_POOL  # noqa: E402
+from utils.hashing import hash_file  # noqa: E402
+from utils.release_catalogue import (  # noqa: E402
+    ReleaseCatalogue, LATEST_RELEASE_ALIAS
+)
+from utils.tabix import build_tabix_index  # noqa: E402
+from benchmarks.fake_dnanexus import FakeDNAnexus  # noqa: E402
+from benchmarks.local_ftp_server import serve_in_process  # noqa: E402
+
+CLINVAR_LINK_PATH = "/pub/clinvar/vcf_GRCh38/weekly/"
+PROJECT_ID = "project-benchmark"
+MB = 1024 * 1024
+VCF_HEADER = (
+    "##fileformat=VCFv4.1\n"
+    + "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+)
+SIGNIFICANCES = (
+    "Benign", "Likely_benign", "Uncertain_significance", "Likely_pathogenic",
+    "Pathogenic", "Conflicting_classifications_of_pathogenicity",
+)
+REVIEW_STATUSES = (
+    "criteria_provided,_single_submitter",
+    "criteria_provided,_multiple_submitters,_no_conflicts",
+    "no_assertion_criteria_provided", "reviewed_by_expert_panel",
+)
+# records generated between checks of the VCF size
+RECORDS_PER_BATCH = 1000
+# positions per synthetic chromosome, within the range tabix can index
+MAX_POSITION = 200_000_000
+
+
+def write_vcf(path, size, rng) -> None:
+    """Write synthetic ClinVar VCF records as BGZF until the file reaches
+    about size bytes, sorted by position so it can be tabix indexed
+
+    Args:
+        path (str): path of VCF to write
+        size (int): approximate size of compressed VCF in bytes
+        rng (random.Random): source of random records
+    """
+    chrom = 1
+    pos = 0
+    with BGZFWriter(path) as writer:
+        writer.write(VCF_HEADER.encode())
+        while os.path.getsize(path) < size:
+            lines = []
+            for _ in range(RECORDS_PER_BATCH):
+                pos += rng.randint(1, 20)
+                if pos > MAX_POSITION:
+                    chrom += 1
+                    pos = 1
+                ref, alt = rng.sample("ACGT", 2)
+                lines.append(
+                    f"{chrom}\t{pos}\t{rng.randint(1, 10 ** 7)}\t{ref}\t"
+                    + f"{alt}\t.\t.\tALLELEID={rng.randint(1, 10 ** 7)};"
+                    + f"CLNREVSTAT={rng.choice(REVIEW_STATUSES)};"
+                    + f"CLNSIG={rng.choice(SIGNIFICANCES)}\n"
+                )
+            writer.write("".join(lines).encode())
+
+
+def write_release(directory, version, size, rng) -> None:
+    """Write VCF, index and checksum for one release, reusing files left
+    by a previous run if the VCF is BGZF and already about the requested
+    size
+
+    Args:
+        directory (str): ClinVar weekly directory being served
+        version (str): release version, format YYYYMMDD
+        size (int): approximate size of release VCF in bytes
+        rng (random.Random): source of random records
+    """
+    vcf_path = os.path.join(directory, f"clinvar_{version}.vcf.gz")
+    md5_path = f"{vcf_path}.md5"
+    if os.path.exists(md5_path) and os.path.exists(vcf_path) and (
+        size <= os.path.getsize(vcf_path) < size + MB
+    ):
+        with open(vcf_path, "rb") as vcf_file:
+            if vcf_file.read(len(BGZF_MAGIC)) == BGZF_MAGIC:
+                return
+    write_vcf(vcf_path, size, rng)
+    build_tabix_index(vcf_path, f"{vcf_path}.tbi")
+    vcf_md5 = hash_file(vcf_path, ("md5",))["md5"]
+    with open(md5_path, "w", encoding="utf8") as md5_file:
+        md5_file.write(f"{vcf_md5}  {os.path.basename(vcf_path)}\n")
+
+
+def build_clinvar_directory(data_dir, size, history_weeks) -> str:
+    """Create a synthetic ClinVar weekly directory with history_weeks
+    releases, where only the newest release has a VCF of size bytes, and an
+    undated alias of the newest release
+
+    Args:
+        data_dir (str): root directory served over FTP
+        size (int): size of newest release VCF in bytes
+        history_weeks (int): number of weekly releases in the directory
+
+    Returns:
+        str: version of the newest release
+    """
+    directory = os.path.join(data_dir, CLINVAR_LINK_PATH.strip("/"))
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(0)
+    today = date.today()
+    versions = [
+        (today - timedelta(weeks=week)).strftime("%Y%m%d")
+        for week in range(history_weeks)
+    ]
+    for index, version in enumerate(versions):
+        write_release(directory, version, size if index == 0 else MB, rng)
+
+    alias_path = os.path.join(directory, LATEST_RELEASE_ALIAS)
+    if os.path.exists(alias_path):
+        os.remove(alias_path)
+    os.link(
+        os.path.join(directory, f"clinvar_{versions[0]}.vcf.gz"), alias_path
+    )
+    return versions[0]
+
+
+class StageTimer:
+    """Records wall time, bytes transferred and peak memory of each stage
+    """
+
+    def __init__(self):
+        self.results = []
+
+    @contextmanager
+    def stage(self, name, nbytes=0):
+        """Time the enclosed block as stage name
+
+        Args:
+            name (str): name of stage
+            nbytes (int, optional): bytes transferred during stage
+        """
+        start = time.perf_counter()
+        yield
+        self.record(name, time.perf_counter() - start, nbytes)
+
+    def record(self, name, seconds, nbytes=0) -> None:
+        self.results.append({
+            "stage": name,
+            "seconds": round(seconds, 4),
+            "mb": round(nbytes / MB, 2),
+            "mb_per_s": round(nbytes / MB / seconds, 2) if seconds else None,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        })
+
+    @contextmanager
+    def accumulate(self, module, name, totals, key):
+        """Add time spent in module.name to totals[key] while installed,
+        to break a stage down into the functions it calls
+
+        Args:
+            module (module): module the function is looked up on
+            name (str): function name
+            totals (dict): seconds spent, keyed by key
+            key (str): key to accumulate time under
+        """
+        function = getattr(module, name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                totals[key] = totals.get(key, 0) + (
+                    time.perf_counter() - start
+                )
+
+        setattr(module, name, timed)
+        try:
+            yield
+        finally:
+            setattr(module, name, function)
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MiB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_benchmark(base_link, version, work_dir, args) -> list[dict]:
+    """Run each stage of a ClinVar update against the local server
+
+    Args:
+        base_link (str): link to local FTP server
+        version (str): version of newest release being served
+        work_dir (str): directory for downloads and the fake DNAnexus
+        args (argparse.Namespace): benchmark options
+
+    Returns:
+        list[dict]: results of each stage
+    """
+    timer = StageTimer()
+    FTP_POOL.max_sessions_per_host = max(
+        FTP_POOL.max_sessions_per_host, args.segments + 1
+    )
+
+    with timer.stage("connect"):
+        ftp = clinvar_file_fetcher.connect_to_website(
+            base_link, CLINVAR_LINK_PATH
+        )
+    with timer.stage("listing"):
+        release = clinvar_file_fetcher.get_most_recent_clivar_file_info(ftp)
+    catalogue = ReleaseCatalogue(os.path.join(work_dir, "catalogue.json"))
+    with timer.stage("catalogue_refresh_cold"):
+        clinvar_file_fetcher.get_most_recent_clivar_file_info(ftp, catalogue)
+    with timer.stage("catalogue_refresh_warm"):
+        clinvar_file_fetcher.get_most_recent_clivar_file_info(ftp, catalogue)
+    FTP_POOL.release(ftp)
+
+    recent_vcf_file, recent_tbi_file, _, _, checksum_file = release
+    directory = os.path.join(args.data_dir, CLINVAR_LINK_PATH.strip("/"))
+    nbytes = sum(
+        os.path.getsize(os.path.join(directory, name))
+        for name in (recent_vcf_file, recent_tbi_file)
+    )
+    backend = FakeDNAnexus(os.path.join(work_dir, "dnanexus"))
+    totals = {}
+    with backend.install(util), \
+            timer.accumulate(util, "download_ftp_file", totals, "download"), \
+            timer.accumulate(
+                util, "stream_ftp_file_DNAnexus", totals, "stream"
+            ), \
+            timer.accumulate(
+                util, "upload_file_DNAnexus", totals, "upload"
+            ), \
+            timer.stage("download_clinvar_dnanexus", nbytes):
+        clinvar_file_fetcher.download_clinvar_dnanexus(
+            base_link, CLINVAR_LINK_PATH, PROJECT_ID,
+            f"/clinvar_version_{version}_GRCh38_annotation_resource_update",
+            recent_vcf_file, checksum_file, recent_tbi_file,
+            args.segments, args.block_size, args.stream
+        )
+    # VCF and index transfer concurrently, so these are summed thread time
+    for key, seconds in totals.items():
+        timer.record(f"  {key} (thread time)", seconds)
+    FTP_POOL.close_all()
+    return timer.results
+
+
+def print_results(results, args) -> None:
+    print(
+        f"size={args.size_mb}MB segments={args.segments}"
+        + f" stream={args.stream} block_size={args.block_size}"
+        + f" latency={args.latency_ms}ms"
+    )
+    print(
+        f"{'stage':<30}{'seconds':>10}{'MB':>10}{'MB/s':>10}"
+        + f"{'peak RSS MB':>14}"
+    )
+    for result in results:
+        print(
+            f"{result['stage']:<30}{result['seconds']:>10}{result['mb']:>10}"
+            + f"{result['mb_per_s'] or '':>10}{result['peak_rss_mb']:>14}"
+        )
+
+
+def main(args) -> None:
+    version = build_clinvar_directory(
+        args.data_dir, args.size_mb * MB, args.history_weeks
+    )
+    address_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=serve_in_process,
+        args=(args.data_dir, args.latency_ms / 1000, address_queue),
+        daemon=True
+    )
+    server.start()
+    try:
+        base_link = address_queue.get(timeout=30)
+        with tempfile.TemporaryDirectory() as work_dir:
+            # downloads are written to the working directory
+            previous_dir = os.getcwd()
+            os.chdir(work_dir)
+            try:
+                results = run_benchmark(base_link, version, work_dir, args)
+            finally:
+                os.chdir(previous_dir)
+    finally:
+        server.terminate()
+        server.join()
+
+    print_results(results, args)
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as json_file:
+            json.dump({"options": vars(args), "results": results}, json_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--size-mb", type=int, default=100,
+        help="Size of the newest synthetic ClinVar VCF in MiB"
+    )
+    parser.add_argument(
+        "--history-weeks", type=int, default=52,
+        help="Number of weekly releases in the synthetic directory"
+    )
+    parser.add_argument(
+        "--segments", type=int, default=1,
+        help="Parallel connections to download the VCF over"
+    )
+    parser.add_argument(
+        "--block-size", type=int, default=util.DEFAULT_BLOCK_SIZE,
+        help="Bytes requested from the data connection per read"
+    )
+    parser.add_argument(
+        "--stream", action="store_true",
+        help="Stream files into the fake DNAnexus backend"
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=0,
+        help="Delay added by the server before answering each command"
+    )
+    parser.add_argument(
+        "--data-dir",
+        default=os.path.join(tempfile.gettempdir(), "phoenix_benchmark"),
+        help="Directory the synthetic releases are generated in and reused"
+        + " from between runs"
+    )
+    parser.add_argument("--json", help="Write results to this json file")
+    main(parser.parse_args())
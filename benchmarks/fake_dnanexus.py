@@ -0,0 +1,116 @@
+"""
+Filesystem-backed stand-in for the DNAnexus calls made during a Phoenix
+update, so transfers can be benchmarked without a DNAnexus project
+"""
+
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from unittest.mock import patch
+
+
+class FakeDXFile:
+    """Stand-in for dxpy.DXFile writing to a local file"""
+
+    def __init__(self, backend, dxid, path):
+        self.backend = backend
+        self.dxid = dxid
+        self.path = path
+        self.properties = {}
+        self._file = None
+
+    def write(self, data):
+        if self._file is None:
+            self._file = open(self.path, "wb")
+        self._file.write(data)
+
+    def close(self, block=False):
+        if self._file is not None:
+            self._file.close()
+        self.backend.bytes_uploaded += os.path.getsize(self.path)
+
+    def remove(self):
+        if self._file is not None:
+            self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.backend.files.pop(self.dxid, None)
+
+    def set_properties(self, properties):
+        self.properties.update(properties)
+
+    def get_id(self):
+        return self.dxid
+
+
+class FakeDNAnexus:
+    """Stores "uploaded" files under root/project/folder and replaces the
+    DNAnexus helpers in utils.util while installed
+
+    Args:
+        root (str): directory to store uploaded files in
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.files = {}
+        self.bytes_uploaded = 0
+        self._lock = threading.Lock()
+
+    def _new_file(self, name, project, folder):
+        folder_path = os.path.join(
+            self.root, project, (folder or "/").lstrip("/")
+        )
+        os.makedirs(folder_path, exist_ok=True)
+        dx_file = FakeDXFile(
+            self, f"file-{uuid.uuid4().hex[:24]}",
+            os.path.join(folder_path, name)
+        )
+        with self._lock:
+            self.files[dx_file.dxid] = dx_file
+        return dx_file
+
+    def new_dxfile(self, name=None, project=None, folder=None, **kwargs):
+        return self._new_file(name, project, folder)
+
+    def DXFile(self, dxid, project=None):
+        return self.files[dxid]
+
+    def upload_file_DNAnexus(
+        self, file_path, project_id, proj_folder_path=None, properties=None
+    ):
+        dx_file = self._new_file(
+            os.path.basename(file_path), project_id, proj_folder_path
+        )
+        shutil.copyfile(file_path, dx_file.path)
+        dx_file.set_properties(properties or {})
+        with self._lock:
+            self.bytes_uploaded += os.path.getsize(dx_file.path)
+        return dx_file.dxid
+
+    def create_proj_folder_if_missing(self, project_id, proj_folder_path):
+        os.makedirs(os.path.join(
+            self.root, project_id, (proj_folder_path or "/").lstrip("/")
+        ), exist_ok=True)
+
+    def find_file_by_md5(self, project_id, file_md5):
+        # always transfer, so every run measures the full transfer path
+        return None
+
+    @contextmanager
+    def install(self, util_module):
+        """Replace DNAnexus calls in the util module with this backend
+
+        Args:
+            util_module (module): imported utils.util module
+        """
+        with patch.multiple(
+            util_module,
+            upload_file_DNAnexus=self.upload_file_DNAnexus,
+            create_proj_folder_if_missing=self.create_proj_folder_if_missing,
+            find_file_by_md5=self.find_file_by_md5,
+            dxpy=self,
+        ):
+            yield self
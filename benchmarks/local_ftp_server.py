@@ -0,0 +1,212 @@
+"""
+Minimal FTP server on loopback serving a local directory, used to benchmark
+and test Phoenix transfers without network access
+"""
+
+import os
+import socket
+import socketserver
+import threading
+import time
+
+
+class FTPHandler(socketserver.StreamRequestHandler):
+    """Handles one FTP control connection. Supports the commands used by
+    ftplib for login, listings (LIST, NLST, MLSD) and resumable binary
+    transfers (SIZE, MDTM, REST, RETR) in passive mode
+    """
+
+    def handle(self):
+        self.cwd = "/"
+        self.rest = 0
+        self.data_server = None
+        self.reply("220 Phoenix local FTP server ready")
+        for raw_line in self.rfile:
+            command, _, argument = raw_line.decode().rstrip("\r\n").partition(
+                " "
+            )
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            handler = getattr(self, f"ftp_{command.upper()}", None)
+            if handler is None:
+                self.reply(f"502 Command {command} not implemented")
+                continue
+            if handler(argument) is False:
+                break
+        if self.data_server is not None:
+            self.data_server.close()
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def local_path(self, path):
+        """Resolve FTP path relative to the served root directory"""
+        ftp_path = os.path.normpath(os.path.join(self.cwd, path or "."))
+        return ftp_path, os.path.join(
+            self.server.root, ftp_path.lstrip("/")
+        )
+
+    def ftp_USER(self, argument):
+        self.reply("331 Any password will do")
+
+    def ftp_PASS(self, argument):
+        self.reply("230 Logged in")
+
+    def ftp_SYST(self, argument):
+        self.reply("215 UNIX Type: L8")
+
+    def ftp_FEAT(self, argument):
+        self.wfile.write(
+            b"211-Features:\r\n MDTM\r\n MLST type*;size*;modify*;\r\n"
+            + b" REST STREAM\r\n SIZE\r\n EPSV\r\n211 End\r\n"
+        )
+
+    def ftp_TYPE(self, argument):
+        self.reply(f"200 Type set to {argument}")
+
+    def ftp_NOOP(self, argument):
+        self.reply("200 NOOP ok")
+
+    def ftp_PWD(self, argument):
+        self.reply(f'257 "{self.cwd}" is the current directory')
+
+    def ftp_CWD(self, argument):
+        ftp_path, local_path = self.local_path(argument)
+        if not os.path.isdir(local_path):
+            self.reply(f"550 {argument}: No such directory")
+            return
+        self.cwd = ftp_path
+        self.reply("250 Directory changed")
+
+    def ftp_QUIT(self, argument):
+        self.reply("221 Goodbye")
+        return False
+
+    def ftp_PASV(self, argument):
+        port = self.open_data_server()
+        self.reply(
+            "227 Entering Passive Mode"
+            + f" (127,0,0,1,{port >> 8},{port & 0xFF})"
+        )
+
+    def ftp_EPSV(self, argument):
+        port = self.open_data_server()
+        self.reply(f"229 Entering Extended Passive Mode (|||{port}|)")
+
+    def ftp_REST(self, argument):
+        self.rest = int(argument)
+        self.reply(f"350 Restarting at {self.rest}")
+
+    def ftp_SIZE(self, argument):
+        _, local_path = self.local_path(argument)
+        if not os.path.isfile(local_path):
+            self.reply(f"550 {argument}: No such file")
+            return
+        self.reply(f"213 {os.path.getsize(local_path)}")
+
+    def ftp_MDTM(self, argument):
+        _, local_path = self.local_path(argument)
+        if not os.path.isfile(local_path):
+            self.reply(f"550 {argument}: No such file")
+            return
+        self.reply(f"213 {format_mtime(local_path)}")
+
+    def ftp_RETR(self, argument):
+        _, local_path = self.local_path(argument)
+        rest, self.rest = self.rest, 0
+        if not os.path.isfile(local_path):
+            self.reply(f"550 {argument}: No such file")
+            return
+        with open(local_path, "rb") as local_file:
+            self.send_data(lambda conn: conn.sendfile(local_file, rest))
+
+    def ftp_LIST(self, argument):
+        self.send_listing(lambda name, path: (
+            f"-r--r--r--   1 ftp      anonymous {os.path.getsize(path):>12}"
+            + f" Jan 01  2024 {name}"
+        ))
+
+    def ftp_NLST(self, argument):
+        self.send_listing(lambda name, path: name)
+
+    def ftp_MLSD(self, argument):
+        self.send_listing(lambda name, path: (
+            f"type=file;size={os.path.getsize(path)};"
+            + f"modify={format_mtime(path)}; {name}"
+        ))
+
+    def open_data_server(self):
+        """Listen for a passive mode data connection"""
+        if self.data_server is not None:
+            self.data_server.close()
+        self.data_server = socket.create_server(("127.0.0.1", 0))
+        return self.data_server.getsockname()[1]
+
+    def send_data(self, send):
+        """Send data over the passive mode data connection"""
+        if self.data_server is None:
+            self.reply("425 Use PASV first")
+            return
+        self.reply("150 Opening BINARY mode data connection")
+        conn, _ = self.data_server.accept()
+        self.data_server.close()
+        self.data_server = None
+        try:
+            with conn:
+                send(conn)
+        except OSError:
+            # client closed data connection before end of transfer
+            self.reply("426 Connection closed; transfer aborted")
+            return
+        self.reply("226 Transfer complete")
+
+    def send_listing(self, format_line):
+        """Send one line per file in the current directory"""
+        _, local_path = self.local_path(".")
+        lines = "".join(
+            f"{format_line(name, os.path.join(local_path, name))}\r\n"
+            for name in sorted(os.listdir(local_path))
+            if os.path.isfile(os.path.join(local_path, name))
+        )
+        self.send_data(lambda conn: conn.sendall(lines.encode()))
+
+
+class LocalFTPServer(socketserver.ThreadingTCPServer):
+    """Threaded FTP server on loopback serving files from root
+
+    Args:
+        root (str): directory to serve
+        latency (float, optional): seconds to wait before answering each
+            command, to simulate round trips to a remote server
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, root, latency=0.0):
+        super().__init__(("127.0.0.1", 0), FTPHandler)
+        self.root = root
+        self.latency = latency
+
+    @property
+    def base_link(self):
+        """Link to server in the format used for CLINVAR_BASE_LINK"""
+        return f"https://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        """Serve in a background thread"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def format_mtime(path):
+    """Format file modification time as an FTP timestamp"""
+    return time.strftime("%Y%m%d%H%M%S", time.gmtime(os.path.getmtime(path)))
+
+
+def serve_in_process(root, latency, address_queue):
+    """Run server until killed, sending its base link to address_queue.
+    Used as a multiprocessing target so the server does not share the
+    benchmarked process's CPU or memory"""
+    server = LocalFTPServer(root, latency)
+    address_queue.put(server.base_link)
+    server.serve_forever()
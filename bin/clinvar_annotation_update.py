@@ -4,75 +4,593 @@ Runs Phoenix ClinVar annotation resource update
 
 from __future__ import annotations
 import argparse
+import datetime
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
 
-from utils.util import is_date_within_n_weeks
+from utils.util import (
+    is_date_within_n_weeks, upload_file_DNAnexus, DEFAULT_BLOCK_SIZE
+)
+from utils.ftp_pool import FTP_POOL
+from utils.hashing import hash_file, hash_files
+from utils.lookup_index import build_lookup_index_DNAnexus
+from utils.profiling import StageProfiler
+from utils.telemetry import METRICS
+from utils.release_catalogue import ReleaseCatalogue
+from utils.release_diff import diff_releases_DNAnexus
+from utils.run_manifest import RunManifest
+from vep_config_update import update_vep_config
 from clinvar_file_fetcher import (
     connect_to_website, get_most_recent_clivar_file_info,
-    download_clinvar_dnanexus
+    get_clinvar_releases_in_window, download_clinvar_dnanexus,
+    list_clinvar_directories, select_most_recent_clinvar_files,
+    select_clinvar_mirror, fetch_clinvar_checksums,
+    prefetch_clinvar_checksums
 )
 
+# JSON lines file of per-stage metrics uploaded to each update folder
+RUN_METRICS_FILE = "phoenix_run_metrics.jsonl"
+# maximum number of releases per target updated at once when backfilling
+MAX_BACKFILL_RELEASES = 4
+# local directory profiling reports are written to, and the subfolder of
+# each update folder they are uploaded to
+PROFILE_FOLDER = "phoenix_profile"
+
+
+class UpdateConfig(NamedTuple):
+    """Settings read from the config file by load_config
+
+    Attributes:
+        clinvar_base_links (list[str]): base ftp links of equivalent mirrors
+            to download clinvar files from, from CLINVAR_BASE_LINK as a
+            single link or a list of links
+        clinvar_targets (dict[str, str]): genome build of each target
+            mapped to the link path to download its clinvar files, from
+            CLINVAR_TARGETS, or CLINVAR_LINK_PATH_B38 in older config files
+        clinvar_weeks_ago (int): check clinvar file fetched is less than n
+            weeks old
+        update_project_id (str): DNAnexus project ID for the project update
+            files are stored in
+        download_segments (int): number of parallel connections to download
+            the clinvar vcf over, from optional key CLINVAR_DOWNLOAD_SEGMENTS
+        block_size (int): bytes requested per read during download, from
+            optional key CLINVAR_DOWNLOAD_BLOCK_SIZE
+        stream_upload (bool): stream files straight into DNAnexus without
+            writing them to local disk, from optional key
+            CLINVAR_STREAM_UPLOAD
+        catalogue_path (str | None): path to persisted release catalogue,
+            from optional key CLINVAR_CATALOGUE_PATH
+        production_files (dict[str, str]): genome build mapped to DNAnexus
+            file ID of the ClinVar VCF in production, from optional target
+            key PRODUCTION_CLINVAR_FILE, for targets that set it
+        vep_config_files (dict[str, str]): genome build mapped to DNAnexus
+            file ID of the VEP config to update with the new release, from
+            optional target key VEP_CONFIG_FILE, for targets that set it
+    """
+    clinvar_base_links: list[str]
+    clinvar_targets: dict[str, str]
+    clinvar_weeks_ago: int
+    update_project_id: str
+    download_segments: int
+    block_size: int
+    stream_upload: bool
+    catalogue_path: str | None
+    production_files: dict[str, str]
+    vep_config_files: dict[str, str]
 
-def main(config_path) -> None:
-    """Run annotation update for b38 clinvar annotation resource file
+
+def main(
+    config_path, target=None, backfill_start=None, backfill_end=None,
+    profile=False
+) -> None:
+    """Run annotation update for clinvar annotation resource files. Each
+    target build in the config is updated in parallel, into its own update
+    folder, and the run's metrics are uploaded to each update folder.
+
+    If a backfill window is given, every release in the window is updated
+    instead of only the most recent, each into its own update folder.
+
+    If the config lists several mirrors, the fastest mirror holding the
+    newest release is selected before any transfer.
+
+    If profile is set, each stage is profiled with cProfile and tracemalloc
+    and the reports are uploaded to each update folder
 
     Args:
         config_path (str): Path to config file
+        target (str, optional): Build of single target in config file to
+            update. Defaults to None, which updates all targets
+        backfill_start (datetime.date, optional): earliest release date to
+            backfill. Defaults to None, which only updates the most recent
+            release unless backfill_end is given
+        backfill_end (datetime.date, optional): latest release date to
+            backfill. Defaults to None, which backfills up to today if
+            backfill_start is given
+        profile (bool, optional): profile CPU and memory use of each stage.
+            Defaults to False.
 
     Raises:
-        RuntimeError: Most recent clinvar file is over 8 weeks old
+        RuntimeError: Target is not in config file
     """
     # load config file
-    (
-        clinvar_base_link, clinvar_link_path, clinvar_weeks_ago,
-        update_project_id
-    ) = load_config(config_path)
-    ftp = connect_to_website(clinvar_base_link, clinvar_link_path)
-    (
-        recent_vcf_file, recent_tbi_file, clinvar_version_date,
-        clinvar_version, clinvar_checksum_file
-    ) = get_most_recent_clivar_file_info(ftp)
+    config = load_config(config_path)
+    clinvar_targets = config.clinvar_targets
+    update_project_id = config.update_project_id
+    if target is not None:
+        if target not in clinvar_targets:
+            raise RuntimeError(f"Target {target} not found in config file")
+        clinvar_targets = {target: clinvar_targets[target]}
+    backfill = backfill_start is not None or backfill_end is not None
+    if backfill:
+        backfill_end = backfill_end or datetime.date.today()
+        # default to the window releases must be published in for a
+        # normal run
+        backfill_start = backfill_start or (
+            backfill_end - datetime.timedelta(weeks=config.clinvar_weeks_ago)
+        )
+    # count DNAnexus API calls made during the run
+    with METRICS.count_dx_api_calls():
+        profiler = StageProfiler(PROFILE_FOLDER) if profile else None
+        if profiler is not None:
+            profiler.start()
+            METRICS.profiler = profiler
+
+        # allow a session per download segment alongside the index download
+        # for every target. Backfilled releases queue for these sessions
+        # rather than opening more connections to the host
+        FTP_POOL.max_sessions_per_host = max(
+            FTP_POOL.max_sessions_per_host,
+            (config.download_segments + 1) * len(clinvar_targets)
+        )
+        # every target is published on the same mirrors, so one mirror
+        # holding every target's newest release is selected for the run
+        clinvar_base_link = select_clinvar_mirror(
+            config.clinvar_base_links, list(clinvar_targets.values())
+        )
+        # without a catalogue every target's directory is listed, so list
+        # them all at once rather than one connection and listing per target
+        listings = {}
+        if config.catalogue_path is None:
+            with METRICS.stage("listing", targets=len(clinvar_targets)):
+                listings = list_clinvar_directories(
+                    clinvar_base_link, list(clinvar_targets.values())
+                )
+        # checksums of every target's newest release are fetched together,
+        # backfills fetch the checksums of their releases themselves
+        checksums = {} if backfill else prefetch_clinvar_checksums(
+            clinvar_base_link, listings
+        )
+        with ThreadPoolExecutor(max_workers=len(clinvar_targets)) as executor:
+            if backfill:
+                futures = [
+                    executor.submit(
+                        backfill_clinvar_target, build, clinvar_base_link,
+                        clinvar_link_path, backfill_start, backfill_end,
+                        update_project_id, config.download_segments,
+                        config.block_size, config.stream_upload,
+                        get_target_catalogue_path(
+                            config.catalogue_path, build
+                        ),
+                        listing=listings.get(clinvar_link_path)
+                    )
+                    for build, clinvar_link_path in clinvar_targets.items()
+                ]
+                update_folders = [
+                    folder for future in futures for folder in future.result()
+                ]
+            else:
+                futures = [
+                    executor.submit(
+                        update_clinvar_target, build, clinvar_base_link,
+                        clinvar_link_path, config.clinvar_weeks_ago,
+                        update_project_id, config.download_segments,
+                        config.block_size, config.stream_upload,
+                        get_target_catalogue_path(
+                            config.catalogue_path, build
+                        ),
+                        config.production_files.get(build),
+                        config.vep_config_files.get(build),
+                        listings.get(clinvar_link_path), checksums
+                    )
+                    for build, clinvar_link_path in clinvar_targets.items()
+                ]
+                update_folders = [future.result() for future in futures]
+        update_folders = [
+            folder for folder in update_folders if folder is not None
+        ]
+
+        if profiler is not None:
+            # stop profiling first, so uploading reports is not profiled
+            METRICS.profiler = None
+            profiler.stop()
+            upload_profile_reports(
+                update_project_id, update_folders, profiler.reports
+            )
+        upload_run_metrics(update_project_id, update_folders)
+
+
+def update_clinvar_target(
+    build, clinvar_base_link, clinvar_link_path, clinvar_weeks_ago,
+    update_project_id, download_segments=1, block_size=DEFAULT_BLOCK_SIZE,
+    stream_upload=False, catalogue_path=None, production_file_id=None,
+    vep_config_file_id=None, listing=None, checksums=None
+) -> str | None:
+    """Run annotation update for one build's most recent clinvar annotation
+    resource
+
+    Args:
+        build (str): Genome build of target, e.g. GRCh38
+        clinvar_base_link (str): base ftp link to download clinvar files
+        clinvar_link_path (str): link path to download the target's
+            clinvar files
+        clinvar_weeks_ago (int): check clinvar file fetched is less than n
+            weeks old
+        update_project_id (str): DNAnexus project ID for update project
+        download_segments (int, optional): number of parallel connections
+            to download the VCF over. Defaults to 1.
+        block_size (int, optional): bytes requested from the data
+            connection per read. Defaults to 1 MiB.
+        stream_upload (bool, optional): stream files straight into
+            DNAnexus. Defaults to False.
+        catalogue_path (str, optional): path to persisted release catalogue
+            for target. Defaults to None.
+        production_file_id (str, optional): DNAnexus file ID of ClinVar VCF
+            currently in production, to report changes in the new release
+            against. Defaults to None.
+        vep_config_file_id (str, optional): DNAnexus file ID of VEP config
+            to write a new version of using the new release. Defaults to
+            None.
+        listing (list[tuple[str, dict]], optional): listing of the target's
+            directory from list_clinvar_directories, used instead of
+            connecting to list it. Defaults to None.
+        checksums (dict[str, bytes], optional): checksum files already
+            fetched by prefetch_clinvar_checksums, by path. Defaults to
+            None, which downloads the checksum with the VCF.
+
+    Raises:
+        RuntimeError: Most recent clinvar file is over n weeks old
+
+    Returns:
+        str | None: DNAnexus path to update folder, or None if the most
+            recent version has already been processed
+    """
+    if catalogue_path is not None:
+        catalogue = ReleaseCatalogue.load(catalogue_path)
+    else:
+        catalogue = None
+    if listing is not None:
+        release = select_most_recent_clinvar_files(
+            [name for name, _ in listing]
+        )
+    else:
+        with METRICS.stage("connect", build=build):
+            ftp = connect_to_website(clinvar_base_link, clinvar_link_path)
+        with METRICS.stage("listing", build=build):
+            release = get_most_recent_clivar_file_info(ftp, catalogue)
+        # return listing session to pool so it is reused for downloads
+        FTP_POOL.release(ftp)
+    if catalogue is not None:
+        catalogue.save()
+    clinvar_version_date, clinvar_version = release[2:4]
 
     # check date of most recent clinvar file is within n weeks
     if not is_date_within_n_weeks(clinvar_version_date, clinvar_weeks_ago):
         raise RuntimeError(
-            "Most recent clinvar file availble for download is from over"
-            + f" {clinvar_weeks_ago} weeks ago"
+            f"Most recent {build} clinvar file availble for download is from"
+            + f" over {clinvar_weeks_ago} weeks ago. Releases from an"
+            + " earlier window can be fetched with --backfill_start"
+        )
+
+    if catalogue is not None and catalogue.last_processed == clinvar_version:
+        print(
+            f"{build} ClinVar version {clinvar_version} has already been"
+            + " processed, no update needed"
+        )
+        return None
+
+    update_folder_name = update_clinvar_release(
+        build, clinvar_base_link, clinvar_link_path, update_project_id,
+        release, download_segments, block_size, stream_upload,
+        production_file_id, vep_config_file_id,
+        (checksums or {}).get(f"{clinvar_link_path}{release[4]}")
+    )
+    if catalogue is not None:
+        catalogue.last_processed = clinvar_version
+        catalogue.save()
+    return update_folder_name
+
+
+def backfill_clinvar_target(
+    build, clinvar_base_link, clinvar_link_path, start_date, end_date,
+    update_project_id, download_segments=1, block_size=DEFAULT_BLOCK_SIZE,
+    stream_upload=False, catalogue_path=None,
+    max_releases=MAX_BACKFILL_RELEASES, listing=None
+) -> list[str]:
+    """Run annotation update for every one of a build's clinvar releases in
+    a date window. Releases are updated concurrently, at most max_releases
+    at once, and each release's run manifest means releases already updated
+    are skipped. Releases share FTP_POOL sessions, so their transfers queue
+    within the pool's per-host cap while other steps run in parallel
+
+    Args:
+        build (str): Genome build of target, e.g. GRCh38
+        clinvar_base_link (str): base ftp link to download clinvar files
+        clinvar_link_path (str): link path to download the target's
+            clinvar files
+        start_date (datetime.date): earliest release date to update
+        end_date (datetime.date): latest release date to update
+        update_project_id (str): DNAnexus project ID for update project
+        download_segments (int, optional): number of parallel connections
+            to download each VCF over. Defaults to 1.
+        block_size (int, optional): bytes requested from the data
+            connection per read. Defaults to 1 MiB.
+        stream_upload (bool, optional): stream files straight into
+            DNAnexus. Defaults to False.
+        catalogue_path (str, optional): path to persisted release catalogue
+            for target. Defaults to None.
+        max_releases (int, optional): maximum number of releases updated at
+            once. Defaults to MAX_BACKFILL_RELEASES.
+        listing (list[tuple[str, dict]], optional): listing of the target's
+            directory from list_clinvar_directories, used instead of
+            connecting to list it. Defaults to None.
+
+    Raises:
+        RuntimeError: No clinvar release in window
+
+    Returns:
+        list[str]: DNAnexus paths to update folders of releases updated by
+            this run, oldest release first
+    """
+    if catalogue_path is not None:
+        catalogue = ReleaseCatalogue.load(catalogue_path)
+    else:
+        catalogue = None
+    ftp = None
+    if listing is None:
+        with METRICS.stage("connect", build=build):
+            ftp = connect_to_website(clinvar_base_link, clinvar_link_path)
+    with METRICS.stage("listing", build=build):
+        releases = get_clinvar_releases_in_window(
+            ftp, start_date, end_date, catalogue, listing
         )
+    if ftp is not None:
+        FTP_POOL.release(ftp)
+    if catalogue is not None:
+        catalogue.save()
+    print(
+        f"Backfilling {len(releases)} {build} ClinVar releases from"
+        + f" {start_date} to {end_date}"
+    )
+    # every release's checksum is fetched at once, rather than one at a
+    # time with each VCF
+    checksums = fetch_clinvar_checksums(
+        clinvar_base_link,
+        [f"{clinvar_link_path}{release[4]}" for release in releases]
+    )
+
+    with ThreadPoolExecutor(max_workers=max_releases) as executor:
+        futures = [
+            executor.submit(
+                update_clinvar_release, build, clinvar_base_link,
+                clinvar_link_path, update_project_id, release,
+                download_segments, block_size, stream_upload,
+                checksum_contents=checksums.get(
+                    f"{clinvar_link_path}{release[4]}"
+                )
+            )
+            for release in releases
+        ]
+        update_folders = [future.result() for future in futures]
+    return [folder for folder in update_folders if folder is not None]
+
+
+def update_clinvar_release(
+    build, clinvar_base_link, clinvar_link_path, update_project_id, release,
+    download_segments=1, block_size=DEFAULT_BLOCK_SIZE, stream_upload=False,
+    production_file_id=None, vep_config_file_id=None, checksum_contents=None
+) -> str | None:
+    """Download, verify and upload one clinvar release into its update
+    folder, with a lookup index built from the VCF. Progress is recorded in
+    a run manifest in the update folder, so a rerun after a failure skips
+    the steps already completed for the version
+
+    Args:
+        build (str): Genome build of target, e.g. GRCh38
+        clinvar_base_link (str): base ftp link to download clinvar files
+        clinvar_link_path (str): link path to download the target's
+            clinvar files
+        update_project_id (str): DNAnexus project ID for update project
+        release (tuple[str, str, datetime.date, str, str]): vcf file name,
+            index file name, release date, version and checksum file name
+        download_segments (int, optional): number of parallel connections
+            to download the VCF over. Defaults to 1.
+        block_size (int, optional): bytes requested from the data
+            connection per read. Defaults to 1 MiB.
+        stream_upload (bool, optional): stream files straight into
+            DNAnexus. Defaults to False.
+        production_file_id (str, optional): DNAnexus file ID of ClinVar VCF
+            currently in production, to report changes in the release
+            against. Defaults to None.
+        vep_config_file_id (str, optional): DNAnexus file ID of VEP config
+            to write a new version of using the release. Defaults to None.
+        checksum_contents (bytes, optional): contents of the release's
+            checksum file, if already fetched. Defaults to None.
 
+    Returns:
+        str | None: DNAnexus path to update folder, or None if an earlier
+            run already completed the update
+    """
+    (
+        recent_vcf_file, recent_tbi_file, clinvar_version_date,
+        clinvar_version, clinvar_checksum_file
+    ) = release
     # generate name of annotation update folder for DNAnexus update project
     update_folder_name = (
-        f"/clinvar_version_{clinvar_version}_annotation_resource_update"
+        f"/clinvar_version_{clinvar_version}_{build}"
+        + "_annotation_resource_update"
     )
+    manifest = RunManifest.load(update_project_id, update_folder_name)
+    if manifest.completed:
+        print(
+            f"{build} ClinVar version {clinvar_version} was updated by an"
+            + f" earlier run in {update_folder_name}, no update needed"
+        )
+        return None
+    manifest.set("listed", {
+        "version": clinvar_version,
+        "version_date": clinvar_version_date.isoformat(),
+        "vcf": recent_vcf_file,
+        "tbi": recent_tbi_file,
+        "checksum": clinvar_checksum_file,
+    })
 
     # download clinvar files to DNAnexus
     dev_clinvar_id, dev_index_id = download_clinvar_dnanexus(
         clinvar_base_link, clinvar_link_path, update_project_id,
         update_folder_name, recent_vcf_file, clinvar_checksum_file,
-        recent_tbi_file
+        recent_tbi_file, download_segments, block_size, stream_upload, build,
+        manifest, checksum_contents
     )
+    prefix = f"clinvar_{clinvar_version}_{build}"
+    # the VCF is read from local disk if it was downloaded there, instead of
+    # streaming it back from DNAnexus
+    vcf_path = manifest.local_path(f"{prefix}.vcf.gz")
+    lookup_index_id = manifest.get("lookup_index")
+    if lookup_index_id is None:
+        lookup_index_id = build_lookup_index_DNAnexus(
+            dev_clinvar_id, update_project_id, update_folder_name, prefix,
+            vcf_path
+        )
+        manifest.set("lookup_index", lookup_index_id)
+    diff_summary = manifest.get("diff")
+    if production_file_id is not None and diff_summary is None:
+        diff_summary = diff_releases_DNAnexus(
+            production_file_id, dev_clinvar_id, update_project_id,
+            update_folder_name, prefix, vcf_path
+        )
+        manifest.set("diff", diff_summary)
+    if diff_summary is not None:
+        print(
+            f"{build} changes since production clinvar file:"
+            + f" {diff_summary['added']} added,"
+            + f" {diff_summary['removed']} removed,"
+            + f" {diff_summary['reclassified']} reclassified"
+        )
+    if vep_config_file_id is not None and manifest.get("vep_config") is None:
+        manifest.set("vep_config", update_vep_config(
+            vep_config_file_id, dev_clinvar_id, dev_index_id,
+            update_project_id, update_folder_name
+        ))
+    manifest.set("completed", True)
 
-    print(f"Most recent clinvar annotation resource file: {recent_vcf_file}")
-    print(f"Most recent clinvar file index: {recent_tbi_file}")
-    print(f"Date of most recent clinvar file version: {clinvar_version_date}")
-    print(f"Most recent clinvar file version: {clinvar_version}")
-    print(f"DNAnexus file ID of development clinvar file: {dev_clinvar_id}")
-    print(f"DNAnexus file ID of development index file: {dev_index_id}")
+    print(f"{build} clinvar annotation resource file: {recent_vcf_file}")
+    print(f"{build} clinvar file index: {recent_tbi_file}")
+    print(f"{build} date of clinvar file version: {clinvar_version_date}")
+    print(f"{build} clinvar file version: {clinvar_version}")
+    print(
+        f"{build} DNAnexus file ID of development clinvar file:"
+        + f" {dev_clinvar_id}"
+    )
+    print(
+        f"{build} DNAnexus file ID of development index file:"
+        + f" {dev_index_id}"
+    )
+    print(
+        f"{build} DNAnexus file ID of clinvar lookup index:"
+        + f" {lookup_index_id}"
+    )
+    return update_folder_name
 
 
-def load_config(config_path) -> tuple[str, str, str, str]:
+def upload_run_metrics(update_project_id, update_folders) -> None:
+    """Write metrics recorded for the run and upload them to each update
+    folder, next to the files they describe
+
+    Args:
+        update_project_id (str): DNAnexus project ID for update project
+        update_folders (list[str]): DNAnexus paths to update folders
+    """
+    if not update_folders:
+        return
+    metrics_path = METRICS.write(RUN_METRICS_FILE)
+    checksums = hash_file(metrics_path)
+    for update_folder in update_folders:
+        upload_file_DNAnexus(
+            metrics_path, update_project_id, update_folder, checksums
+        )
+
+
+def upload_profile_reports(
+    update_project_id, update_folders, reports
+) -> None:
+    """Upload profiling reports of the run to a subfolder of each update
+    folder
+
+    Args:
+        update_project_id (str): DNAnexus project ID for update project
+        update_folders (list[str]): DNAnexus paths to update folders
+        reports (list[str]): paths to local report files
+    """
+    if not update_folders or not reports:
+        return
+    checksums = hash_files(reports)
+    for update_folder in update_folders:
+        for report in reports:
+            upload_file_DNAnexus(
+                report, update_project_id,
+                f"{update_folder}/{PROFILE_FOLDER}", checksums[report]
+            )
+
+
+def get_target_catalogue_path(catalogue_path, build) -> str | None:
+    """Generates path to release catalogue for a target build, so each
+    build's catalogue is kept separate
+
+    Args:
+        catalogue_path (str | None): catalogue path from config file
+        build (str): Genome build of target
+
+    Returns:
+        str | None: path to target's catalogue, or None if catalogue_path
+            is None
+    """
+    if catalogue_path is None:
+        return None
+    root, extension = os.path.splitext(catalogue_path)
+    return f"{root}_{build}{extension}"
+
+
+def parse_release_date(date) -> datetime.date:
+    """Parses a release date given on the command line
+
+    Args:
+        date (str): date in format YYYYMMDD
+
+    Raises:
+        argparse.ArgumentTypeError: date is not in format YYYYMMDD
+
+    Returns:
+        datetime.date: parsed date
+    """
+    try:
+        return datetime.datetime.strptime(date, "%Y%m%d").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"{date} is not a date in format YYYYMMDD"
+        )
+
+
+def load_config(config_path) -> UpdateConfig:
     """Opens config file in json format and reads contents
 
     Args:
         config_path (str): Path to config file
 
     Returns:
-        clinvar_base_link (str): base ftp link to download clinvar files
-        clinvar_link_path (str): link path to download clinvar files
-        clinvar_weeks_ago (str): check clinvar file fetched is less than n
-            weeks old
-        update_project_id (str): DNAnexus project ID for the project update
-            files are stored in
+        UpdateConfig: settings read from config file, with defaults for
+            optional keys
 
     Raises:
         RuntimeError: Config file does not contain expected keys
@@ -82,24 +600,66 @@ def load_config(config_path) -> tuple[str, str, str, str]:
         config = json.load(json_file)
     keys = [
         "CLINVAR_BASE_LINK",
-        "CLINVAR_LINK_PATH_B38",
         "CLINVAR_CHECK_NUM_WEEKS_AGO",
         "UPDATE_PROJECT_ID"
     ]
-    if not all(e in config for e in keys):
+    if not all(e in config for e in keys) or not (
+        "CLINVAR_TARGETS" in config or "CLINVAR_LINK_PATH_B38" in config
+    ):
         raise RuntimeError("Config file does not contain expected keys")
     try:
-        clinvar_base_link = config.get("CLINVAR_BASE_LINK")
-        clinvar_link_path = config.get("CLINVAR_LINK_PATH_B38")
+        clinvar_base_links = config.get("CLINVAR_BASE_LINK")
+        if isinstance(clinvar_base_links, str):
+            clinvar_base_links = [clinvar_base_links]
+        if not clinvar_base_links or not all(
+            isinstance(link, str) for link in clinvar_base_links
+        ):
+            raise TypeError("CLINVAR_BASE_LINK must be a link or list")
+        if "CLINVAR_TARGETS" in config:
+            clinvar_targets = {
+                target["BUILD"]: target["CLINVAR_LINK_PATH"]
+                for target in config.get("CLINVAR_TARGETS")
+            }
+            production_files = {
+                target["BUILD"]: target["PRODUCTION_CLINVAR_FILE"]
+                for target in config.get("CLINVAR_TARGETS")
+                if "PRODUCTION_CLINVAR_FILE" in target
+            }
+            vep_config_files = {
+                target["BUILD"]: target["VEP_CONFIG_FILE"]
+                for target in config.get("CLINVAR_TARGETS")
+                if "VEP_CONFIG_FILE" in target
+            }
+        else:
+            clinvar_targets = {
+                "GRCh38": config.get("CLINVAR_LINK_PATH_B38")
+            }
+            production_files = {}
+            vep_config_files = {}
         clinvar_weeks_ago = int(config.get("CLINVAR_CHECK_NUM_WEEKS_AGO"))
         update_project_id = config.get("UPDATE_PROJECT_ID")
-    except (TypeError, ValueError):
+        download_segments = int(config.get("CLINVAR_DOWNLOAD_SEGMENTS", 1))
+        block_size = int(
+            config.get("CLINVAR_DOWNLOAD_BLOCK_SIZE", DEFAULT_BLOCK_SIZE)
+        )
+        stream_upload = config.get("CLINVAR_STREAM_UPLOAD", False)
+        if not isinstance(stream_upload, bool):
+            raise TypeError("CLINVAR_STREAM_UPLOAD must be true or false")
+        catalogue_path = config.get("CLINVAR_CATALOGUE_PATH")
+    except (TypeError, ValueError, KeyError):
         raise RuntimeError(
             "Config file key values do not match expected value types"
         )
-    return (
-        clinvar_base_link, clinvar_link_path, clinvar_weeks_ago,
-        update_project_id
+    if not clinvar_targets:
+        raise RuntimeError("Config file does not contain any targets")
+    if download_segments < 1 or block_size < 1:
+        raise RuntimeError(
+            "Config file download segments and block size must be positive"
+        )
+    return UpdateConfig(
+        clinvar_base_links, clinvar_targets, clinvar_weeks_ago,
+        update_project_id, download_segments, block_size, stream_upload,
+        catalogue_path, production_files, vep_config_files
     )
 
 
@@ -107,7 +667,43 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     # Add arguments
     parser.add_argument('--config_file', type=str, required=True)
+    parser.add_argument(
+        '--target', type=str,
+        help="Build of single config target to update, e.g. GRCh38"
+    )
+    parser.add_argument(
+        '--list_targets', action='store_true',
+        help="Print build of each config target, one per line, and exit"
+    )
+    parser.add_argument(
+        '--backfill_start', type=parse_release_date,
+        help=(
+            "Update every release from this date, YYYYMMDD, instead of only"
+            + " the most recent"
+        )
+    )
+    parser.add_argument(
+        '--backfill_end', type=parse_release_date,
+        help=(
+            "Update every release up to this date, YYYYMMDD. Without"
+            + " --backfill_start, releases from CLINVAR_CHECK_NUM_WEEKS_AGO"
+            + " weeks before are updated"
+        )
+    )
+    parser.add_argument(
+        '--profile', action='store_true',
+        help=(
+            "Profile CPU and memory use of each stage and upload the"
+            + f" reports to {PROFILE_FOLDER} in each update folder"
+        )
+    )
     # Parse arguments
     args = parser.parse_args()
 
-    main(args.config_file)
+    if args.list_targets:
+        print("\n".join(load_config(args.config_file).clinvar_targets))
+    else:
+        main(
+            args.config_file, args.target, args.backfill_start,
+            args.backfill_end, args.profile
+        )
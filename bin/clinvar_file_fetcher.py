@@ -3,17 +3,28 @@ Get most recent weekly release of ClinVar files
 """
 
 from __future__ import annotations
-import time
 from ftplib import FTP
 import re
-from ftplib import error_perm
+import time
+from ftplib import all_errors, error_perm, error_reply, error_temp
 from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlparse
 
-from utils.util import download_file_upload_DNAnexus
+from utils.util import download_file_upload_DNAnexus, DEFAULT_BLOCK_SIZE
+from utils.async_ftp import fetch_ftp_files, list_ftp_directories
+from utils.ftp_pool import FTP_POOL
+from utils.mirrors import FTP_MIRRORS, measure_read_throughput
+from utils.telemetry import METRICS
+from utils.release_catalogue import ReleaseCatalogue
+
+# maximum number of files downloaded and uploaded at once
+MAX_TRANSFER_WORKERS = 3
 
 
 def connect_to_website(base_link, path) -> FTP:
-    """Generates a FTP object to enable file download from website
+    """Gets a pooled FTP session to enable file download from website.
+    Release the session back to FTP_POOL once finished with it
 
     Args:
         base_link (str): Link used to download clivar files
@@ -38,12 +49,10 @@ def connect_to_website(base_link, path) -> FTP:
     else:
         trimmed_link = result.group(2)
 
-    # safety feature to prevent too many requests to server
-    time.sleep(0.5)
+    # new connections are rate limited by FTP_POOL to avoid overloading
+    # the server
     try:
-        ftp = FTP(trimmed_link)
-        ftp.login()
-        ftp.cwd(path)
+        ftp = FTP_POOL.acquire(trimmed_link, path)
     except OSError:
         raise RuntimeError("Error: cannot connect to website")
     except error_perm:
@@ -52,13 +61,278 @@ def connect_to_website(base_link, path) -> FTP:
     return ftp
 
 
-def get_most_recent_clivar_file_info(ftp) -> tuple[
+def select_clinvar_mirror(clinvar_base_links, clinvar_link_paths) -> str:
+    """Selects the fastest mirror holding the newest clinvar release of
+    every target. Each mirror is probed at once with a timed listing of
+    every target's directory and a short timed read of the newest VCF in
+    the first, and the mirror with the highest throughput of those holding
+    the newest release in every directory is selected. Mirrors holding
+    every newest release are registered with FTP_MIRRORS, fastest first,
+    so transfers that stall on the selected mirror fail over to the next
+
+    Args:
+        clinvar_base_links (list[str]): Links of equivalent mirrors used to
+            download clinvar files
+        clinvar_link_paths (list[str]): Path of each target's directory
+            appended to each link in format path/to/dir
+
+    Raises:
+        RuntimeError: No mirror could be probed for the newest releases
+
+    Returns:
+        str: Link of selected mirror
+    """
+    if len(clinvar_base_links) == 1:
+        FTP_MIRRORS.set_mirrors(clinvar_base_links)
+        return clinvar_base_links[0]
+
+    with METRICS.stage(
+        "mirror_select", mirrors=len(clinvar_base_links)
+    ) as stage, ThreadPoolExecutor(
+        max_workers=len(clinvar_base_links)
+    ) as executor:
+        probes = list(executor.map(
+            lambda base_link: probe_clinvar_mirror(
+                base_link, clinvar_link_paths
+            ),
+            clinvar_base_links
+        ))
+        newest_versions = {
+            link_path: max(
+                (
+                    probe["versions"][link_path] for probe in probes
+                    if probe["versions"].get(link_path)
+                ),
+                default=None
+            )
+            for link_path in clinvar_link_paths
+        }
+        candidates = sorted(
+            (
+                probe for probe in probes
+                if probe["throughput"] is not None
+                and get_stale_directories(probe, newest_versions) == []
+            ),
+            key=lambda probe: probe["throughput"], reverse=True
+        )
+        if not candidates:
+            raise RuntimeError(
+                "No ClinVar mirror could be probed for the newest releases: "
+                + "; ".join(
+                    f"{probe['base_link']} ({probe['error']})"
+                    for probe in probes
+                )
+            )
+        stage["selected"] = candidates[0]["base_link"]
+        stage["versions"] = newest_versions
+
+    FTP_MIRRORS.set_mirrors([probe["base_link"] for probe in candidates])
+    for probe in probes:
+        if probe not in candidates:
+            print(
+                f"Mirror {probe['base_link']} not used: "
+                + (probe["error"] or "; ".join(
+                    f"newest release in {link_path} is {version}"
+                    for link_path, version in get_stale_directories(
+                        probe, newest_versions
+                    )
+                ))
+            )
+    print(
+        f"Selected mirror {candidates[0]['base_link']} for ClinVar releases"
+        + f" {', '.join(sorted(set(newest_versions.values())))} at"
+        + f" {candidates[0]['throughput'] / 1024 / 1024:.1f} MB/s, listing"
+        + f" in {candidates[0]['listing_seconds']:.2f}s"
+    )
+    return candidates[0]["base_link"]
+
+
+def get_stale_directories(probe, newest_versions) -> list[tuple[str, str]]:
+    """Gets directories in which a probed mirror does not hold the newest
+    release found on any mirror
+
+    Args:
+        probe (dict): probe result from probe_clinvar_mirror
+        newest_versions (dict[str, str]): each directory mapped to the
+            newest release version found in it on any mirror
+
+    Returns:
+        list[tuple[str, str]]: path and newest version on the mirror, or
+            None if it could not be listed, of each stale directory
+    """
+    return [
+        (link_path, probe["versions"].get(link_path))
+        for link_path, version in newest_versions.items()
+        if probe["versions"].get(link_path) != version
+    ]
+
+
+def probe_clinvar_mirror(clinvar_base_link, clinvar_link_paths) -> dict:
+    """Times a listing of each of a mirror's clinvar directories and a
+    short read of the newest VCF in the first
+
+    Args:
+        clinvar_base_link (str): Link of mirror used to download clinvar
+            files
+        clinvar_link_paths (list[str]): Paths appended to link in format
+            path/to/dir
+
+    Returns:
+        dict: mirror base_link, newest release version in each directory
+            listed as versions, total listing_seconds, throughput in bytes
+            per second and error, with values left None for steps that
+            could not be completed
+    """
+    probe = {
+        "base_link": clinvar_base_link, "versions": {},
+        "listing_seconds": None, "throughput": None, "error": None,
+    }
+    with METRICS.stage("mirror_probe", mirror=clinvar_base_link) as stage:
+        try:
+            listing_seconds = 0
+            for link_path in clinvar_link_paths:
+                ftp = connect_to_website(clinvar_base_link, link_path)
+                start = time.perf_counter()
+                try:
+                    release = get_most_recent_clivar_file_info(ftp)
+                except BaseException:
+                    FTP_POOL.discard(ftp)
+                    raise
+                listing_seconds += time.perf_counter() - start
+                FTP_POOL.release(ftp)
+                probe["versions"][link_path] = release[3]
+                if link_path == clinvar_link_paths[0]:
+                    probe_vcf = release[0]
+            probe["listing_seconds"] = listing_seconds
+
+            parsed_link = urlparse(
+                f"{clinvar_base_link}{clinvar_link_paths[0]}"
+            )
+            probe["throughput"] = measure_read_throughput(
+                parsed_link.netloc, parsed_link.path, probe_vcf
+            )
+        except (RuntimeError,) + all_errors as err:
+            probe["error"] = str(err) or type(err).__name__
+            stage["error"] = type(err).__name__
+        stage.update({
+            key: probe[key]
+            for key in ("versions", "listing_seconds", "throughput")
+            if probe[key] is not None
+        })
+    return probe
+
+
+def list_clinvar_directories(clinvar_base_link, link_paths) -> dict[
+    str, list[tuple[str, dict]]
+]:
+    """Lists several clinvar release directories at once over asyncio FTP
+    connections, so listing every target costs about one round trip
+    instead of one per target
+
+    Args:
+        clinvar_base_link (str): Link used to download clivar files
+        link_paths (list[str]): Paths appended to link in format
+            path/to/dir
+
+    Raises:
+        RuntimeError: Cannot connect to website or list a directory
+
+    Returns:
+        dict[str, list[tuple[str, dict]]]: each path mapped to the name and
+            MLSD facts of each file in its directory
+    """
+    links = {
+        path: clinvar_base_link.rstrip("/") + "/" + path.lstrip("/")
+        for path in link_paths
+    }
+    try:
+        listings = list_ftp_directories(list(links.values()))
+    except (OSError, EOFError, error_reply, error_perm, error_temp) as err:
+        raise RuntimeError(
+            f"Error: cannot list directories {', '.join(link_paths)}: {err}"
+        )
+    return {
+        path: [
+            (name, facts) for name, facts in listings[link]
+            if facts.get("type", "file") == "file"
+        ]
+        for path, link in links.items()
+    }
+
+
+def fetch_clinvar_checksums(clinvar_base_link, checksum_paths) -> dict[
+    str, bytes
+]:
+    """Fetches several clinvar checksum files at once over asyncio FTP
+    connections, so the checksums of every release being updated cost about
+    one round trip instead of a connection and transfer each
+
+    Args:
+        clinvar_base_link (str): Link used to download clivar files
+        checksum_paths (list[str]): Paths of checksum files appended to
+            link in format path/to/file.md5
+
+    Returns:
+        dict[str, bytes]: each path mapped to the checksum file contents,
+            or an empty dict if they could not be fetched, in which case
+            each checksum is downloaded with its file instead
+    """
+    if not checksum_paths:
+        return {}
+    links = {
+        path: clinvar_base_link.rstrip("/") + "/" + path.lstrip("/")
+        for path in checksum_paths
+    }
+    try:
+        contents = fetch_ftp_files(list(links.values()))
+    except (OSError, EOFError, error_reply, error_perm, error_temp) as err:
+        print(
+            f"Could not fetch checksums {', '.join(checksum_paths)} at once"
+            + f" ({err}), downloading each with its file"
+        )
+        return {}
+    return {path: contents[link] for path, link in links.items()}
+
+
+def prefetch_clinvar_checksums(clinvar_base_link, listings) -> dict[
+    str, bytes
+]:
+    """Fetches the checksum of the most recent release in each listed
+    directory at once
+
+    Args:
+        clinvar_base_link (str): Link used to download clivar files
+        listings (dict[str, list[tuple[str, dict]]]): listing of each
+            directory from list_clinvar_directories
+
+    Returns:
+        dict[str, bytes]: path of each checksum file, in format
+            path/to/file.md5, mapped to its contents
+    """
+    checksum_paths = []
+    for link_path, listing in listings.items():
+        try:
+            release = select_most_recent_clinvar_files(
+                [name for name, _ in listing]
+            )
+        except RuntimeError:
+            # raised again when the directory's target is updated
+            continue
+        checksum_paths.append(f"{link_path}{release[4]}")
+    return fetch_clinvar_checksums(clinvar_base_link, checksum_paths)
+
+
+def get_most_recent_clivar_file_info(ftp, catalogue=None) -> tuple[
     str, str, datetime.date, str
 ]:
     """Gets information on most recent clinvar files
 
     Args:
         ftp (FTP): FTP object to get clinvar files
+        catalogue (ReleaseCatalogue, optional): persisted release catalogue.
+            If provided, the catalogue is refreshed and its newest release
+            with index and checksum present is returned, without listing the
+            directory if nothing has changed since the last refresh
 
     Raises:
         RuntimeError: No clinvar vcf files found on ncbi website
@@ -70,23 +344,56 @@ def get_most_recent_clivar_file_info(ftp) -> tuple[
         most_recent_date (datetime.date): Most recent clinvar file date
         recent_vcf_version (Str): Most recent clinvar version format YYYYMMDD
     """
-    # for all file info strings returned by ftp, add names to file_info_list
+    if catalogue is not None:
+        catalogue.refresh(ftp)
+        release = catalogue.newest_complete_release()
+        if release is None:
+            raise RuntimeError(
+                "No ClinVar VCF files with matching index and checksum could"
+                + " be found on ncbi website"
+            )
+        return (
+            release["vcf"]["name"], release["tbi"]["name"],
+            datetime.strptime(release["version"], '%Y%m%d').date(),
+            release["version"], release["md5"]["name"]
+        )
+
+    # for all file info strings returned by ftp, add names to file_list
     file_info_list = []
-    file_list = []
     ftp.retrlines('LIST', file_info_list.append)
+    file_list = [
+        file_info.split()[-1] for file_info in file_info_list
+        if file_info.strip()
+    ]
+    return select_most_recent_clinvar_files(file_list)
+
+
+def select_most_recent_clinvar_files(file_list) -> tuple[
+    str, str, datetime.date, str, str
+]:
+    """Selects most recent clinvar files from names of files in a clinvar
+    release directory
+
+    Args:
+        file_list (list[str]): names of files in directory
+
+    Raises:
+        RuntimeError: No clinvar vcf files found on ncbi website
+        RuntimeError: No clinvar vcf index found on ncbi website
+        RuntimeError: No clinvar vcf checksum found on ncbi website
+
+    Returns:
+        recent_vcf_file (str): Most recent clinvar vcf filename found
+        recent_tbi_file (str): Index file name for most recent vcf found
+        most_recent_date (datetime.date): Most recent clinvar file date
+        recent_vcf_version (Str): Most recent clinvar version format YYYYMMDD
+        clinvar_checksum_file (str): Checksum file name for most recent vcf
+    """
     clinvar_gz_regex = re.compile(r"^clinvar_[0-9]+\.vcf\.gz$")
 
     most_recent_date = datetime.strptime("20100101", '%Y%m%d').date()
     clinvar_version = recent_vcf_file = None
 
-    for file_info in file_info_list:
-        # if file info is empty, ignore
-        if not file_info.strip():
-            continue
-        # get name portion of file information
-        file_name = file_info.split()[-1]
-        file_list.append(file_name)
-
     for file_name in file_list:
         # find most recent version of annotation resource
         if clinvar_gz_regex.match(file_name):
@@ -131,12 +438,68 @@ def get_most_recent_clivar_file_info(ftp) -> tuple[
     )
 
 
+def get_clinvar_releases_in_window(
+    ftp, start_date, end_date, catalogue=None, listing=None
+) -> list[tuple[str, str, datetime.date, str, str]]:
+    """Gets information on every clinvar release published in a date window
+    that has its index and checksum on the website
+
+    Args:
+        ftp (FTP): FTP object to get clinvar files
+        start_date (datetime.date): earliest release date to include
+        end_date (datetime.date): latest release date to include
+        catalogue (ReleaseCatalogue, optional): persisted release catalogue,
+            refreshed instead of listing the directory if nothing has
+            changed since the last refresh. Defaults to None.
+        listing (list[tuple[str, dict]], optional): directory listing
+            already fetched by list_clinvar_directories, used instead of
+            listing the directory with ftp. Defaults to None.
+
+    Raises:
+        RuntimeError: No clinvar vcf files in window found on ncbi website
+
+    Returns:
+        list[tuple[str, str, datetime.date, str, str]]: vcf file name, index
+            file name, release date, version and checksum file name of each
+            release, oldest release first
+    """
+    if catalogue is None:
+        catalogue = ReleaseCatalogue()
+    if listing is not None:
+        catalogue.update_releases(listing)
+    else:
+        catalogue.refresh(ftp)
+    releases = catalogue.complete_releases(
+        start_date.strftime('%Y%m%d'), end_date.strftime('%Y%m%d')
+    )
+    if not releases:
+        raise RuntimeError(
+            "No ClinVar VCF files with matching index and checksum from"
+            + f" {start_date} to {end_date} could be found on ncbi website"
+        )
+    return [
+        (
+            release["vcf"]["name"], release["tbi"]["name"],
+            datetime.strptime(release["version"], '%Y%m%d').date(),
+            release["version"], release["md5"]["name"]
+        )
+        for release in releases
+    ]
+
+
 def download_clinvar_dnanexus(
     clinvar_base_link, clinvar_link_path, update_project_id,
     update_folder_name, recent_vcf_file, clinvar_checksum_file,
-    recent_tbi_file
+    recent_tbi_file, download_segments=1, block_size=DEFAULT_BLOCK_SIZE,
+    stream_upload=False, build="GRCh38", manifest=None,
+    checksum_contents=None
 ) -> tuple[str, str]:
-    """Download ClinVar file and index to DNAnexus project
+    """Download ClinVar file and index to DNAnexus project. The VCF and
+    index are transferred concurrently on a bounded thread pool, with FTP
+    sessions per host capped by FTP_POOL. Both are checked to be intact
+    BGZF files before upload, and once the VCF is on local disk the index
+    is cross-checked against it and rebuilt from it if they do not match.
+    Streamed files are not on local disk, so are not checked
 
     Args:
         clinvar_base_link (str): Base ftp link to download website
@@ -146,6 +509,21 @@ def download_clinvar_dnanexus(
         recent_vcf_file (str): Name of dev clinvar file
         clinvar_checksum_file (str): Name of dev clinvar checksum
         recent_tbi_file (str): Name of dev clinvar index
+        download_segments (int, optional): number of parallel connections
+            to download the VCF over. Defaults to 1.
+        block_size (int, optional): bytes requested from the data
+            connection per read. Defaults to 1 MiB.
+        stream_upload (bool, optional): stream files straight into
+            DNAnexus instead of downloading them to local disk first.
+            Defaults to False.
+        build (str, optional): Genome build added to uploaded file names.
+            Defaults to GRCh38.
+        manifest (RunManifest, optional): manifest of the update, recording
+            the progress of each file so a rerun skips finished steps.
+            Defaults to None.
+        checksum_contents (bytes, optional): contents of the VCF checksum
+            file already fetched by fetch_clinvar_checksums. Defaults to
+            None, which downloads it with the VCF.
 
     Returns:
         dev_clinvar_id (str): DNAnexus file ID for clinvar file
@@ -153,18 +531,55 @@ def download_clinvar_dnanexus(
     """
     full_website_link = f"{clinvar_base_link}{clinvar_link_path}"
     vcf_basename = recent_vcf_file.split(".")[0]
-    new_vcf_name = f"{vcf_basename}_GRCh38.vcf.gz"
-    dev_clinvar_id = download_file_upload_DNAnexus(
-        f"{full_website_link}{recent_vcf_file}",
-        update_project_id, update_folder_name, new_vcf_name,
-        f"{full_website_link}{clinvar_checksum_file}"
-    )
+    new_vcf_name = f"{vcf_basename}_{build}.vcf.gz"
     # the index file does not have a checksum on the ncbi website
     tbi_basename = recent_tbi_file.split(".")[0]
-    new_tbi_name = f"{tbi_basename}_GRCh38.vcf.gz.tbi"
-    dev_index_id = download_file_upload_DNAnexus(
-        f"{full_website_link}{recent_tbi_file}",
-        update_project_id, update_folder_name, new_tbi_name
-    )
+    new_tbi_name = f"{tbi_basename}_{build}.vcf.gz.tbi"
+
+    # set once the VCF is on local disk, so the index downloaded alongside
+    # it can be cross-checked against it before the index is uploaded
+    vcf_downloaded = None if stream_upload else Future()
+    with ThreadPoolExecutor(max_workers=MAX_TRANSFER_WORKERS) as executor:
+        clinvar_future = executor.submit(
+            download_file_upload_DNAnexus,
+            f"{full_website_link}{recent_vcf_file}",
+            update_project_id, update_folder_name, new_vcf_name,
+            f"{full_website_link}{clinvar_checksum_file}",
+            download_segments, block_size, stream_upload, verify_bgzf=True,
+            manifest=manifest, downloaded=vcf_downloaded,
+            checksum_contents=checksum_contents
+        )
+        if vcf_downloaded is not None:
+            clinvar_future.add_done_callback(
+                lambda future: release_downloaded(future, vcf_downloaded)
+            )
+        index_future = executor.submit(
+            download_file_upload_DNAnexus,
+            f"{full_website_link}{recent_tbi_file}",
+            update_project_id, update_folder_name, new_tbi_name,
+            block_size=block_size, stream_upload=stream_upload,
+            verify_bgzf=True,
+            indexed_file=None if stream_upload else new_vcf_name,
+            manifest=manifest, indexed_file_ready=vcf_downloaded
+        )
+        dev_clinvar_id = clinvar_future.result()
+        dev_index_id = index_future.result()
 
     return dev_clinvar_id, dev_index_id
+
+
+def release_downloaded(transfer_future, downloaded) -> None:
+    """Resolve the future waited on by the index transfer once the VCF
+    transfer ends without reaching local disk, e.g. because it was already
+    in the project, or cancel it if the VCF transfer failed
+
+    Args:
+        transfer_future (Future): future of the VCF transfer
+        downloaded (Future): future set once the VCF is on local disk
+    """
+    if downloaded.done():
+        return
+    if transfer_future.exception() is None:
+        downloaded.set_result(None)
+    else:
+        downloaded.cancel()
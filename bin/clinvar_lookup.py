@@ -0,0 +1,156 @@
+"""
+Looks up the ClinVar classification of variants in the lookup index built
+for a ClinVar release
+"""
+
+from __future__ import annotations
+import argparse
+import os
+import re
+import sys
+
+import dxpy
+
+from utils.lookup_index import ClinVarLookupIndex
+from vep_config_update import FILE_ID_REGEX, split_file_id
+
+OUTPUT_COLUMNS = [
+    "query", "chrom", "pos", "id", "ref", "alt", "clnsig", "review_status"
+]
+# chrom:pos or chrom:pos:ref:alt, separated by colons or hyphens, where an
+# allele can itself be a hyphen for deletions and insertions
+VARIANT_REGEX = re.compile(
+    r"([^:-]+)[:-]([0-9]+)(?:[:-]([^:-]+|-)[:-]([^:-]+|-))?"
+)
+
+
+def main(index, variants, variants_file=None, output=None) -> None:
+    """Look up variants in a lookup index and write a TSV of the records
+    found, with one row per matching record and an empty row for variants
+    not in the release
+
+    Args:
+        index (str): path to lookup index, or its DNAnexus file ID
+        variants (list[str]): variants as chrom:pos or chrom:pos:ref:alt
+        variants_file (str, optional): file of variants, one per line.
+            Defaults to None.
+        output (str, optional): path to write TSV to. Defaults to None,
+            which writes to stdout.
+    """
+    if variants_file is not None:
+        variants = list(variants) + read_variants(variants_file)
+    queries = [parse_variant(variant) for variant in variants]
+    with ClinVarLookupIndex(get_lookup_index(index)) as lookup_index:
+        results = lookup_index.lookup_many(queries)
+    lines = format_results(variants, results)
+    if output is None:
+        sys.stdout.write("".join(lines))
+    else:
+        with open(output, "w", encoding="utf8") as output_file:
+            output_file.writelines(lines)
+
+
+def get_lookup_index(index) -> str:
+    """Download lookup index from DNAnexus if a file ID is given
+
+    Args:
+        index (str): path to lookup index, or DNAnexus file ID as
+            file-xxxx or project-xxxx:file-xxxx
+
+    Returns:
+        str: path to local lookup index
+    """
+    if not FILE_ID_REGEX.match(index) or os.path.exists(index):
+        return index
+    project, file_id = split_file_id(index)
+    dx_file = dxpy.DXFile(file_id, project=project)
+    index_path = dx_file.describe(fields={"name"})["name"]
+    if not os.path.exists(index_path):
+        dxpy.download_dxfile(file_id, index_path, project=project)
+    return index_path
+
+
+def read_variants(variants_file) -> list[str]:
+    """Read variants from a file, skipping blank and # comment lines
+
+    Args:
+        variants_file (str): path to file of variants, one per line
+
+    Returns:
+        list[str]: variants in file order
+    """
+    with open(variants_file, "r", encoding="utf8") as file:
+        return [
+            line.strip() for line in file
+            if line.strip() and not line.startswith("#")
+        ]
+
+
+def parse_variant(variant) -> tuple[str, int, str | None, str | None]:
+    """Parse a variant given as chrom:pos or chrom:pos:ref:alt, with
+    fields separated by colons or hyphens. An allele given as a hyphen is
+    kept as the allele, as used by ClinVar for deletions and insertions
+
+    Args:
+        variant (str): variant, e.g. 1:12345:A:G, 1-12345-A-G, 1:12345:A:-
+            or chr1:12345
+
+    Raises:
+        RuntimeError: variant is not in the expected format
+
+    Returns:
+        tuple[str, int, str | None, str | None]: chromosome, position and
+            alleles, with alleles None if not given
+    """
+    match = VARIANT_REGEX.fullmatch(variant)
+    if match is None:
+        raise RuntimeError(
+            f"Variant {variant} is not in format chrom:pos or"
+            + " chrom:pos:ref:alt"
+        )
+    chrom, pos, ref, alt = match.groups()
+    return chrom, int(pos), ref, alt
+
+
+def format_results(variants, results) -> list[str]:
+    """Format lookup results as TSV lines
+
+    Args:
+        variants (list[str]): variants queried
+        results (list[list[VCFRecord]]): records found for each variant
+
+    Returns:
+        list[str]: header and one line per record found, or per variant
+            with no records
+    """
+    lines = ["\t".join(OUTPUT_COLUMNS) + "\n"]
+    for variant, records in zip(variants, results):
+        if not records:
+            lines.append(variant + "\t" * (len(OUTPUT_COLUMNS) - 1) + "\n")
+        for record in records:
+            lines.append("\t".join([
+                variant, record.chrom, str(record.pos), record.variant_id,
+                record.ref, record.alt, record.clnsig or "",
+                record.review_status or "",
+            ]) + "\n")
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--index', type=str, required=True,
+        help="Path to lookup index, or its DNAnexus file ID"
+    )
+    parser.add_argument(
+        'variants', nargs='*',
+        help="Variants as chrom:pos or chrom:pos:ref:alt, e.g. 1:12345:A:G"
+    )
+    parser.add_argument(
+        '--variants_file', type=str,
+        help="File of variants to look up, one per line"
+    )
+    parser.add_argument('--output', type=str, help="Path to write TSV to")
+    args = parser.parse_args()
+
+    main(args.index, args.variants, args.variants_file, args.output)
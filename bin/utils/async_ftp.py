@@ -0,0 +1,484 @@
+"""
+Asyncio FTP client and transfer engine, so listings and small file
+transfers from many directories overlap on one event loop instead of
+waiting on each other's round trips
+"""
+
+from __future__ import annotations
+import asyncio
+import re
+from contextlib import asynccontextmanager
+from ftplib import error_perm, error_reply, error_temp
+from urllib.parse import urlparse
+
+from .rate_limiter import RATE_LIMITER, is_throttle_error
+from .telemetry import METRICS
+
+# port in an EPSV reply, e.g. 229 Entering Extended Passive Mode (|||6446|)
+EPSV_REGEX = re.compile(r"\(\|\|\|(\d+)\|\)")
+# replies meaning the server does not support a command
+UNSUPPORTED_REPLY_CODES = ("500", "502", "504")
+# bytes read from the data connection per read
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+
+class AsyncFTPClient:
+    """FTP control connection driven by asyncio streams. Each transfer
+    opens a passive mode data connection to the control connection's host.
+    Error replies are raised as the ftplib errors the synchronous code
+    already handles
+    """
+
+    def __init__(self, timeout=60):
+        """
+        Args:
+            timeout (int, optional): seconds to wait for the server before
+                giving up. Defaults to 60.
+        """
+        self.timeout = timeout
+        self.host = None
+        self._reader = None
+        self._writer = None
+
+    async def connect(self, host, port=21) -> str:
+        """Open control connection and read the server greeting
+
+        Args:
+            host (str): FTP host name
+            port (int, optional): FTP control port. Defaults to 21.
+
+        Returns:
+            str: server greeting
+        """
+        self.host = host
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port), self.timeout
+        )
+        return await self._read_reply()
+
+    async def login(self, user="anonymous", passwd="anonymous@") -> str:
+        """Log in to the server
+
+        Args:
+            user (str, optional): user name. Defaults to anonymous.
+            passwd (str, optional): password. Defaults to anonymous@.
+
+        Returns:
+            str: login reply
+        """
+        reply = await self.command(f"USER {user}")
+        if reply.startswith("3"):
+            reply = await self.command(f"PASS {passwd}")
+        return reply
+
+    async def command(self, command) -> str:
+        """Send a command and read its reply
+
+        Args:
+            command (str): FTP command, e.g. CWD /pub
+
+        Raises:
+            ftplib.error_temp: server replied with a 4xx error
+            ftplib.error_perm: server replied with a 5xx error
+
+        Returns:
+            str: server reply
+        """
+        self._writer.write(f"{command}\r\n".encode())
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def cwd(self, path) -> str:
+        """Change working directory
+
+        Args:
+            path (str): directory to change to
+
+        Returns:
+            str: server reply
+        """
+        return await self.command(f"CWD {path}")
+
+    async def size(self, name) -> int:
+        """Get size of a file in bytes
+
+        Args:
+            name (str): file name
+
+        Returns:
+            int: size of file in bytes
+        """
+        await self.command("TYPE I")
+        return int((await self.command(f"SIZE {name}")).split()[-1])
+
+    async def mlsd(self) -> list[tuple[str, dict]]:
+        """List files in the working directory with their facts, falling
+        back to LIST if the server does not support MLSD
+
+        Returns:
+            list[tuple[str, dict]]: name and MLSD facts of each entry. Facts
+                are empty for servers without MLSD
+        """
+        try:
+            lines = (await self._transfer("MLSD")).decode().splitlines()
+        except error_perm as err:
+            if str(err)[:3] not in UNSUPPORTED_REPLY_CODES:
+                raise
+            lines = (await self._transfer("LIST")).decode().splitlines()
+            return [(line.split()[-1], {}) for line in lines if line.strip()]
+        entries = []
+        for line in lines:
+            facts_text, _, name = line.partition(" ")
+            facts = {}
+            for fact in facts_text.rstrip(";").split(";"):
+                key, _, value = fact.partition("=")
+                facts[key.lower()] = value
+            entries.append((name, facts))
+        return entries
+
+    async def retrieve(
+        self, name, write=None, rest=None, block_size=DEFAULT_BLOCK_SIZE
+    ) -> bytes | int:
+        """Download a file in binary mode
+
+        Args:
+            name (str): file name
+            write (Callable[[bytes], None], optional): called with each
+                block as it is received. Defaults to None, which returns
+                the whole file.
+            rest (int, optional): byte offset to start the transfer from.
+                Defaults to None.
+            block_size (int, optional): bytes read per read. Defaults to
+                1 MiB.
+
+        Returns:
+            bytes | int: file contents, or bytes received if write is given
+        """
+        await self.command("TYPE I")
+        return await self._transfer(f"RETR {name}", write, rest, block_size)
+
+    async def quit(self) -> None:
+        """Log out and close the connection, ignoring errors from a
+        connection the server already dropped
+        """
+        if self._writer is None:
+            return
+        try:
+            await self.command("QUIT")
+        except (OSError, EOFError, asyncio.TimeoutError, error_reply,
+                error_perm, error_temp):
+            pass
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Close the connection without logging out
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _transfer(
+        self, command, write=None, rest=None, block_size=DEFAULT_BLOCK_SIZE
+    ) -> bytes | int:
+        """Run a command that sends its result over a data connection
+
+        Args:
+            command (str): FTP command, e.g. RETR clinvar.vcf.gz.md5
+            write (Callable[[bytes], None], optional): called with each
+                block. Defaults to None, which returns all data.
+            rest (int, optional): byte offset to start from. Defaults to
+                None.
+            block_size (int, optional): bytes read per read. Defaults to
+                1 MiB.
+
+        Raises:
+            ftplib.error_reply: server did not start the transfer
+
+        Returns:
+            bytes | int: data received, or bytes received if write is given
+        """
+        reply = await self.command("EPSV")
+        match = EPSV_REGEX.search(reply)
+        if match is None:
+            raise error_reply(f"Unexpected EPSV reply: {reply}")
+        data_reader, data_writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, int(match.group(1))),
+            self.timeout
+        )
+        try:
+            if rest is not None:
+                await self.command(f"REST {rest}")
+            reply = await self.command(command)
+            if not reply.startswith("1"):
+                raise error_reply(f"Transfer did not start: {reply}")
+            blocks = []
+            received = 0
+            while block := await asyncio.wait_for(
+                data_reader.read(block_size), self.timeout
+            ):
+                received += len(block)
+                if write is None:
+                    blocks.append(block)
+                else:
+                    write(block)
+        finally:
+            data_writer.close()
+        await self._read_reply()
+        return received if write is not None else b"".join(blocks)
+
+    async def _read_reply(self) -> str:
+        """Read a single or multi-line reply from the control connection
+
+        Raises:
+            EOFError: server closed the connection
+            ftplib.error_temp: server replied with a 4xx error
+            ftplib.error_perm: server replied with a 5xx error
+
+        Returns:
+            str: reply, with lines joined by newlines
+        """
+        lines = []
+        while True:
+            line = await asyncio.wait_for(
+                self._reader.readline(), self.timeout
+            )
+            if not line:
+                raise EOFError("FTP server closed the connection")
+            line = line.decode("latin-1").rstrip("\r\n")
+            lines.append(line)
+            # the last line of a reply starts with the code and a space
+            if len(lines) == 1 and line[3:4] != "-":
+                break
+            if len(lines) > 1 and line[:3] == lines[0][:3] and (
+                line[3:4] == " "
+            ):
+                break
+        reply = "\n".join(lines)
+        if reply[:1] == "4":
+            raise error_temp(reply)
+        if reply[:1] == "5":
+            raise error_perm(reply)
+        return reply
+
+
+class AsyncFTPEngine:
+    """Runs many FTP listings and small transfers at once on one event
+    loop. Connections per host are capped and idle connections are reused,
+    and new connections wait on the rate limiter shared with FTP_POOL
+    """
+
+    def __init__(
+        self, max_connections_per_host=4, timeout=60,
+        rate_limiter=RATE_LIMITER, max_connect_attempts=5
+    ):
+        """
+        Args:
+            max_connections_per_host (int, optional): maximum connections
+                open at once per host. Defaults to 4.
+            timeout (int, optional): seconds to wait for the server before
+                giving up. Defaults to 60.
+            rate_limiter (RateLimiter, optional): limiter new connections
+                wait on. Defaults to RATE_LIMITER.
+            max_connect_attempts (int, optional): number of times to try
+                connecting to a host that throttles connections. Defaults
+                to 5.
+        """
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.max_connect_attempts = max_connect_attempts
+        self._idle = {}
+        self._slots = {}
+
+    async def list_directory(self, host, path) -> list[tuple[str, dict]]:
+        """List files in a directory
+
+        Args:
+            host (str): FTP host name, optionally followed by :port
+            path (str): directory to list
+
+        Returns:
+            list[tuple[str, dict]]: name and MLSD facts of each entry
+        """
+        async with self._session(host) as client:
+            await client.cwd(path)
+            return await client.mlsd()
+
+    async def fetch_file(self, host, path) -> bytes:
+        """Download a small file into memory
+
+        Args:
+            host (str): FTP host name, optionally followed by :port
+            path (str): path to file on server
+
+        Returns:
+            bytes: file contents
+        """
+        directory, _, name = path.rpartition("/")
+        async with self._session(host) as client:
+            await client.cwd(directory or "/")
+            return await client.retrieve(name)
+
+    async def close(self) -> None:
+        """Close every idle connection
+        """
+        clients = [
+            client for clients in self._idle.values() for client in clients
+        ]
+        self._idle.clear()
+        await asyncio.gather(*(client.quit() for client in clients))
+
+    @asynccontextmanager
+    async def _session(self, host):
+        """Context manager for a connection to host, returned for reuse on
+        success and closed if an error is raised
+
+        Args:
+            host (str): FTP host name, optionally followed by :port
+
+        Yields:
+            AsyncFTPClient: logged-in connection
+        """
+        slots = self._slots.setdefault(
+            host, asyncio.Semaphore(self.max_connections_per_host)
+        )
+        async with slots:
+            # reused connections also wait out a throttling backoff
+            if self.rate_limiter is not None and (
+                self.rate_limiter.backoff_remaining() > 0
+            ):
+                await asyncio.to_thread(self.rate_limiter.wait_for_backoff)
+            idle_clients = self._idle.setdefault(host, [])
+            client = idle_clients.pop() if idle_clients else None
+            if client is None:
+                client = await self._connect(host)
+            try:
+                yield client
+            except BaseException:
+                client.close()
+                raise
+            idle_clients.append(client)
+
+    async def _connect(self, host) -> AsyncFTPClient:
+        """Open and log in to a new connection, waiting on the rate limiter
+        and backing off while the server throttles connections
+
+        Args:
+            host (str): FTP host name, optionally followed by :port
+
+        Returns:
+            AsyncFTPClient: logged-in connection
+        """
+        host_name, _, port = host.partition(":")
+        attempt = 1
+        while True:
+            if self.rate_limiter is not None:
+                # the limiter is shared with threads, so wait off the loop
+                await asyncio.to_thread(self.rate_limiter.acquire)
+            client = AsyncFTPClient(self.timeout)
+            try:
+                await client.connect(host_name, int(port or 21))
+                await client.login()
+            except (OSError, EOFError, error_reply, error_perm,
+                    error_temp) as err:
+                client.close()
+                if (
+                    self.rate_limiter is None
+                    or attempt >= self.max_connect_attempts
+                    or not is_throttle_error(err)
+                ):
+                    raise
+                delay = self.rate_limiter.backoff()
+                print(
+                    f"Connection to {host} throttled ({err}), retrying in"
+                    + f" {delay:.1f}s"
+                )
+                attempt += 1
+                continue
+            if self.rate_limiter is not None:
+                self.rate_limiter.succeeded()
+            return client
+
+
+def list_ftp_directories(links, **engine_options) -> dict[
+    str, list[tuple[str, dict]]
+]:
+    """List several FTP directories at once, e.g. the weekly and monthly
+    directories of both builds, on one event loop
+
+    Args:
+        links (list[str]): links to directories, e.g.
+            https://ftp.ncbi.nlm.nih.gov/pub/clinvar/vcf_GRCh38/weekly/
+        **engine_options: options passed to AsyncFTPEngine
+
+    Returns:
+        dict[str, list[tuple[str, dict]]]: each link mapped to the name and
+            MLSD facts of each entry in its directory
+    """
+    async def list_all(engine):
+        return await asyncio.gather(*(
+            engine.list_directory(*split_ftp_link(link)) for link in links
+        ))
+
+    with METRICS.stage("async_listing", directories=len(links)):
+        listings = run_engine(list_all, **engine_options)
+    return dict(zip(links, listings))
+
+
+def fetch_ftp_files(links, **engine_options) -> dict[str, bytes]:
+    """Download several small files at once, such as checksums, into
+    memory on one event loop
+
+    Args:
+        links (list[str]): links to files, e.g.
+            https://ftp.ncbi.nlm.nih.gov/pub/clinvar/clinvar.vcf.gz.md5
+        **engine_options: options passed to AsyncFTPEngine
+
+    Returns:
+        dict[str, bytes]: each link mapped to the file contents
+    """
+    async def fetch_all(engine):
+        return await asyncio.gather(*(
+            engine.fetch_file(*split_ftp_link(link)) for link in links
+        ))
+
+    with METRICS.stage("async_fetch", files=len(links)) as stage:
+        contents = run_engine(fetch_all, **engine_options)
+        stage["bytes"] = sum(len(content) for content in contents)
+    return dict(zip(links, contents))
+
+
+def run_engine(run, **engine_options):
+    """Run a coroutine using a new engine on a new event loop, closing the
+    engine's connections afterwards. Used by the synchronous wrappers
+
+    Args:
+        run (Callable[[AsyncFTPEngine], Coroutine]): coroutine function
+            taking the engine
+        **engine_options: options passed to AsyncFTPEngine
+
+    Returns:
+        result of the coroutine
+    """
+    async def run_and_close():
+        engine = AsyncFTPEngine(**engine_options)
+        try:
+            return await run(engine)
+        finally:
+            await engine.close()
+
+    return asyncio.run(run_and_close())
+
+
+def split_ftp_link(link) -> tuple[str, str]:
+    """Split link into FTP host and path
+
+    Args:
+        link (str): link, e.g. https://ftp.ncbi.nlm.nih.gov/pub/clinvar/
+
+    Returns:
+        tuple[str, str]: host, optionally followed by :port, and path
+    """
+    parsed_link = urlparse(link)
+    return parsed_link.netloc, parsed_link.path or "/"
@@ -0,0 +1,252 @@
+"""
+Writing and integrity checking of BGZF files, the blocked gzip format used
+for ClinVar VCFs and their tabix indexes
+"""
+
+from __future__ import annotations
+import mmap
+import multiprocessing
+import os
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+# empty block that must end every BGZF file
+BGZF_EOF = bytes.fromhex(
+    "1f8b08040000000000ff0600424302001b0003000000000000000000"
+)
+# gzip magic, deflate compression and FEXTRA flag that start every block
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+# fixed gzip header before the extra field, and CRC32 and ISIZE trailer
+HEADER_SIZE = 12
+TRAILER_SIZE = 8
+# uncompressed bytes per block, leaving room for incompressible data
+MAX_BLOCK_DATA = 0xff00
+# blocks checked per process pool task
+BLOCKS_PER_TASK = 512
+
+
+def compress_block(data, level=6) -> bytes:
+    """Compress data as a single BGZF block
+
+    Args:
+        data (bytes): at most MAX_BLOCK_DATA bytes to compress
+        level (int, optional): zlib compression level. Defaults to 6.
+
+    Returns:
+        bytes: BGZF block
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    block_size = HEADER_SIZE + 6 + len(cdata) + TRAILER_SIZE
+    return (
+        struct.pack(
+            "<4sIBBHBBHH", BGZF_MAGIC, 0, 0, 255, 6, 66, 67, 2,
+            block_size - 1
+        )
+        + cdata
+        + struct.pack("<II", zlib.crc32(data), len(data))
+    )
+
+
+class BGZFWriter:
+    """Writes data to a file as BGZF blocks, ending with the EOF marker
+    when closed
+    """
+
+    def __init__(self, file_path, level=6):
+        """
+        Args:
+            file_path (str): path of BGZF file to write
+            level (int, optional): zlib compression level. Defaults to 6.
+        """
+        self.level = level
+        self._file = open(file_path, "wb")
+        self._buffer = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, data) -> None:
+        """Compress data into the file, a block at a time
+
+        Args:
+            data (bytes): data to write
+        """
+        self._buffer += data
+        while len(self._buffer) >= MAX_BLOCK_DATA:
+            self._file.write(compress_block(
+                bytes(self._buffer[:MAX_BLOCK_DATA]), self.level
+            ))
+            del self._buffer[:MAX_BLOCK_DATA]
+
+    def close(self) -> None:
+        """Write remaining data and the EOF marker, and close the file
+        """
+        if self._file.closed:
+            return
+        if self._buffer:
+            self._file.write(compress_block(bytes(self._buffer), self.level))
+            self._buffer.clear()
+        self._file.write(BGZF_EOF)
+        self._file.close()
+
+
+def check_bgzf_integrity(file_path, workers=None) -> int:
+    """Check a file is well-formed BGZF. Block boundaries are scanned from
+    the block headers, then every block is decompressed and checked
+    against its CRC32 and uncompressed size on a process pool, and the
+    file must end with the BGZF EOF marker
+
+    Args:
+        file_path (str): path to BGZF file
+        workers (int, optional): processes to check blocks on. Defaults to
+            the number of CPUs.
+
+    Raises:
+        RuntimeError: file is not valid BGZF
+
+    Returns:
+        int: number of blocks in file, including the EOF marker
+    """
+    with open(file_path, "rb") as bgzf_file:
+        if os.fstat(bgzf_file.fileno()).st_size == 0:
+            raise RuntimeError(f"BGZF file {file_path} is empty")
+        with mmap.mmap(
+            bgzf_file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            blocks = scan_bgzf_blocks(data, file_path)
+            if data[blocks[-1][0]:] != BGZF_EOF:
+                raise RuntimeError(
+                    f"BGZF file {file_path} is missing the EOF marker, so"
+                    + " may be truncated"
+                )
+
+    tasks = [
+        blocks[start:start + BLOCKS_PER_TASK]
+        for start in range(0, len(blocks), BLOCKS_PER_TASK)
+    ]
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers == 1:
+        errors = [check_bgzf_blocks(file_path, task) for task in tasks]
+    else:
+        # spawn, as forking a process with transfer threads running can
+        # deadlock on locks they hold
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            errors = list(executor.map(
+                check_bgzf_blocks, [file_path] * len(tasks), tasks
+            ))
+    for error in errors:
+        if error is not None:
+            raise RuntimeError(error)
+    return len(blocks)
+
+
+def scan_bgzf_blocks(data, file_path) -> list[tuple[int, int]]:
+    """Find the offset and size of every block from the BGZF headers
+
+    Args:
+        data (mmap.mmap): contents of BGZF file
+        file_path (str): path to BGZF file used in errors
+
+    Raises:
+        RuntimeError: block header is invalid or block is truncated
+
+    Returns:
+        list[tuple[int, int]]: offset and size in bytes of each block
+    """
+    blocks = []
+    offset = 0
+    file_size = len(data)
+    while offset < file_size:
+        if data[offset:offset + 4] != BGZF_MAGIC:
+            raise RuntimeError(
+                f"BGZF file {file_path} has no block header at byte {offset}"
+            )
+        if offset + HEADER_SIZE > file_size:
+            raise RuntimeError(
+                f"BGZF file {file_path} block header at byte {offset} is"
+                + " truncated"
+            )
+        extra_length, = struct.unpack_from("<H", data, offset + 10)
+        extra_end = offset + HEADER_SIZE + extra_length
+        if extra_end > file_size:
+            raise RuntimeError(
+                f"BGZF file {file_path} block header at byte {offset} is"
+                + " truncated"
+            )
+        block_size = None
+        field = offset + HEADER_SIZE
+        # find the BC subfield holding the block size
+        while field + 4 <= extra_end:
+            field_id, field_length = struct.unpack_from("<2sH", data, field)
+            if (
+                field_id == b"BC" and field_length == 2
+                and field + 6 <= extra_end
+            ):
+                block_size = struct.unpack_from("<H", data, field + 4)[0] + 1
+                break
+            field += 4 + field_length
+        if block_size is None:
+            raise RuntimeError(
+                f"BGZF file {file_path} block at byte {offset} has no block"
+                + " size field"
+            )
+        if offset + block_size > file_size:
+            raise RuntimeError(
+                f"BGZF file {file_path} block at byte {offset} is truncated"
+            )
+        blocks.append((offset, block_size))
+        offset += block_size
+    return blocks
+
+
+def check_bgzf_blocks(file_path, blocks) -> str | None:
+    """Decompress blocks and check their CRC32 and uncompressed size. Runs
+    in process pool workers, so errors are returned rather than raised
+
+    Args:
+        file_path (str): path to BGZF file
+        blocks (list[tuple[int, int]]): offset and size of blocks to check
+
+    Returns:
+        str | None: description of first invalid block, or None if all
+            blocks are valid
+    """
+    with open(file_path, "rb") as bgzf_file, mmap.mmap(
+        bgzf_file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        for offset, block_size in blocks:
+            extra_length, = struct.unpack_from("<H", data, offset + 10)
+            cdata_start = offset + HEADER_SIZE + extra_length
+            cdata_end = offset + block_size - TRAILER_SIZE
+            crc, uncompressed_size = struct.unpack_from(
+                "<II", data, cdata_end
+            )
+            try:
+                uncompressed = zlib.decompress(
+                    data[cdata_start:cdata_end], -15
+                )
+            except zlib.error as err:
+                return (
+                    f"BGZF file {file_path} block at byte {offset} cannot"
+                    + f" be decompressed: {err}"
+                )
+            if len(uncompressed) != uncompressed_size:
+                return (
+                    f"BGZF file {file_path} block at byte {offset} is"
+                    + f" {len(uncompressed)} bytes uncompressed, expected"
+                    + f" {uncompressed_size}"
+                )
+            if zlib.crc32(uncompressed) != crc:
+                return (
+                    f"BGZF file {file_path} block at byte {offset} does not"
+                    + " match its CRC32"
+                )
+    return None
@@ -0,0 +1,164 @@
+"""
+On-disk checkpoints that let interrupted FTP downloads resume
+"""
+
+from __future__ import annotations
+import json
+import os
+
+
+class DownloadCheckpoint:
+    """Sidecar file next to a partial download recording the byte offset
+    reached and the digest of the bytes written up to that offset, or for
+    a segmented download the offset reached in each byte range
+    """
+
+    def __init__(self, file_path):
+        """
+        Args:
+            file_path (str): path to local file being downloaded
+        """
+        self.path = f"{file_path}.ckpt"
+
+    def load(self, source) -> dict | None:
+        """Read checkpoint for a download
+
+        Args:
+            source (str): download link the checkpoint must have been
+                written for
+
+        Returns:
+            dict | None: checkpoint contents, or None if there is no usable
+                checkpoint for source
+        """
+        try:
+            with open(self.path, "r", encoding="utf8") as json_file:
+                state = json.load(json_file)
+        except (OSError, ValueError):
+            return None
+        if state.get("source") != source:
+            return None
+        return state
+
+    def save(self, source, offset, hash_obj) -> None:
+        """Atomically write checkpoint. The partial file must already be
+        flushed to disk up to offset
+
+        Args:
+            source (str): download link of file being downloaded
+            offset (int): number of bytes of the file written to disk
+            hash_obj (hashlib hash object): hash of the first offset bytes
+        """
+        self._write({
+            "source": source,
+            "offset": offset,
+            "hash_name": hash_obj.name,
+            "digest": hash_obj.hexdigest(),
+        })
+
+    def load_ranges(self, source, file_size) -> list[list[int]] | None:
+        """Read checkpoint for a segmented download
+
+        Args:
+            source (str): download link the checkpoint must have been
+                written for
+            file_size (int): size of file being downloaded
+
+        Returns:
+            list[list[int]] | None: start, end and offset reached of each
+                range, or None if there is no usable segmented checkpoint
+                for source
+        """
+        state = self.load(source)
+        if state is None or state.get("size") != file_size or not (
+            state.get("ranges")
+        ):
+            return None
+        return state["ranges"]
+
+    def save_ranges(self, source, file_size, ranges) -> None:
+        """Atomically write checkpoint of a segmented download. Each range
+        of the partial file must already be flushed to disk up to its offset
+
+        Args:
+            source (str): download link of file being downloaded
+            file_size (int): size of file being downloaded
+            ranges (list[list[int]]): start, end and offset reached of each
+                range
+        """
+        self._write({"source": source, "size": file_size, "ranges": ranges})
+
+    def _write(self, state) -> None:
+        """Atomically replace checkpoint contents
+
+        Args:
+            state (dict): checkpoint contents
+        """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf8") as json_file:
+            json.dump(state, json_file)
+        os.replace(tmp_path, self.path)
+
+    def resume(self, localfile, source, hash_obj, chunk_size=1024 * 1024):
+        """Prepare partial file to resume download from the checkpoint.
+        Bytes already on disk up to the checkpoint offset are re-hashed
+        into hash_obj and checked against the checkpoint digest. If there is
+        no valid checkpoint the file is truncated to restart from byte zero
+
+        Args:
+            localfile (file object): partial file opened in "a+b" mode
+            source (str): download link of file being downloaded
+            hash_obj (hashlib hash object): unused hash to bring up to date
+                with the bytes already downloaded
+            chunk_size (int, optional): bytes read per chunk when re-hashing
+
+        Returns:
+            int: byte offset to resume the download from
+        """
+        state = self.load(source)
+        offset = 0
+        if state is not None and state.get("hash_name") == hash_obj.name:
+            # verify partial file on a copy so hash_obj is left unused if
+            # the partial file cannot be trusted
+            probe = hash_obj.copy()
+            if self._update_hash(
+                localfile, probe, state["offset"], chunk_size
+            ) and probe.hexdigest() == state["digest"]:
+                self._update_hash(
+                    localfile, hash_obj, state["offset"], chunk_size
+                )
+                offset = state["offset"]
+        localfile.truncate(offset)
+        localfile.seek(offset)
+        return offset
+
+    def clear(self) -> None:
+        """Remove checkpoint once download is complete
+        """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _update_hash(localfile, hash_obj, length, chunk_size) -> bool:
+        """Update hash with the first length bytes of a file
+
+        Args:
+            localfile (file object): file to read
+            hash_obj (hashlib hash object): hash to update
+            length (int): number of bytes to read from start of file
+            chunk_size (int): bytes read per chunk
+
+        Returns:
+            bool: did the file contain at least length bytes
+        """
+        localfile.seek(0)
+        remaining = length
+        while remaining > 0:
+            chunk = localfile.read(min(chunk_size, remaining))
+            if not chunk:
+                return False
+            hash_obj.update(chunk)
+            remaining -= len(chunk)
+        return True
@@ -0,0 +1,254 @@
+"""
+Pool of reusable, logged-in FTP sessions shared by the ClinVar fetcher and
+the download utilities
+"""
+
+import atexit
+import threading
+from contextlib import contextmanager
+from ftplib import FTP, all_errors
+
+from .rate_limiter import RATE_LIMITER, is_throttle_error
+
+
+class FTPSessionPool:
+    """Keeps logged-in FTP sessions open so listings and downloads from the
+    same host reuse a connection instead of reconnecting and logging in
+    for every file. The number of sessions in use per host is capped, so
+    concurrent transfers wait for a free session rather than opening more
+    connections than the server allows. New connections are opened
+    through a rate limiter, backing off and retrying if the server throttles
+    them, and idle sessions are not reused until any backoff has ended
+    """
+
+    def __init__(
+        self, max_idle_per_host=4, max_sessions_per_host=3, timeout=60,
+        rate_limiter=None, max_connect_attempts=5
+    ):
+        """
+        Args:
+            max_idle_per_host (int, optional): maximum number of idle
+                sessions kept open per host. Defaults to 4.
+            max_sessions_per_host (int, optional): maximum number of
+                sessions in use at once per host. Defaults to 3.
+            timeout (int, optional): socket timeout in seconds for new
+                sessions. Defaults to 60.
+            rate_limiter (RateLimiter, optional): limiter new connections
+                wait on. Defaults to no rate limiting.
+            max_connect_attempts (int, optional): number of times to try
+                connecting to a host that throttles connections. Defaults
+                to 5.
+        """
+        self.max_idle_per_host = max_idle_per_host
+        self.max_sessions_per_host = max_sessions_per_host
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.max_connect_attempts = max_connect_attempts
+        self._idle = {}
+        self._cwd = {}
+        self._hosts = {}
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host, path=None) -> FTP:
+        """Get a logged-in session for host, reusing an idle one if it is
+        still alive. Blocks while max_sessions_per_host sessions for host
+        are already in use, and while the rate limiter is backing off after
+        the server throttled a connection
+
+        Args:
+            host (str): FTP host name, optionally followed by :port
+            path (str, optional): directory to change to on the session
+
+        Raises:
+            ftplib.error_perm: directory path could not be found
+            OSError: cannot connect to host
+
+        Returns:
+            ftplib.FTP: logged-in FTP session in directory path
+        """
+        with self._lock:
+            slots = self._slots.setdefault(
+                host, threading.BoundedSemaphore(self.max_sessions_per_host)
+            )
+        slots.acquire()
+        try:
+            # retries after a throttled transfer reuse idle sessions, so
+            # wait out the backoff rather than resending at once
+            if self.rate_limiter is not None:
+                self.rate_limiter.wait_for_backoff()
+        except BaseException:
+            slots.release()
+            raise
+        with self._lock:
+            idle_sessions = self._idle.get(host, [])
+            ftp = idle_sessions.pop() if idle_sessions else None
+
+        try:
+            # idle sessions may have been dropped by the server, so check
+            # them before use and reconnect if stale
+            if ftp is not None and not self._is_alive(ftp):
+                self._close(ftp)
+                ftp = None
+            if ftp is None:
+                ftp = self._connect(host)
+        except BaseException:
+            slots.release()
+            raise
+        self._hosts[ftp] = host
+
+        if path is not None and self._cwd.get(ftp) != path:
+            try:
+                ftp.cwd(path)
+            except all_errors:
+                self.discard(ftp)
+                raise
+            self._cwd[ftp] = path
+        return ftp
+
+    def release(self, ftp) -> None:
+        """Return session to the pool so it can be reused
+
+        Args:
+            ftp (ftplib.FTP): session previously returned by acquire
+        """
+        host = self._hosts.pop(ftp)
+        with self._lock:
+            idle_sessions = self._idle.setdefault(host, [])
+            keep = len(idle_sessions) < self.max_idle_per_host
+            if keep:
+                idle_sessions.append(ftp)
+        if not keep:
+            self._close(ftp)
+        self._slots[host].release()
+
+    def discard(self, ftp) -> None:
+        """Close session without returning it to the pool
+
+        Args:
+            ftp (ftplib.FTP): session previously returned by acquire
+        """
+        host = self._hosts.pop(ftp)
+        self._close(ftp)
+        self._slots[host].release()
+
+    @contextmanager
+    def session(self, host, path=None):
+        """Context manager for a pooled session. The session is returned
+        to the pool on success and discarded if an error is raised
+
+        Args:
+            host (str): FTP host name
+            path (str, optional): directory to change to on the session
+
+        Yields:
+            ftplib.FTP: logged-in FTP session in directory path
+        """
+        ftp = self.acquire(host, path)
+        try:
+            yield ftp
+        except BaseException:
+            self.discard(ftp)
+            raise
+        self.release(ftp)
+
+    def close_all(self) -> None:
+        """Close all idle sessions in the pool
+        """
+        with self._lock:
+            idle_sessions = [
+                ftp for sessions in self._idle.values() for ftp in sessions
+            ]
+            self._idle.clear()
+        for ftp in idle_sessions:
+            self._close(ftp)
+
+    def _close(self, ftp) -> None:
+        """Close session, ignoring errors from a connection already dropped
+
+        Args:
+            ftp (ftplib.FTP): session to close
+        """
+        self._cwd.pop(ftp, None)
+        try:
+            ftp.quit()
+        except all_errors:
+            pass
+        finally:
+            ftp.close()
+
+    def _connect(self, host) -> FTP:
+        """Open and log in to a new session, waiting on the rate limiter
+        and backing off while the server throttles connections
+
+        Args:
+            host (str): FTP host name, optionally followed by :port
+
+        Returns:
+            ftplib.FTP: logged-in FTP session
+        """
+        if self.rate_limiter is None:
+            return self._login(host)
+        attempt = 1
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                ftp = self._login(host)
+            except all_errors as err:
+                if (
+                    attempt >= self.max_connect_attempts
+                    or not is_throttle_error(err)
+                ):
+                    raise
+                delay = self.rate_limiter.backoff()
+                print(
+                    f"Connection to {host} throttled ({err}), retrying in"
+                    + f" {delay:.1f}s"
+                )
+                attempt += 1
+                continue
+            self.rate_limiter.succeeded()
+            return ftp
+
+    def _login(self, host) -> FTP:
+        """Open and log in to a new session
+
+        Args:
+            host (str): FTP host name, optionally followed by :port
+
+        Returns:
+            ftplib.FTP: logged-in FTP session
+        """
+        host_name, _, port = host.partition(":")
+        if port:
+            ftp = FTP(timeout=self.timeout)
+            ftp.connect(host_name, int(port))
+        else:
+            ftp = FTP(host, timeout=self.timeout)
+        try:
+            ftp.login()
+        except all_errors:
+            ftp.close()
+            raise
+        return ftp
+
+    @staticmethod
+    def _is_alive(ftp) -> bool:
+        """Check a session is still connected to the server
+
+        Args:
+            ftp (ftplib.FTP): session to check
+
+        Returns:
+            bool: does the server still respond on the session
+        """
+        try:
+            ftp.voidcmd("NOOP")
+            return True
+        except (*all_errors, AttributeError):
+            return False
+
+
+# pool shared by every FTP listing and download in the process
+FTP_POOL = FTPSessionPool(rate_limiter=RATE_LIMITER)
+atexit.register(FTP_POOL.close_all)
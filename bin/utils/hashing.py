@@ -0,0 +1,137 @@
+"""
+Checksums of local files and downloads, computing every algorithm in a
+single pass over the data
+"""
+
+from __future__ import annotations
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .telemetry import METRICS
+
+# checksums recorded for every file uploaded to DNAnexus
+HASH_ALGORITHMS = ("md5", "sha256")
+# bytes read into the reused buffer per read
+DEFAULT_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+class MultiHash:
+    """Updates a hash for each algorithm from the same data, so several
+    checksums cost one read of the file. Has the name, update, copy and
+    hexdigest of a hashlib hash, so it can be passed wherever a download
+    takes a hash object
+    """
+
+    def __init__(self, algorithms=HASH_ALGORITHMS):
+        """
+        Args:
+            algorithms (tuple[str], optional): hashlib algorithm names.
+                Defaults to md5 and sha256.
+        """
+        self._hashes = {
+            algorithm: hashlib.new(algorithm) for algorithm in algorithms
+        }
+
+    @property
+    def name(self) -> str:
+        """Algorithm names joined by plus signs, e.g. md5+sha256
+        """
+        return "+".join(self._hashes)
+
+    def update(self, data) -> None:
+        """Update every hash with data
+
+        Args:
+            data (bytes-like): data to hash
+        """
+        for hash_obj in self._hashes.values():
+            hash_obj.update(data)
+
+    def copy(self) -> MultiHash:
+        """Copy the current state of every hash
+
+        Returns:
+            MultiHash: independent copy
+        """
+        copied = MultiHash(())
+        copied._hashes = {
+            algorithm: hash_obj.copy()
+            for algorithm, hash_obj in self._hashes.items()
+        }
+        return copied
+
+    def hexdigest(self) -> str:
+        """Combined digest of every hash, used to check download
+        checkpoints
+
+        Returns:
+            str: hex digests joined by colons, in algorithm order
+        """
+        return ":".join(self.hexdigests().values())
+
+    def hexdigests(self) -> dict[str, str]:
+        """Hex digest of each hash
+
+        Returns:
+            dict[str, str]: algorithm name mapped to hex digest
+        """
+        return {
+            algorithm: hash_obj.hexdigest()
+            for algorithm, hash_obj in self._hashes.items()
+        }
+
+
+def hash_file(
+    file_path, algorithms=HASH_ALGORITHMS, buffer_size=DEFAULT_BUFFER_SIZE
+) -> dict[str, str]:
+    """Calculate checksums of a file in one pass, reading it into a reused
+    buffer so memory use does not depend on file size
+
+    Args:
+        file_path (str): path to file
+        algorithms (tuple[str], optional): hashlib algorithm names.
+            Defaults to md5 and sha256.
+        buffer_size (int, optional): bytes read per read. Defaults to
+            4 MiB.
+
+    Returns:
+        dict[str, str]: algorithm name mapped to hex digest of file
+    """
+    hash_obj = MultiHash(algorithms)
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with METRICS.stage("hash", file=file_path) as stage, \
+            open(file_path, "rb", buffering=0) as f:
+        while size := f.readinto(buffer):
+            hash_obj.update(view[:size])
+            stage["bytes"] += size
+    return hash_obj.hexdigests()
+
+
+def hash_files(
+    file_paths, algorithms=HASH_ALGORITHMS, workers=None
+) -> dict[str, dict[str, str]]:
+    """Calculate checksums of several files at once on a thread pool.
+    hashlib releases the GIL while hashing large buffers, so files are
+    hashed in parallel
+
+    Args:
+        file_paths (list[str]): paths to files
+        algorithms (tuple[str], optional): hashlib algorithm names.
+            Defaults to md5 and sha256.
+        workers (int, optional): threads to hash files on. Defaults to the
+            number of CPUs.
+
+    Returns:
+        dict[str, dict[str, str]]: file path mapped to its checksums
+    """
+    file_paths = list(file_paths)
+    if not file_paths:
+        return {}
+    workers = min(workers or os.cpu_count() or 1, len(file_paths))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        checksums = executor.map(
+            hash_file, file_paths, [algorithms] * len(file_paths)
+        )
+        return dict(zip(file_paths, checksums))
@@ -0,0 +1,361 @@
+"""
+Compact positional index of a ClinVar release, memory-mapped and binary
+searched to look up variants without decompressing the VCF
+"""
+
+from __future__ import annotations
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+
+import dxpy
+
+from .hashing import hash_file
+from .telemetry import METRICS
+from .util import upload_file_DNAnexus
+from .vcf_reader import CHROMOSOME_ORDER, VCFRecord, read_vcf_records
+
+LOOKUP_MAGIC = b"PXLI"
+LOOKUP_VERSION = 1
+# magic, version, record count, chromosome count, string pool size
+HEADER = struct.Struct("<4sIIIQ")
+# chromosome name padded with nulls, index of first and after last record
+CHROMOSOME_ENTRY = struct.Struct("<16sII")
+# fields of each record stored in the string pool, separated by tabs
+POOL_FIELDS = ("variant_id", "ref", "alt", "clnsig", "review_status")
+# bytes of the temporary string pool copied to the index at a time
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def build_lookup_index(source, index_path) -> int:
+    """Build lookup index from a ClinVar VCF in one streaming pass.
+
+    The index holds a table of each chromosome's record range, an array of
+    positions sorted within each chromosome, and an offset table into a
+    string pool holding each record's ID, alleles, CLNSIG and review status.
+    Arrays are 8-byte aligned so they can be memory-mapped and used in place.
+    Strings are written to a temporary pool as records are read, so only
+    packed positions and pool offsets are held in memory. ClinVar VCFs are
+    sorted, so each chromosome's strings are copied to the index as one
+    block, and only chromosomes out of order are sorted and copied by record
+
+    Args:
+        source (str | file object): path to VCF, or binary file object
+        index_path (str): path to write index to
+
+    Raises:
+        RuntimeError: VCF has a chromosome name over 16 bytes or more than
+            4 GiB of strings
+
+    Returns:
+        int: number of records indexed
+    """
+    # positions, pool offsets and string lengths of each chromosome's
+    # records in file order
+    chromosomes = {}
+    # chromosomes whose records are not grouped together in the VCF
+    split = set()
+    last_chrom = None
+    pool_size = 0
+    with tempfile.TemporaryFile() as pool_file:
+        for record in read_vcf_records(source):
+            if record.chrom != last_chrom:
+                if record.chrom in chromosomes:
+                    split.add(record.chrom)
+                elif len(record.chrom.encode()) > CHROMOSOME_ENTRY.size - 8:
+                    raise RuntimeError(
+                        f"Chromosome name {record.chrom} is too long to index"
+                    )
+                else:
+                    chromosomes[record.chrom] = (
+                        array("I"), array("I"), array("I")
+                    )
+                last_chrom = record.chrom
+            entry = "\t".join(
+                getattr(record, field) or "" for field in POOL_FIELDS
+            ).encode()
+            positions, starts, lengths = chromosomes[record.chrom]
+            positions.append(record.pos)
+            starts.append(pool_size)
+            lengths.append(len(entry))
+            pool_file.write(entry)
+            pool_size += len(entry)
+            if pool_size >= 1 << 32:
+                raise RuntimeError("Too many strings in VCF to index")
+
+        names = sorted(chromosomes, key=lambda chrom: (
+            CHROMOSOME_ORDER.get(chrom, len(CHROMOSOME_ORDER)), chrom
+        ))
+        orders = {
+            chrom: get_sorted_order(chromosomes[chrom][0])
+            for chrom in names
+        }
+        record_count = sum(len(chromosomes[chrom][0]) for chrom in names)
+        with open(index_path, "wb") as index_file:
+            index_file.write(HEADER.pack(
+                LOOKUP_MAGIC, LOOKUP_VERSION, record_count, len(names),
+                pool_size
+            ))
+            start = 0
+            for chrom in names:
+                end = start + len(chromosomes[chrom][0])
+                index_file.write(
+                    CHROMOSOME_ENTRY.pack(chrom.encode(), start, end)
+                )
+                start = end
+
+            for chrom in names:
+                positions = chromosomes[chrom][0]
+                if orders[chrom] is not None:
+                    positions = array(
+                        "I", (positions[i] for i in orders[chrom])
+                    )
+                index_file.write(positions.tobytes())
+            write_padding(index_file, 4 * record_count)
+
+            offset = 0
+            index_file.write(array("I", [offset]).tobytes())
+            for chrom in names:
+                lengths = chromosomes[chrom][2]
+                offsets = array("I")
+                for i in orders[chrom] or range(len(lengths)):
+                    offset += lengths[i]
+                    offsets.append(offset)
+                index_file.write(offsets.tobytes())
+            write_padding(index_file, 4 * (record_count + 1))
+
+            for chrom in names:
+                _, starts, lengths = chromosomes[chrom]
+                if orders[chrom] is None and chrom not in split:
+                    copy_pool_range(
+                        pool_file, index_file, starts[0],
+                        starts[-1] + lengths[-1]
+                    )
+                    continue
+                for i in orders[chrom] or range(len(starts)):
+                    pool_file.seek(starts[i])
+                    index_file.write(pool_file.read(lengths[i]))
+    return record_count
+
+
+def get_sorted_order(positions) -> list[int] | None:
+    """Get the order sorting a chromosome's records by position
+
+    Args:
+        positions (array): positions of records in file order
+
+    Returns:
+        list[int] | None: indexes of records in sorted order, or None if
+            records are already sorted
+    """
+    if all(
+        positions[i] <= positions[i + 1] for i in range(len(positions) - 1)
+    ):
+        return None
+    # stable, so records at the same position keep file order
+    return sorted(range(len(positions)), key=positions.__getitem__)
+
+
+def copy_pool_range(pool_file, index_file, start, end) -> None:
+    """Copy a range of the temporary string pool to the index in chunks
+
+    Args:
+        pool_file (file object): temporary string pool
+        index_file (file object): index opened for binary writing
+        start (int): offset of first byte to copy
+        end (int): offset after last byte to copy
+    """
+    pool_file.seek(start)
+    while start < end:
+        chunk = pool_file.read(min(COPY_CHUNK_SIZE, end - start))
+        index_file.write(chunk)
+        start += len(chunk)
+
+
+def write_padding(index_file, size) -> None:
+    """Write nulls after data of size bytes up to the next multiple of 8
+
+    Args:
+        index_file (file object): index opened for binary writing
+        size (int): number of bytes of data written
+    """
+    index_file.write(b"\0" * (-size % 8))
+
+
+class ClinVarLookupIndex:
+    """Memory-mapped lookup index built by build_lookup_index. Records at a
+    position are found by binary search over the position array of their
+    chromosome, reading only the pages the search touches
+    """
+
+    def __init__(self, index_path):
+        """
+        Args:
+            index_path (str): path to lookup index
+
+        Raises:
+            RuntimeError: file is not a lookup index
+        """
+        with open(index_path, "rb") as index_file:
+            self._map = mmap.mmap(
+                index_file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        magic, version, record_count, chrom_count, pool_size = (
+            HEADER.unpack_from(self._map) if len(self._map) >= HEADER.size
+            else (None, None, 0, 0, 0)
+        )
+        if magic != LOOKUP_MAGIC or version != LOOKUP_VERSION:
+            self._map.close()
+            raise RuntimeError(f"{index_path} is not a ClinVar lookup index")
+        self.path = index_path
+        self.record_count = record_count
+        self.chromosomes = {}
+        offset = HEADER.size
+        for _ in range(chrom_count):
+            name, start, end = CHROMOSOME_ENTRY.unpack_from(self._map, offset)
+            self.chromosomes[name.rstrip(b"\0").decode()] = (start, end)
+            offset += CHROMOSOME_ENTRY.size
+        self._view = view = memoryview(self._map)
+        positions_size = 4 * record_count
+        self._positions = view[offset:offset + positions_size].cast("I")
+        offset += positions_size + (-positions_size % 8)
+        offsets_size = 4 * (record_count + 1)
+        self._offsets = view[offset:offset + offsets_size].cast("I")
+        offset += offsets_size + (-offsets_size % 8)
+        self._pool = view[offset:offset + pool_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.record_count
+
+    def close(self) -> None:
+        """Release the memory map
+        """
+        for view in (
+            self._positions, self._offsets, self._pool, self._view
+        ):
+            view.release()
+        self._map.close()
+
+    def lookup(self, chrom, pos, ref=None, alt=None) -> list[VCFRecord]:
+        """Find records at a position, optionally matching alleles
+
+        Args:
+            chrom (str): chromosome, with or without a chr prefix
+            pos (int): 1-based position
+            ref (str, optional): reference allele to match. Defaults to
+                None, which matches any.
+            alt (str, optional): alternate allele to match. Defaults to
+                None, which matches any.
+
+        Returns:
+            list[VCFRecord]: matching records in file order
+        """
+        chrom = self.normalise_chromosome(chrom)
+        if chrom not in self.chromosomes:
+            return []
+        start, end = self.chromosomes[chrom]
+        first = bisect_left(self._positions, pos, start, end)
+        last = bisect_right(self._positions, pos, first, end)
+        records = []
+        for index in range(first, last):
+            record = self.record(index, chrom)
+            if (ref is None or record.ref == ref) and (
+                alt is None or record.alt == alt
+            ):
+                records.append(record)
+        return records
+
+    def lookup_many(self, variants) -> list[list[VCFRecord]]:
+        """Find records for many variants at once
+
+        Args:
+            variants (Iterable[tuple]): chrom, pos and optionally ref and
+                alt of each variant
+
+        Returns:
+            list[list[VCFRecord]]: matching records for each variant, in the
+                order given
+        """
+        with METRICS.stage(
+            "lookup", index=os.path.basename(self.path)
+        ) as stage:
+            results = [self.lookup(*variant) for variant in variants]
+            stage["variants"] = len(results)
+        return results
+
+    def record(self, index, chrom) -> VCFRecord:
+        """Read record at index from the string pool
+
+        Args:
+            index (int): index of record in sorted record order
+            chrom (str): chromosome of record
+
+        Returns:
+            VCFRecord: record at index
+        """
+        fields = bytes(
+            self._pool[self._offsets[index]:self._offsets[index + 1]]
+        ).decode().split("\t")
+        variant_id, ref, alt, clnsig, review_status = fields
+        return VCFRecord(
+            chrom, self._positions[index], variant_id, ref, alt,
+            clnsig or None, review_status or None
+        )
+
+    def normalise_chromosome(self, chrom) -> str:
+        """Match chromosome names with or without a chr prefix, and M to MT
+
+        Args:
+            chrom (str): chromosome name, e.g. chr1 or 1
+
+        Returns:
+            str: chromosome name as used in the index
+        """
+        if chrom in self.chromosomes:
+            return chrom
+        if chrom.lower().startswith("chr"):
+            chrom = chrom[3:]
+        return "MT" if chrom in ("M", "m") else chrom
+
+
+def build_lookup_index_DNAnexus(
+    vcf_file_id, project_id, proj_folder_path, prefix, vcf_path=None
+) -> str:
+    """Build lookup index of a ClinVar VCF in DNAnexus and upload the index
+    to the update folder. The VCF is read from local disk if it was
+    downloaded there, and otherwise streamed from DNAnexus
+
+    Args:
+        vcf_file_id (str): DNAnexus file ID of VCF in project_id
+        project_id (str): DNAnexus project ID to upload index to
+        proj_folder_path (str): DNAnexus folder path to upload index to
+        prefix (str): prefix of index file name, e.g.
+            clinvar_20240107_GRCh38
+        vcf_path (str, optional): path to local copy of VCF. Defaults to
+            None.
+
+    Returns:
+        str: DNAnexus file ID of uploaded index
+    """
+    index_path = f"{prefix}_lookup.idx"
+    if vcf_path is not None and os.path.exists(vcf_path):
+        vcf_file = vcf_path
+    else:
+        vcf_file = dxpy.open_dxfile(
+            vcf_file_id, project=project_id, mode="rb"
+        )
+    with METRICS.stage("lookup_index", file=prefix) as stage:
+        stage["records"] = build_lookup_index(vcf_file, index_path)
+        stage["bytes"] = os.path.getsize(index_path)
+    return upload_file_DNAnexus(
+        index_path, project_id, proj_folder_path, hash_file(index_path)
+    )
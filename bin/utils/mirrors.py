@@ -0,0 +1,131 @@
+"""
+Equivalent FTP mirrors of the ClinVar release directories, probed for
+throughput and used to fail over transfers that stall on one mirror
+"""
+
+from __future__ import annotations
+import threading
+import time
+from urllib.parse import urlparse
+
+from .ftp_pool import FTP_POOL
+
+# bytes read from the start of a file to measure a mirror's throughput
+PROBE_BYTES = 4 * 1024 * 1024
+# bytes requested from the data connection per read while probing
+PROBE_BLOCK_SIZE = 256 * 1024
+
+
+class MirrorSet:
+    """Base links of equivalent mirrors, fastest first. A directory on one
+    mirror can be mapped to the same directory on every other mirror, so a
+    transfer from a mirror that stalls can carry on from another at the
+    byte offset it reached
+    """
+
+    def __init__(self):
+        self._base_links = []
+        self._lock = threading.Lock()
+
+    def set_mirrors(self, base_links) -> None:
+        """Replace mirrors transfers can fail over between
+
+        Args:
+            base_links (list[str]): base links of mirrors holding the same
+                files, e.g. https://ftp.ncbi.nlm.nih.gov, fastest first
+        """
+        with self._lock:
+            self._base_links = [
+                get_link_location(base_link) for base_link in base_links
+            ]
+
+    def alternatives(self, domain, path) -> list[tuple[str, str]]:
+        """Get the same directory on every other mirror
+
+        Args:
+            domain (str): ftp server domain, optionally followed by :port
+            path (str): directory on ftp server
+
+        Returns:
+            list[tuple[str, str]]: domain and directory on each other
+                mirror, fastest first, or an empty list if the directory is
+                not on a known mirror
+        """
+        location = f"{domain}{path}"
+        with self._lock:
+            base_links = list(self._base_links)
+        for base_link in base_links:
+            if not location.startswith(f"{base_link}/"):
+                continue
+            relative_path = location[len(base_link):]
+            return [
+                split_link_location(f"{other}{relative_path}")
+                for other in base_links if other != base_link
+            ]
+        return []
+
+
+def measure_read_throughput(
+    domain, path, website_filename, probe_bytes=PROBE_BYTES,
+    block_size=PROBE_BLOCK_SIZE
+) -> float:
+    """Time a short ranged read from the start of a file
+
+    Args:
+        domain (str): ftp server domain
+        path (str): directory containing file on ftp server
+        website_filename (str): name of file on ftp server
+        probe_bytes (int, optional): bytes to read. Defaults to 4 MiB.
+        block_size (int, optional): bytes requested from the data
+            connection per read. Defaults to 256 KiB.
+
+    Returns:
+        float: bytes per second received
+    """
+    ftp = FTP_POOL.acquire(domain, path)
+    received = 0
+    try:
+        ftp.voidcmd("TYPE I")
+        start = time.perf_counter()
+        with ftp.transfercmd("RETR " + website_filename, rest=0) as conn:
+            while received < probe_bytes:
+                block = conn.recv(min(block_size, probe_bytes - received))
+                if not block:
+                    break
+                received += len(block)
+        elapsed = time.perf_counter() - start
+    finally:
+        # closing the data connection early aborts the transfer, so the
+        # session may have unread replies and is not reused
+        FTP_POOL.discard(ftp)
+    return received / elapsed if elapsed > 0 else float("inf")
+
+
+def get_link_location(link) -> str:
+    """Get host and path of a link without its scheme or trailing slash
+
+    Args:
+        link (str): link, e.g. https://ftp.ncbi.nlm.nih.gov/pub/
+
+    Returns:
+        str: host and path, e.g. ftp.ncbi.nlm.nih.gov/pub
+    """
+    parsed_link = urlparse(link)
+    return f"{parsed_link.netloc}{parsed_link.path}".rstrip("/")
+
+
+def split_link_location(location) -> tuple[str, str]:
+    """Split host and path from get_link_location into domain and path
+
+    Args:
+        location (str): host and path, e.g. ftp.ncbi.nlm.nih.gov/pub/
+
+    Returns:
+        tuple[str, str]: domain and path, e.g. ftp.ncbi.nlm.nih.gov and
+            /pub/
+    """
+    domain, slash, path = location.partition("/")
+    return domain, f"{slash}{path}"
+
+
+FTP_MIRRORS = MirrorSet()
@@ -0,0 +1,181 @@
+"""
+Optional CPU and memory profiling of each stage of a run, written as
+pstats and allocation reports
+"""
+
+from __future__ import annotations
+import cProfile
+import io
+import itertools
+import os
+import pstats
+import re
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# functions listed in each stage's text CPU report
+TOP_FUNCTIONS = 40
+# source lines listed in each stage's allocation report
+TOP_ALLOCATIONS = 25
+# stack frames recorded per allocation
+ALLOCATION_FRAMES = 1
+
+
+class StageProfiler:
+    """Profiles the outermost stage open on each thread with cProfile, and
+    compares tracemalloc snapshots taken as the stage starts and ends.
+    Nested stages are covered by the profile of the stage containing them,
+    as cProfile cannot nest on one thread. From Python 3.12 only one
+    cProfile profiler can be active in a process, so a stage starting while
+    another thread's stage is profiled is recorded as not CPU profiled and
+    only gets an allocation report. tracemalloc traces the whole process, so
+    allocations by stages running at the same time on other threads also
+    appear in a stage's allocation report
+    """
+
+    def __init__(
+        self, output_dir, top_functions=TOP_FUNCTIONS,
+        top_allocations=TOP_ALLOCATIONS
+    ):
+        """
+        Args:
+            output_dir (str): directory reports are written to
+            top_functions (int, optional): functions listed in each text CPU
+                report. Defaults to TOP_FUNCTIONS.
+            top_allocations (int, optional): source lines listed in each
+                allocation report. Defaults to TOP_ALLOCATIONS.
+        """
+        self.output_dir = output_dir
+        self.top_functions = top_functions
+        self.top_allocations = top_allocations
+        self.reports = []
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def start(self) -> None:
+        """Start tracing memory allocations
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        tracemalloc.start(ALLOCATION_FRAMES)
+
+    def stop(self) -> None:
+        """Stop tracing memory allocations
+        """
+        tracemalloc.stop()
+
+    @contextmanager
+    def profile(self, record):
+        """Profile the enclosed block as a stage, unless a stage is already
+        being profiled on this thread. Reports are written once the block
+        ends, and the stage's net allocated bytes added to its record. If
+        another profiler is already active in the process the stage is not
+        CPU profiled, and its record's cpu_profiled is set to False
+
+        Args:
+            record (dict): metrics record of the stage
+        """
+        if getattr(self._local, "active", False) or not (
+            tracemalloc.is_tracing()
+        ):
+            yield
+            return
+        self._local.active = True
+        before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another thread's stage is profiled, and only one profiler can
+            # be active at once from Python 3.12
+            profile = None
+            record["cpu_profiled"] = False
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            after = tracemalloc.take_snapshot()
+            self._local.active = False
+            record["allocated_bytes"] = self.write_reports(
+                record, profile, before, after
+            )
+
+    def write_reports(self, record, profile, before, after) -> int:
+        """Write binary pstats, text CPU report and allocation report of a
+        stage, leaving out the CPU reports if it was not CPU profiled
+
+        Args:
+            record (dict): metrics record of the stage
+            profile (cProfile.Profile | None): CPU profile of the stage, or
+                None if it was not CPU profiled
+            before (tracemalloc.Snapshot): snapshot as the stage started
+            after (tracemalloc.Snapshot): snapshot as the stage ended
+
+        Returns:
+            int: net bytes allocated during the stage
+        """
+        with self._lock:
+            number = next(self._counter)
+        prefix = os.path.join(
+            self.output_dir, get_report_prefix(number, record)
+        )
+
+        reports = []
+        if profile is not None:
+            profile.dump_stats(f"{prefix}.pstats")
+            cpu_report = io.StringIO()
+            stats = pstats.Stats(profile, stream=cpu_report)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(
+                self.top_functions
+            )
+            with open(f"{prefix}_cpu.txt", "w", encoding="utf8") as report:
+                report.write(cpu_report.getvalue())
+            reports.extend([f"{prefix}.pstats", f"{prefix}_cpu.txt"])
+
+        # leave out allocations made by tracemalloc itself
+        trace_filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ]
+        differences = after.filter_traces(trace_filters).compare_to(
+            before.filter_traces(trace_filters), "lineno"
+        )
+        allocated_bytes = sum(stat.size_diff for stat in differences)
+        with open(
+            f"{prefix}_memory.txt", "w", encoding="utf8"
+        ) as report:
+            report.write(
+                f"Net allocated during stage: {allocated_bytes} bytes\n"
+                + f"Top {self.top_allocations} source lines by allocated"
+                + " bytes:\n"
+            )
+            for stat in differences[:self.top_allocations]:
+                report.write(f"{stat}\n")
+
+        reports.append(f"{prefix}_memory.txt")
+        with self._lock:
+            self.reports.extend(reports)
+        return allocated_bytes
+
+
+def get_report_prefix(number, record) -> str:
+    """Generate file name prefix of a stage's reports from the stage name
+    and labels, so reports sort in the order stages finished
+
+    Args:
+        number (int): order stage finished in
+        record (dict): metrics record of the stage
+
+    Returns:
+        str: prefix, e.g. 003_download_clinvar_20240107.vcf.gz
+    """
+    label = next(
+        (
+            str(record[key]) for key in ("file", "build", "mirror")
+            if key in record
+        ),
+        None
+    )
+    name = record["stage"] if label is None else f"{record['stage']}_{label}"
+    return f"{number:03d}_" + re.sub(r"[^0-9A-Za-z._-]+", "_", name)
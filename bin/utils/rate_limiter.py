@@ -0,0 +1,125 @@
+"""
+Process-wide rate limiting of new FTP connections, with backoff when the
+server reports it is overloaded
+"""
+
+import random
+import threading
+import time
+from ftplib import error_perm, error_temp
+
+# replies NCBI sends when too many connections are open or being opened
+THROTTLE_REPLY_CODES = ("421", "530")
+
+
+class RateLimiter:
+    """Token bucket limiting how often new connections are opened. Tokens
+    refill at rate per second up to burst, so runs that stay under the
+    limit never wait. When the server throttles a connection, every caller
+    waits out an exponential backoff with jitter before the next connection
+    """
+
+    def __init__(
+        self, rate=2.0, burst=4, base_backoff=1.0, max_backoff=60.0
+    ):
+        """
+        Args:
+            rate (float, optional): connections allowed per second on
+                average. Defaults to 2.
+            burst (int, optional): connections allowed at once before
+                waiting for the bucket to refill. Defaults to 4.
+            base_backoff (float, optional): seconds to back off after the
+                first throttled connection, doubling with each consecutive
+                throttle. Defaults to 1.
+            max_backoff (float, optional): maximum seconds to back off.
+                Defaults to 60.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._backoff_until = 0.0
+        self._throttled = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Wait until a new connection may be opened
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst,
+                    self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if now >= self._backoff_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(
+                    self._backoff_until - now, (1 - self._tokens) / self.rate
+                )
+            time.sleep(wait)
+
+    def backoff(self) -> float:
+        """Record that the server throttled a connection, delaying every
+        caller of acquire by an exponentially increasing, jittered time
+
+        Returns:
+            float: seconds until connections are allowed again
+        """
+        with self._lock:
+            delay = min(
+                self.max_backoff, self.base_backoff * 2 ** self._throttled
+            )
+            # jitter stops parallel transfers reconnecting in lockstep
+            delay = random.uniform(delay / 2, delay)
+            self._throttled += 1
+            self._backoff_until = max(
+                self._backoff_until, time.monotonic() + delay
+            )
+        return delay
+
+    def backoff_remaining(self) -> float:
+        """Seconds left until the current backoff ends
+
+        Returns:
+            float: seconds to wait, or 0 if not backing off
+        """
+        with self._lock:
+            return max(0.0, self._backoff_until - time.monotonic())
+
+    def wait_for_backoff(self) -> None:
+        """Wait until the current backoff ends, without using a token.
+        Used before reusing an open connection, which does not need a token
+        but should not send commands while the server is throttling
+        """
+        while (wait := self.backoff_remaining()) > 0:
+            time.sleep(wait)
+
+    def succeeded(self) -> None:
+        """Record a connection that was not throttled, resetting backoff
+        """
+        with self._lock:
+            self._throttled = 0
+
+
+def is_throttle_error(err) -> bool:
+    """Check if an error means the server is refusing connections because
+    of load, rather than the request being invalid
+
+    Args:
+        err (Exception): error raised by an FTP connection or command
+
+    Returns:
+        bool: should the connection be retried after backing off
+    """
+    if isinstance(err, (error_temp, error_perm)):
+        return str(err)[:3] in THROTTLE_REPLY_CODES
+    return isinstance(err, (ConnectionResetError, ConnectionRefusedError))
+
+
+# limiter shared by every FTP connection in the process
+RATE_LIMITER = RateLimiter()
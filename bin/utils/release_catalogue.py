@@ -0,0 +1,192 @@
+"""
+Persisted catalogue of ClinVar releases available on the ftp server
+"""
+
+from __future__ import annotations
+import json
+import os
+import re
+from ftplib import error_perm, error_reply
+
+# dated release files, e.g. clinvar_20240107.vcf.gz.tbi
+RELEASE_FILE_REGEX = re.compile(r"^clinvar_([0-9]{8})\.vcf\.gz(\.tbi|\.md5)?$")
+RELEASE_FILE_KINDS = {None: "vcf", ".tbi": "tbi", ".md5": "md5"}
+# undated copy of the newest release, which changes with every release
+LATEST_RELEASE_ALIAS = "clinvar.vcf.gz"
+
+
+class ReleaseCatalogue:
+    """Catalogue of known ClinVar release versions with the size and
+    modification time of their VCF, index and checksum files.
+
+    Refreshing first compares MDTM and SIZE of the undated latest release
+    alias against the values recorded at the last refresh, so the full
+    directory listing is only fetched and parsed when a new release has
+    been published
+    """
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str, optional): path to save catalogue to as json
+        """
+        self.path = path
+        self.releases = {}
+        self.latest_alias = None
+        self.newest_complete = None
+        self.last_processed = None
+
+    @classmethod
+    def load(cls, path) -> ReleaseCatalogue:
+        """Load catalogue from json file, or start an empty catalogue if
+        the file does not exist or cannot be read
+
+        Args:
+            path (str): path to catalogue json file
+
+        Returns:
+            ReleaseCatalogue: catalogue loaded from path
+        """
+        catalogue = cls(path)
+        try:
+            with open(path, "r", encoding="utf8") as json_file:
+                contents = json.load(json_file)
+        except (OSError, ValueError):
+            return catalogue
+        catalogue.releases = contents.get("releases", {})
+        catalogue.latest_alias = contents.get("latest_alias")
+        catalogue.newest_complete = contents.get("newest_complete")
+        catalogue.last_processed = contents.get("last_processed")
+        return catalogue
+
+    def save(self) -> None:
+        """Atomically write catalogue to its json file
+        """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf8") as json_file:
+            json.dump({
+                "releases": self.releases,
+                "latest_alias": self.latest_alias,
+                "newest_complete": self.newest_complete,
+                "last_processed": self.last_processed,
+            }, json_file, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def refresh(self, ftp) -> bool:
+        """Bring catalogue up to date with the ftp directory
+
+        Args:
+            ftp (ftplib.FTP): FTP session in ClinVar release directory
+
+        Returns:
+            bool: was the directory listing fetched because the newest
+                release may have changed
+        """
+        latest_alias = self._get_latest_alias_facts(ftp)
+        if (
+            latest_alias is not None
+            and latest_alias == self.latest_alias
+            and self.newest_complete is not None
+        ):
+            return False
+
+        try:
+            entries = [
+                (name, facts) for name, facts in ftp.mlsd(
+                    facts=["type", "size", "modify"]
+                )
+                if facts.get("type", "file") == "file"
+            ]
+        except (error_perm, error_reply):
+            # server does not support MLSD, fall back to parsing LIST
+            listing = []
+            ftp.retrlines("LIST", listing.append)
+            entries = [
+                (line.split()[-1], {}) for line in listing if line.strip()
+            ]
+        self.update_releases(entries)
+        self.latest_alias = latest_alias
+        return True
+
+    def update_releases(self, entries) -> None:
+        """Replace catalogue releases with files from a directory listing
+
+        Args:
+            entries (list[tuple[str, dict]]): file names in directory with
+                MLSD facts for each file
+        """
+        releases = {}
+        for name, facts in entries:
+            match = RELEASE_FILE_REGEX.match(name)
+            if match is None:
+                continue
+            version, extension = match.groups()
+            releases.setdefault(version, {})[
+                RELEASE_FILE_KINDS[extension]
+            ] = {
+                "name": name,
+                "size": int(facts["size"]) if "size" in facts else None,
+                "modify": facts.get("modify"),
+            }
+        self.releases = releases
+        complete_versions = [
+            version for version, files in releases.items()
+            if len(files) == len(RELEASE_FILE_KINDS)
+        ]
+        self.newest_complete = max(complete_versions, default=None)
+
+    def newest_complete_release(self) -> dict | None:
+        """Get newest release with VCF, index and checksum all present
+
+        Returns:
+            dict | None: release version and file information for each of
+                "vcf", "tbi" and "md5", or None if there is no complete
+                release
+        """
+        if self.newest_complete is None:
+            return None
+        return {
+            "version": self.newest_complete,
+            **self.releases[self.newest_complete]
+        }
+
+    def complete_releases(self, start=None, end=None) -> list[dict]:
+        """Get every release with VCF, index and checksum all present whose
+        version is within a date window
+
+        Args:
+            start (str, optional): earliest version to include, as
+                YYYYMMDD. Defaults to None, for no lower limit.
+            end (str, optional): latest version to include, as YYYYMMDD.
+                Defaults to None, for no upper limit.
+
+        Returns:
+            list[dict]: release version and file information for each of
+                "vcf", "tbi" and "md5", oldest release first
+        """
+        return [
+            {"version": version, **files}
+            for version, files in sorted(self.releases.items())
+            if len(files) == len(RELEASE_FILE_KINDS)
+            and (start is None or version >= start)
+            and (end is None or version <= end)
+        ]
+
+    @staticmethod
+    def _get_latest_alias_facts(ftp) -> dict | None:
+        """Get modification time and size of the undated latest release
+
+        Args:
+            ftp (ftplib.FTP): FTP session in ClinVar release directory
+
+        Returns:
+            dict | None: modification time and size of latest release
+                alias, or None if the server does not provide them
+        """
+        try:
+            ftp.voidcmd("TYPE I")
+            modify = ftp.sendcmd(f"MDTM {LATEST_RELEASE_ALIAS}").split()[-1]
+            size = ftp.size(LATEST_RELEASE_ALIAS)
+        except (error_perm, error_reply):
+            return None
+        return {"modify": modify[:14], "size": size}
@@ -0,0 +1,197 @@
+"""
+Streaming comparison of two coordinate-sorted ClinVar releases
+"""
+
+from __future__ import annotations
+import json
+import os
+from contextlib import nullcontext
+from typing import Iterator
+
+import dxpy
+
+from .hashing import hash_files
+from .telemetry import METRICS
+from .util import upload_file_DNAnexus
+from .vcf_reader import CHROMOSOME_ORDER, VCFRecord, read_vcf_records
+
+DIFF_COLUMNS = [
+    "change", "chrom", "pos", "id", "ref", "alt", "previous_clnsig",
+    "new_clnsig", "previous_review_status", "new_review_status"
+]
+
+
+def diff_releases(previous_source, new_source, diff_path) -> dict:
+    """Merge-join two coordinate-sorted ClinVar VCFs in a single streaming
+    pass, writing added, removed and reclassified variants to a TSV.
+    Records at the same position are matched on ClinVar variation ID, so
+    memory use only depends on the number of records at one position
+
+    Args:
+        previous_source (str | file object): VCF of previous release
+        new_source (str | file object): VCF of new release
+        diff_path (str): path to write TSV of changes to
+
+    Raises:
+        RuntimeError: VCF is not sorted by coordinate
+
+    Returns:
+        dict: number of records in each release, and number of variants
+            added, removed, reclassified and unchanged. Reclassified
+            variants are also counted by whether CLNSIG or review status
+            changed
+    """
+    summary = dict.fromkeys([
+        "previous_records", "new_records", "added", "removed",
+        "reclassified", "clnsig_changed", "review_status_changed",
+        "unchanged"
+    ], 0)
+    previous_groups = group_records_by_position(
+        read_vcf_records(previous_source), "Previous"
+    )
+    new_groups = group_records_by_position(
+        read_vcf_records(new_source), "New"
+    )
+
+    with open(diff_path, "w", encoding="utf8") as diff_file:
+        diff_file.write("\t".join(DIFF_COLUMNS) + "\n")
+
+        def write_change(change, previous=None, new=None):
+            record = new or previous
+            diff_file.write("\t".join([
+                change, record.chrom, str(record.pos), record.variant_id,
+                record.ref, record.alt,
+                (previous and previous.clnsig) or ".",
+                (new and new.clnsig) or ".",
+                (previous and previous.review_status) or ".",
+                (new and new.review_status) or ".",
+            ]) + "\n")
+            summary[change] += 1
+
+        previous_group = next(previous_groups, None)
+        new_group = next(new_groups, None)
+        while previous_group is not None or new_group is not None:
+            if new_group is None or (
+                previous_group is not None
+                and previous_group[0] < new_group[0]
+            ):
+                previous_records, new_records = previous_group[1], []
+                previous_group = next(previous_groups, None)
+            elif previous_group is None or new_group[0] < previous_group[0]:
+                previous_records, new_records = [], new_group[1]
+                new_group = next(new_groups, None)
+            else:
+                previous_records, new_records = (
+                    previous_group[1], new_group[1]
+                )
+                previous_group = next(previous_groups, None)
+                new_group = next(new_groups, None)
+
+            summary["previous_records"] += len(previous_records)
+            summary["new_records"] += len(new_records)
+            previous_by_id = {
+                record.variant_id: record for record in previous_records
+            }
+            for new in new_records:
+                previous = previous_by_id.pop(new.variant_id, None)
+                if previous is None:
+                    write_change("added", new=new)
+                    continue
+                clnsig_changed = previous.clnsig != new.clnsig
+                review_status_changed = (
+                    previous.review_status != new.review_status
+                )
+                if not (clnsig_changed or review_status_changed):
+                    summary["unchanged"] += 1
+                    continue
+                write_change("reclassified", previous, new)
+                summary["clnsig_changed"] += clnsig_changed
+                summary["review_status_changed"] += review_status_changed
+            for previous in previous_by_id.values():
+                write_change("removed", previous=previous)
+    return summary
+
+
+def group_records_by_position(records, label) -> Iterator[
+    tuple[tuple, list[VCFRecord]]
+]:
+    """Group consecutive records at the same position, checking positions
+    are in coordinate order
+
+    Args:
+        records (Iterator[VCFRecord]): records in file order
+        label (str): name of file used in errors
+
+    Raises:
+        RuntimeError: records are not sorted by coordinate
+
+    Yields:
+        tuple[tuple, list[VCFRecord]]: sort key of position and the records
+            at that position
+    """
+    key = None
+    group = []
+    for record in records:
+        record_key = (
+            CHROMOSOME_ORDER.get(record.chrom, len(CHROMOSOME_ORDER)),
+            record.chrom, record.pos
+        )
+        if record_key != key:
+            if key is not None:
+                if record_key < key:
+                    raise RuntimeError(
+                        f"{label} ClinVar VCF is not sorted by coordinate at"
+                        + f" {record.chrom}:{record.pos}"
+                    )
+                yield key, group
+            key = record_key
+            group = []
+        group.append(record)
+    if group:
+        yield key, group
+
+
+def diff_releases_DNAnexus(
+    previous_file_id, new_file_id, project_id, proj_folder_path, prefix,
+    new_file_path=None
+) -> dict:
+    """Compare ClinVar VCF in DNAnexus against a previous release, streaming
+    the previous release from DNAnexus, and upload the TSV of changes and
+    summary counts to the update folder. The new release is read from local
+    disk if it was downloaded there, and otherwise streamed from DNAnexus
+
+    Args:
+        previous_file_id (str): DNAnexus file ID of previous release, as
+            file-xxxx or project-xxxx:file-xxxx
+        new_file_id (str): DNAnexus file ID of new release in project_id
+        project_id (str): DNAnexus project ID to upload diff to
+        proj_folder_path (str): DNAnexus folder path to upload diff to
+        prefix (str): prefix of diff file names, e.g. clinvar_20240107_GRCh38
+        new_file_path (str, optional): path to local copy of new release.
+            Defaults to None.
+
+    Returns:
+        dict: summary counts returned by diff_releases
+    """
+    previous_project, _, previous_id = previous_file_id.rpartition(":")
+    diff_path = f"{prefix}_diff.tsv"
+    summary_path = f"{prefix}_diff_summary.json"
+    with dxpy.open_dxfile(
+        previous_id, project=previous_project or None, mode="rb"
+    ) as previous_file, (
+        nullcontext(new_file_path)
+        if new_file_path is not None and os.path.exists(new_file_path)
+        else dxpy.open_dxfile(new_file_id, project=project_id, mode="rb")
+    ) as new_file, METRICS.stage("release_diff", file=prefix):
+        summary = diff_releases(previous_file, new_file, diff_path)
+    with open(summary_path, "w", encoding="utf8") as summary_file:
+        json.dump(
+            {"previous": previous_file_id, "new": new_file_id, **summary},
+            summary_file, indent=1
+        )
+    checksums = hash_files([diff_path, summary_path])
+    for path, file_checksums in checksums.items():
+        upload_file_DNAnexus(
+            path, project_id, proj_folder_path, file_checksums
+        )
+    return summary
@@ -0,0 +1,192 @@
+"""
+Manifest of each update's progress, stored in its DNAnexus update folder so
+a rerun after a failure resumes where the last run stopped
+"""
+
+from __future__ import annotations
+import os
+import threading
+
+import dxpy
+
+from .hashing import hash_file
+from .telemetry import METRICS
+from .util import create_proj_folder_if_missing
+
+# name of the record holding the manifest in each update folder
+MANIFEST_NAME = "phoenix_run_manifest"
+# steps each file passes through, in order
+FILE_STATES = ("downloaded", "verified", "uploaded")
+
+
+class RunManifest:
+    """Progress of one ClinVar version's update, held as the details of an
+    open DNAnexus record in the update folder. Details are saved after
+    every step, recording the files listed for the version, each file's
+    state, checksums and uploaded file ID, and whether the update completed
+    """
+
+    def __init__(self, record, details=None):
+        """
+        Args:
+            record (dxpy.DXRecord): open record holding the manifest
+            details (dict, optional): manifest contents saved by an earlier
+                run. Defaults to None, for an empty manifest.
+        """
+        self.record = record
+        self.details = details or {}
+        self.details.setdefault("files", {})
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, project_id, folder_path) -> RunManifest:
+        """Load the manifest in an update folder, creating the folder and
+        an empty manifest if this is the first run for the version
+
+        Args:
+            project_id (str): DNAnexus project ID for update project
+            folder_path (str): DNAnexus path to update folder
+
+        Returns:
+            RunManifest: manifest for the update folder
+        """
+        with METRICS.stage("manifest_load", folder=folder_path):
+            create_proj_folder_if_missing(project_id, folder_path)
+            found = dxpy.find_one_data_object(
+                classname="record", name=MANIFEST_NAME, project=project_id,
+                folder=folder_path, recurse=False, zero_ok=True
+            )
+            if found is None:
+                return cls(dxpy.new_dxrecord(
+                    project=project_id, folder=folder_path,
+                    name=MANIFEST_NAME, details={"files": {}}, close=False
+                ))
+            record = dxpy.DXRecord(found["id"], project=project_id)
+            return cls(record, record.get_details())
+
+    @property
+    def completed(self) -> bool:
+        """Has every step of the update finished
+        """
+        return self.details.get("completed", False)
+
+    def get(self, key):
+        """Get value recorded for an update step
+
+        Args:
+            key (str): name of step, e.g. listed
+
+        Returns:
+            value recorded for step, or None if it has not been recorded
+        """
+        with self._lock:
+            return self.details.get(key)
+
+    def set(self, key, value) -> None:
+        """Record value for an update step and save the manifest
+
+        Args:
+            key (str): name of step, e.g. listed
+            value: JSON serialisable value to record
+        """
+        with self._lock:
+            self.details[key] = value
+            self._save()
+
+    def get_file(self, file_name) -> dict:
+        """Get recorded progress of a file
+
+        Args:
+            file_name (str): name file is uploaded as
+
+        Returns:
+            dict: copy of fields recorded for file, empty if the file has
+                not been recorded
+        """
+        with self._lock:
+            return dict(self.details["files"].get(file_name, {}))
+
+    def update_file(self, file_name, state, **fields) -> None:
+        """Record a file reaching a step and save the manifest
+
+        Args:
+            file_name (str): name file is uploaded as
+            state (str): step file has reached, one of FILE_STATES
+            **fields: other JSON serialisable fields to record for file,
+                e.g. file_id or checksums
+        """
+        with self._lock:
+            self.details["files"].setdefault(file_name, {}).update(
+                state=state, **fields
+            )
+            self._save()
+
+    def uploaded_file_id(self, file_name, project_id) -> str | None:
+        """Get ID of a file an earlier run uploaded, if it is still closed
+        in the project
+
+        Args:
+            file_name (str): name file is uploaded as
+            project_id (str): DNAnexus project ID file was uploaded to
+
+        Returns:
+            str | None: DNAnexus file ID, or None if the file has not been
+                uploaded or has since been removed
+        """
+        file_id = self.get_file(file_name).get("file_id")
+        if file_id is None:
+            return None
+        try:
+            state = dxpy.DXFile(file_id, project=project_id).describe(
+                fields={"state"}
+            )["state"]
+        except dxpy.exceptions.DXError:
+            return None
+        return file_id if state == "closed" else None
+
+    def local_checksums(self, file_name) -> dict[str, str] | None:
+        """Get checksums of a file an earlier run downloaded, if it is
+        still on local disk unchanged
+
+        Args:
+            file_name (str): name file is uploaded as, which is also its
+                local path
+
+        Returns:
+            dict[str, str] | None: checksums recorded for file, or None if
+                the file must be downloaded again
+        """
+        recorded = self.get_file(file_name)
+        if recorded.get("state") not in FILE_STATES or not (
+            os.path.exists(file_name)
+            and os.path.getsize(file_name) == recorded.get("size")
+        ):
+            return None
+        checksums = hash_file(file_name)
+        return checksums if checksums == recorded.get("checksums") else None
+
+    def local_path(self, file_name) -> str | None:
+        """Get local path of a file downloaded and checked against its
+        published checksum, if it is still on local disk, without hashing
+        it again
+
+        Args:
+            file_name (str): name file is uploaded as, which is also its
+                local path
+
+        Returns:
+            str | None: local path to file, or None if it is not on local
+                disk at the size recorded once it was downloaded
+        """
+        recorded = self.get_file(file_name)
+        if recorded.get("state") not in FILE_STATES or not (
+            os.path.exists(file_name)
+            and os.path.getsize(file_name) == recorded.get("size")
+        ):
+            return None
+        return file_name
+
+    def _save(self) -> None:
+        """Write details to the record. The caller must hold the lock
+        """
+        self.record.set_details(self.details)
@@ -0,0 +1,407 @@
+"""
+Reading, cross-checking and rebuilding tabix (.tbi) indexes of BGZF
+compressed VCFs
+"""
+
+from __future__ import annotations
+import mmap
+import struct
+import zlib
+from typing import Iterator
+
+from .bgzf import BGZFWriter, HEADER_SIZE, TRAILER_SIZE, scan_bgzf_blocks
+
+TBI_MAGIC = b"TBI\x01"
+# bin holding each reference's offset range and record counts
+PSEUDO_BIN = 37450
+# linear index window size is 1 << LINEAR_SHIFT bases
+LINEAR_SHIFT = 14
+# tabix VCF preset: format, sequence, begin and end columns, meta character
+# and lines to skip
+VCF_PRESET = (2, 1, 2, 0, ord("#"), 0)
+
+
+class TabixIndex:
+    """Contents of a tabix index. Chunks are pairs of BGZF virtual
+    offsets, the compressed offset of a block shifted left 16 bits plus the
+    offset into the uncompressed block
+    """
+
+    def __init__(self, preset, names, bins, linear):
+        """
+        Args:
+            preset (tuple[int]): format, column and meta settings
+            names (list[str]): name of each reference sequence
+            bins (list[dict[int, list[tuple[int, int]]]]): chunks in each
+                bin, per reference
+            linear (list[list[int]]): smallest virtual offset in each
+                linear index window, per reference
+        """
+        self.preset = preset
+        self.names = names
+        self.bins = bins
+        self.linear = linear
+
+    def to_bytes(self) -> bytes:
+        """Serialise index to uncompressed tabix format
+
+        Returns:
+            bytes: uncompressed index contents
+        """
+        names = b"".join(name.encode() + b"\0" for name in self.names)
+        content = bytearray(TBI_MAGIC)
+        content += struct.pack(
+            "<7ii", len(self.names), *self.preset, len(names)
+        )
+        content += names
+        for bins, linear in zip(self.bins, self.linear):
+            content += struct.pack("<i", len(bins))
+            for bin_number, chunks in bins.items():
+                content += struct.pack("<Ii", bin_number, len(chunks))
+                for chunk in chunks:
+                    content += struct.pack("<QQ", *chunk)
+            content += struct.pack(f"<i{len(linear)}Q", len(linear), *linear)
+        return bytes(content)
+
+
+def read_tabix_index(index_path) -> TabixIndex:
+    """Read tabix index, decompressing it from a memory mapped buffer
+
+    Args:
+        index_path (str): path to .tbi file
+
+    Raises:
+        RuntimeError: file is not a tabix index
+
+    Returns:
+        TabixIndex: parsed index
+    """
+    with open(index_path, "rb") as index_file, mmap.mmap(
+        index_file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        try:
+            content = b"".join(
+                decompress_block(data, offset, block_size)
+                for offset, block_size in scan_bgzf_blocks(data, index_path)
+            )
+        except zlib.error as err:
+            raise RuntimeError(
+                f"{index_path} is not a valid tabix index: {err}"
+            )
+
+    view = memoryview(content)
+    try:
+        if view[:4] != TBI_MAGIC:
+            raise ValueError("no tabix magic number")
+        n_ref, *preset, names_length = struct.unpack_from("<7ii", view, 4)
+        position = 36
+        names = bytes(
+            view[position:position + names_length]
+        ).decode().split("\0")[:n_ref]
+        position += names_length
+        all_bins = []
+        all_linear = []
+        for _ in range(n_ref):
+            n_bin, = struct.unpack_from("<i", view, position)
+            position += 4
+            bins = {}
+            for _ in range(n_bin):
+                bin_number, n_chunk = struct.unpack_from("<Ii", view, position)
+                position += 8
+                chunks = struct.unpack_from(f"<{2 * n_chunk}Q", view, position)
+                position += 16 * n_chunk
+                bins[bin_number] = list(zip(chunks[::2], chunks[1::2]))
+            n_linear, = struct.unpack_from("<i", view, position)
+            position += 4
+            all_linear.append(list(
+                struct.unpack_from(f"<{n_linear}Q", view, position)
+            ))
+            position += 8 * n_linear
+            all_bins.append(bins)
+    except (ValueError, struct.error, UnicodeDecodeError) as err:
+        raise RuntimeError(f"{index_path} is not a valid tabix index: {err}")
+    return TabixIndex(tuple(preset), names, all_bins, all_linear)
+
+
+def check_tabix_index(index_path, vcf_path) -> list[str]:
+    """Cross-check a tabix index against the BGZF VCF it indexes. Every
+    virtual offset in the index must point into a BGZF block of the VCF,
+    and the first record indexed for each reference must be on that contig
+
+    Args:
+        index_path (str): path to .tbi file
+        vcf_path (str): path to BGZF compressed VCF
+
+    Returns:
+        list[str]: problems found, empty if the index matches the VCF
+    """
+    try:
+        index = read_tabix_index(index_path)
+    except RuntimeError as err:
+        return [str(err)]
+
+    problems = []
+    with open(vcf_path, "rb") as vcf_file, mmap.mmap(
+        vcf_file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        blocks = dict(scan_bgzf_blocks(data, vcf_path))
+        # uncompressed size of each block, from its ISIZE field
+        block_sizes = {
+            offset: struct.unpack_from("<I", data, offset + size - 4)[0]
+            for offset, size in blocks.items()
+        }
+
+        def valid_offset(virtual_offset):
+            block_offset = virtual_offset >> 16
+            return (
+                block_offset in block_sizes
+                and virtual_offset & 0xFFFF <= block_sizes[block_offset]
+            ) or (block_offset == len(data) and virtual_offset & 0xFFFF == 0)
+
+        for name, bins, linear in zip(index.names, index.bins, index.linear):
+            chunks = [
+                chunk for bin_number, bin_chunks in bins.items()
+                for chunk in (
+                    bin_chunks[:1] if bin_number == PSEUDO_BIN
+                    else bin_chunks
+                )
+            ]
+            invalid = [
+                offset for chunk in chunks for offset in chunk
+                if not valid_offset(offset)
+            ] + [
+                offset for offset in linear
+                if offset and not valid_offset(offset)
+            ]
+            if invalid:
+                problems.append(
+                    f"{len(invalid)} offsets for {name} do not point into"
+                    + " a BGZF block of the VCF"
+                )
+                continue
+            if not chunks:
+                problems.append(f"No records are indexed for {name}")
+                continue
+            first_line = read_line_at(data, min(chunks)[0], blocks)
+            if not first_line.startswith(f"{name}\t".encode()):
+                problems.append(
+                    f"First record indexed for {name} is on another contig"
+                )
+    return problems
+
+
+def build_tabix_index(vcf_path, index_path) -> TabixIndex:
+    """Rebuild tabix index of a BGZF compressed VCF in a single streaming
+    pass, and write it to index_path
+
+    Args:
+        vcf_path (str): path to coordinate sorted BGZF compressed VCF
+        index_path (str): path to write .tbi file to
+
+    Raises:
+        RuntimeError: VCF is not sorted by coordinate
+
+    Returns:
+        TabixIndex: index written
+    """
+    names = []
+    all_bins = []
+    all_linear = []
+    chrom = None
+    for line, start, end in iter_vcf_lines(vcf_path):
+        if not line or line.startswith(b"#"):
+            continue
+        fields = line.split(b"\t", 4)
+        beg = int(fields[1]) - 1
+        record_end = beg + max(len(fields[3]), 1)
+        if fields[0].decode() != chrom:
+            if chrom is not None:
+                finish_reference(bins, linear, chunk, reference)
+            chrom = fields[0].decode()
+            if chrom in names:
+                raise RuntimeError(
+                    f"VCF {vcf_path} is not sorted: {chrom} records are not"
+                    + " contiguous"
+                )
+            names.append(chrom)
+            bins = {}
+            linear = []
+            all_bins.append(bins)
+            all_linear.append(linear)
+            chunk = None
+            reference = [start, end, 0]
+            last_beg = -1
+        if beg < last_beg:
+            raise RuntimeError(
+                f"VCF {vcf_path} is not sorted by position at"
+                + f" {chrom}:{beg + 1}"
+            )
+        last_beg = beg
+
+        bin_number = reg2bin(beg, record_end)
+        if chunk is None or chunk[0] != bin_number:
+            if chunk is not None:
+                add_chunk(bins, *chunk)
+            chunk = [bin_number, start, end]
+        else:
+            chunk[2] = end
+        for window in range(
+            beg >> LINEAR_SHIFT, ((record_end - 1) >> LINEAR_SHIFT) + 1
+        ):
+            if window >= len(linear):
+                linear.extend([None] * (window + 1 - len(linear)))
+            if linear[window] is None:
+                linear[window] = start
+        reference[1] = end
+        reference[2] += 1
+    if chrom is not None:
+        finish_reference(bins, linear, chunk, reference)
+
+    index = TabixIndex(VCF_PRESET, names, all_bins, all_linear)
+    with BGZFWriter(index_path) as writer:
+        writer.write(index.to_bytes())
+    return index
+
+
+def add_chunk(bins, bin_number, start, end) -> None:
+    """Add chunk to bin, merging it into the bin's last chunk if they end
+    and start in the same BGZF block
+
+    Args:
+        bins (dict[int, list[list[int]]]): chunks in each bin
+        bin_number (int): bin to add chunk to
+        start (int): virtual offset of first record in chunk
+        end (int): virtual offset after last record in chunk
+    """
+    chunks = bins.setdefault(bin_number, [])
+    if chunks and chunks[-1][1] >> 16 == start >> 16:
+        chunks[-1] = (chunks[-1][0], end)
+    else:
+        chunks.append((start, end))
+
+
+def finish_reference(bins, linear, chunk, reference) -> None:
+    """Add the last chunk and the pseudo bin for a reference, and fill gaps
+    in its linear index
+
+    Args:
+        bins (dict[int, list[list[int]]]): chunks in each bin
+        linear (list[int | None]): linear index, None for empty windows
+        chunk (list[int]): bin, start and end of last chunk
+        reference (list[int]): first and last virtual offset and number of
+            records of reference
+    """
+    add_chunk(bins, *chunk)
+    bins[PSEUDO_BIN] = [(reference[0], reference[1]), (reference[2], 0)]
+    previous = 0
+    for window, offset in enumerate(linear):
+        if offset is None:
+            linear[window] = previous
+        else:
+            previous = offset
+
+
+def iter_vcf_lines(vcf_path) -> Iterator[tuple[bytes, int, int]]:
+    """Stream lines of a BGZF file with their virtual offsets
+
+    Args:
+        vcf_path (str): path to BGZF compressed VCF
+
+    Yields:
+        tuple[bytes, int, int]: line without newline, and virtual offsets
+            of the start of the line and of the byte after its newline
+    """
+    with open(vcf_path, "rb") as vcf_file, mmap.mmap(
+        vcf_file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        blocks = scan_bgzf_blocks(data, vcf_path)
+        partial = b""
+        partial_start = None
+        for index, (offset, block_size) in enumerate(blocks):
+            block = decompress_block(data, offset, block_size)
+            next_offset = offset + block_size
+            position = 0
+            while position < len(block):
+                newline = block.find(b"\n", position)
+                if partial_start is None:
+                    partial_start = offset << 16 | position
+                if newline == -1:
+                    partial += block[position:]
+                    break
+                line_end = newline + 1
+                # an offset at the end of a block is given as the start of
+                # the next block, as htslib does
+                end = (
+                    next_offset << 16 if line_end == len(block)
+                    else offset << 16 | line_end
+                )
+                yield partial + block[position:newline], partial_start, end
+                partial = b""
+                partial_start = None
+                position = line_end
+        if partial:
+            yield partial, partial_start, len(data) << 16
+
+
+def read_line_at(data, virtual_offset, blocks) -> bytes:
+    """Read the line starting at a virtual offset of a BGZF file
+
+    Args:
+        data (mmap.mmap): contents of BGZF file
+        virtual_offset (int): virtual offset of start of line
+        blocks (dict[int, int]): compressed size of the block at each
+            offset
+
+    Returns:
+        bytes: line, read across following blocks if needed
+    """
+    offset = virtual_offset >> 16
+    line = b""
+    position = virtual_offset & 0xFFFF
+    while offset in blocks:
+        block_size = blocks[offset]
+        block = decompress_block(data, offset, block_size)[position:]
+        newline = block.find(b"\n")
+        if newline != -1:
+            return line + block[:newline]
+        line += block
+        offset += block_size
+        position = 0
+    return line
+
+
+def decompress_block(data, offset, block_size) -> bytes:
+    """Decompress a single BGZF block
+
+    Args:
+        data (mmap.mmap): contents of BGZF file
+        offset (int): offset of block in file
+        block_size (int): compressed size of block
+
+    Returns:
+        bytes: uncompressed block contents
+    """
+    extra_length, = struct.unpack_from("<H", data, offset + 10)
+    return zlib.decompress(
+        data[offset + HEADER_SIZE + extra_length:
+             offset + block_size - TRAILER_SIZE],
+        -15
+    )
+
+
+def reg2bin(beg, end) -> int:
+    """Calculate smallest bin containing a region, as in the SAM
+    specification
+
+    Args:
+        beg (int): 0-based start of region
+        end (int): 0-based end of region, exclusive
+
+    Returns:
+        int: bin number
+    """
+    end -= 1
+    for shift, offset in ((14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)):
+        if beg >> shift == end >> shift:
+            return offset + (beg >> shift)
+    return 0
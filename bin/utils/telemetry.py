@@ -0,0 +1,186 @@
+"""
+Per-stage timing, throughput and DNAnexus API call telemetry for a run
+"""
+
+from __future__ import annotations
+import datetime
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import dxpy
+import dxpy.api
+
+MEGABYTE = 1024 * 1024
+
+
+class RunMetrics:
+    """Records duration, bytes transferred, MB/s, FTP retries and
+    DNAnexus API calls for each stage of a run, written out as JSON lines.
+
+    Stages may be nested and run concurrently on different threads. Retries
+    and API calls are added to every stage open on the thread they happen
+    on, and to the run totals. API calls made on dxpy's own upload threads
+    are only counted in the run totals. If a profiler is set, each stage is
+    also profiled by it
+    """
+
+    def __init__(self):
+        self.records = []
+        self.retries = 0
+        self.dx_api_calls = 0
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._dx_request = None
+        # StageProfiler set for runs with profiling enabled
+        self.profiler = None
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """Time the enclosed block as a stage. The record yielded can have
+        its "bytes" updated as data is transferred
+
+        Args:
+            name (str): name of stage, e.g. download
+            labels: extra fields to record for the stage, e.g. file name
+
+        Yields:
+            dict: record for stage
+        """
+        record = {
+            "stage": name,
+            **labels,
+            "started": datetime.datetime.now(
+                datetime.timezone.utc
+            ).isoformat(timespec="milliseconds"),
+            "bytes": 0,
+            "retries": 0,
+            "dx_api_calls": 0,
+        }
+        open_stages = self._open_stages()
+        open_stages.append(record)
+        # profiling wraps the timed block, so writing reports is not timed
+        with self._profile(record):
+            start = time.perf_counter()
+            try:
+                yield record
+            except BaseException as err:
+                record["error"] = type(err).__name__
+                raise
+            finally:
+                seconds = time.perf_counter() - start
+                open_stages.remove(record)
+                record["seconds"] = round(seconds, 4)
+                record["mb_per_s"] = round(
+                    record["bytes"] / MEGABYTE / seconds, 2
+                ) if record["bytes"] and seconds else None
+                with self._lock:
+                    self.records.append(record)
+
+    def count_retry(self) -> None:
+        """Count a retried transfer against the open stages and the run
+        """
+        self._count("retries")
+
+    def count_dx_api_call(self) -> None:
+        """Count a DNAnexus API request against the open stages and the run
+        """
+        self._count("dx_api_calls")
+
+    @contextmanager
+    def count_dx_api_calls(self):
+        """Wrap dxpy's HTTP request function while the enclosed block runs,
+        so every DNAnexus API call made through dxpy is counted. The
+        original function is restored once the block ends. Nested blocks
+        have no further effect
+        """
+        if self._dx_request is not None:
+            yield
+            return
+        api_request = self._dx_request = dxpy.api.DXHTTPRequest
+        package_request = dxpy.DXHTTPRequest
+
+        def counted_request(*args, **kwargs):
+            self.count_dx_api_call()
+            return api_request(*args, **kwargs)
+
+        # dxpy.api binds its own reference to the request function, and
+        # file uploads call it through the dxpy package
+        dxpy.api.DXHTTPRequest = counted_request
+        dxpy.DXHTTPRequest = counted_request
+        try:
+            yield
+        finally:
+            dxpy.api.DXHTTPRequest = api_request
+            dxpy.DXHTTPRequest = package_request
+            self._dx_request = None
+
+    def summary(self) -> dict:
+        """Totals for the whole run
+
+        Returns:
+            dict: run duration, retries and DNAnexus API calls
+        """
+        with self._lock:
+            return {
+                "stage": "run",
+                "started": datetime.datetime.fromtimestamp(
+                    self.started, datetime.timezone.utc
+                ).isoformat(timespec="milliseconds"),
+                "seconds": round(time.time() - self.started, 4),
+                "retries": self.retries,
+                "dx_api_calls": self.dx_api_calls,
+            }
+
+    def write(self, path) -> str:
+        """Write one JSON line per stage recorded, followed by the run
+        totals
+
+        Args:
+            path (str): path of JSON lines file to write
+
+        Returns:
+            str: path to metrics file
+        """
+        with self._lock:
+            records = list(self.records)
+        with open(path, "w", encoding="utf8") as metrics_file:
+            for record in records + [self.summary()]:
+                metrics_file.write(json.dumps(record) + "\n")
+        return path
+
+    def _profile(self, record):
+        """Context manager profiling a stage with the run's profiler, if
+        one is set
+
+        Args:
+            record (dict): metrics record of the stage
+
+        Returns:
+            context manager profiling the stage, or doing nothing if there
+                is no profiler
+        """
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.profile(record)
+
+    def _open_stages(self) -> list[dict]:
+        """Stages currently open on this thread, outermost first
+        """
+        if not hasattr(self._local, "stages"):
+            self._local.stages = []
+        return self._local.stages
+
+    def _count(self, field) -> None:
+        """Add one to field of the open stages on this thread and the run
+        """
+        for record in self._open_stages():
+            record[field] += 1
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+
+# metrics for every stage of the current run
+METRICS = RunMetrics()
@@ -2,14 +2,39 @@
 Utility functions for running Phoenix
 """
 
+from __future__ import annotations
 import datetime
 from hashlib import md5
 import dxpy
 import os
-from ftplib import FTP
+import queue
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from ftplib import all_errors, error_perm, error_reply
 from urllib.parse import urlparse
 from dxpy.bindings.dxproject import DXProject
 
+from .bgzf import check_bgzf_integrity
+from .checkpoint import DownloadCheckpoint
+from .ftp_pool import FTP_POOL
+from .hashing import MultiHash, hash_file
+from .mirrors import FTP_MIRRORS
+from .rate_limiter import RATE_LIMITER, is_throttle_error
+from .tabix import build_tabix_index, check_tabix_index
+from .telemetry import METRICS
+
+# folders in each DNAnexus project, listed once per run and kept up to date
+# as folders are created
+PROJECT_FOLDERS = {}
+PROJECT_FOLDERS_LOCK = threading.Lock()
+# md5 of files already in each DNAnexus project, mapped to their file IDs
+MD5_INDEX = {}
+MD5_INDEX_LOCK = threading.Lock()
+# bytes requested from the data connection per read
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+# files smaller than this per segment are downloaded as a single stream
+MIN_SEGMENT_SIZE = 32 * 1024 * 1024
+
 
 def is_date_within_n_weeks(comparison_date, num_weeks_ago=8) -> bool:
     """Checks if a given date occurs within past n weeks
@@ -28,12 +53,14 @@ def is_date_within_n_weeks(comparison_date, num_weeks_ago=8) -> bool:
     return comparison_date > n_weeks_ago_date
 
 
-def compare_checksums_md5(file_path, checksum_path) -> bool:
+def compare_checksums_md5(file_path, checksum_path, file_md5=None) -> bool:
     """Compares file to its md5 checksum file
 
     Args:
         file_path (str): Path to file to compare
         checksum_path (str): Path to md5 to compare to
+        file_md5 (str, optional): md5 of file already calculated during
+            download. If None, md5 is calculated from file_path
 
     Raises:
         RuntimeError: File to be compared could not be found
@@ -41,18 +68,11 @@ def compare_checksums_md5(file_path, checksum_path) -> bool:
     Returns:
         bool: Does file match checksum provided
     """
-    # read checksum file from path
-    try:
-        with open(checksum_path, "r") as file:
-            md5_checksum = file.read()[0:32]
-    except OSError:
-        raise RuntimeError(
-            "During checksum comparison,"
-            + f" file {checksum_path} could not be found"
-        )
+    md5_checksum = read_md5_checksum(checksum_path)
 
     # parse checksum from md5 file
-    file_md5 = get_file_md5(file_path)
+    if file_md5 is None:
+        file_md5 = get_file_md5(file_path)
     if file_md5 == md5_checksum:
         return True
     else:
@@ -63,26 +83,74 @@ def compare_checksums_md5(file_path, checksum_path) -> bool:
         return False
 
 
-def get_file_md5(file_path) -> str:
-    """Calculate md5 checksum of file
+def read_md5_checksum(checksum_path) -> str:
+    """Reads md5 checksum from md5 checksum file
+
+    Args:
+        checksum_path (str): Path to md5 checksum file
+
+    Raises:
+        RuntimeError: Checksum file could not be found
+
+    Returns:
+        str: md5 checksum
+    """
+    try:
+        with open(checksum_path, "r") as file:
+            return file.read()[0:32]
+    except OSError:
+        raise RuntimeError(
+            "During checksum comparison,"
+            + f" file {checksum_path} could not be found"
+        )
+
+
+def get_file_md5(file_path, chunk_size=1024 * 1024) -> str:
+    """Calculate md5 checksum of file, reading file in chunks
 
     Args:
         file_path (str): path to file
+        chunk_size (int, optional): number of bytes read per chunk.
+            Defaults to 1 MiB
 
     Returns:
         str: hex digested md5 checksum of file
     """
-    with open(file_path, "rb") as f:
-        md5_obj = md5(f.read())
-        return md5_obj.hexdigest()
+    return hash_file(file_path, ("md5",), chunk_size)["md5"]
 
 
-def download_ftp_file(download_link_file, file_name=None) -> str:
-    """Download file from ftp link
+def download_ftp_file(
+    download_link_file, file_name=None, hash_obj=None, max_retries=3,
+    checkpoint_interval=64 * 1024 * 1024, segments=1,
+    block_size=DEFAULT_BLOCK_SIZE
+) -> str:
+    """Download file from ftp link. Progress is checkpointed to a sidecar
+    file, so a dropped connection is retried from the last byte received
+    and a rerun after a failed download resumes from the last checkpoint
+    using FTP REST instead of restarting from byte zero.
+
+    If segments is more than 1, large files are split into byte ranges
+    downloaded over parallel connections instead, falling back to a single
+    stream if the server does not support SIZE and REST. The offset reached
+    in each range is checkpointed, so each range resumes where it stopped
 
     Args:
         download_link_file (str): ftp download url to file
         file_name (str, optional): name to upload file as
+        hash_obj (hashlib hash object, optional): hash updated with each
+            block as it is received, so the checksum is available as soon
+            as the transfer ends
+        max_retries (int, optional): number of times to resume the
+            transfer after a connection error. Defaults to 3.
+        checkpoint_interval (int, optional): number of bytes downloaded
+            between checkpoints. Defaults to 64 MiB.
+        segments (int, optional): number of parallel connections to
+            download file over. Defaults to 1.
+        block_size (int, optional): bytes requested from the data
+            connection per read. Defaults to 1 MiB.
+
+    Raises:
+        ftplib.error_perm: file could not be downloaded from server
 
     Returns:
         str: path to downloaded file
@@ -95,21 +163,367 @@ def download_ftp_file(download_link_file, file_name=None) -> str:
     parsed_url_file = urlparse(download_link_file)
     domain = parsed_url_file.netloc
     path = parsed_url_file.path[:-len(website_filename)]
-    ftp = FTP(domain)
-    ftp.login()
-    ftp.cwd(path)
-    with open(file, 'wb') as localfile:
-        ftp.retrbinary('RETR ' + website_filename, localfile.write, 1024)
-    ftp.quit()
+    # partial files are hashed to check they are intact before resuming
+    if hash_obj is None:
+        hash_obj = md5()
+    checkpoint = DownloadCheckpoint(file)
+
+    with METRICS.stage(
+        "download", file=website_filename, segments=segments
+    ) as stage:
+        if segments > 1:
+            file_size = get_ftp_file_size(domain, path, website_filename)
+            if file_size is not None and file_size >= (
+                segments * MIN_SEGMENT_SIZE
+            ):
+                resumed = download_ftp_file_segments(
+                    domain, path, website_filename, file, file_size,
+                    hash_obj, segments, max_retries, block_size,
+                    checkpoint, download_link_file, checkpoint_interval
+                )
+                stage["resumed_from"] = resumed
+                stage["bytes"] = file_size - resumed
+                checkpoint.clear()
+                return file
+            stage["segments"] = 1
+
+        # append mode, so writes always follow the resumed offset
+        with open(file, 'a+b') as localfile:
+            offset = checkpoint.resume(
+                localfile, download_link_file, hash_obj
+            )
+            checkpoint_offset = offset
+            stage["resumed_from"] = offset
+
+            def write_block(block):
+                nonlocal offset, checkpoint_offset
+                localfile.write(block)
+                hash_obj.update(block)
+                offset += len(block)
+                stage["bytes"] += len(block)
+                if offset - checkpoint_offset >= checkpoint_interval:
+                    localfile.flush()
+                    os.fsync(localfile.fileno())
+                    checkpoint.save(download_link_file, offset, hash_obj)
+                    checkpoint_offset = offset
+
+            retrieve_ftp_stream(
+                domain, path, website_filename, write_block, offset,
+                max_retries, block_size
+            )
+    checkpoint.clear()
 
     return file
 
 
+def retrieve_ftp_stream(
+    domain, path, website_filename, write_block, offset=0, max_retries=3,
+    block_size=DEFAULT_BLOCK_SIZE
+) -> int:
+    """Retrieve file from ftp server in order, passing each block received
+    to write_block. After a connection error the transfer is resumed from
+    the last byte received using FTP REST
+
+    Args:
+        domain (str): ftp server domain
+        path (str): directory containing file on ftp server
+        website_filename (str): name of file on ftp server
+        write_block (function): called with each block of bytes received
+        offset (int, optional): byte offset to start transfer from.
+            Defaults to 0.
+        max_retries (int, optional): number of times to resume the
+            transfer after a connection error. Defaults to 3.
+        block_size (int, optional): bytes requested from the data
+            connection per read. Defaults to 1 MiB.
+
+    Raises:
+        ftplib.error_perm: file could not be downloaded from server
+
+    Returns:
+        int: byte offset reached at end of file
+    """
+    def counted_write_block(block):
+        nonlocal offset
+        write_block(block)
+        offset += len(block)
+
+    # the same directory on other mirrors, failed over to if the transfer
+    # stalls or keeps failing
+    sources = [(domain, path)] + FTP_MIRRORS.alternatives(domain, path)
+    retries = 0
+    while True:
+        domain, path = sources[0]
+        try:
+            with FTP_POOL.session(domain, path) as ftp:
+                ftp.retrbinary(
+                    'RETR ' + website_filename, counted_write_block,
+                    block_size, rest=offset or None
+                )
+            return offset
+        except error_perm:
+            raise
+        except all_errors as err:
+            retries += 1
+            if len(sources) > 1 and (
+                isinstance(err, TimeoutError) or retries > max_retries
+            ):
+                sources.pop(0)
+                retries = 0
+                METRICS.count_retry()
+                print(
+                    f"Download of {website_filename} from {domain} stalled"
+                    + f" at byte {offset} ({err}), failing over to"
+                    + f" {sources[0][0]}"
+                )
+                continue
+            if retries > max_retries:
+                raise
+            METRICS.count_retry()
+            if is_throttle_error(err):
+                RATE_LIMITER.backoff()
+            print(
+                f"Download of {website_filename} interrupted at byte"
+                + f" {offset} ({err}), resuming"
+            )
+
+
+def get_ftp_file_size(domain, path, website_filename) -> int | None:
+    """Get size of file on ftp server, checking the server supports
+    restarting transfers at an offset
+
+    Args:
+        domain (str): ftp server domain
+        path (str): directory containing file on ftp server
+        website_filename (str): name of file on ftp server
+
+    Returns:
+        int | None: size of file in bytes, or None if the server refuses
+            SIZE or REST
+    """
+    with FTP_POOL.session(domain, path) as ftp:
+        try:
+            ftp.voidcmd("TYPE I")
+            file_size = ftp.size(website_filename)
+            ftp.sendcmd("REST 0")
+        except (error_perm, error_reply):
+            return None
+    return file_size
+
+
+def download_ftp_file_segments(
+    domain, path, website_filename, file, file_size, hash_obj, segments,
+    max_retries=3, block_size=DEFAULT_BLOCK_SIZE, checkpoint=None,
+    source=None, checkpoint_interval=64 * 1024 * 1024
+) -> int:
+    """Download file as byte ranges over parallel ftp connections into a
+    preallocated local file. The first range is hashed as it streams in and
+    the remaining ranges are hashed from disk once all ranges complete.
+
+    If a checkpoint is given, the offset reached in each range is saved to
+    it as the range downloads. A partial file left by an earlier run with a
+    checkpoint for the same source and size is resumed, each range
+    restarting from its checkpointed offset, instead of being truncated
+
+    Args:
+        domain (str): ftp server domain
+        path (str): directory containing file on ftp server
+        website_filename (str): name of file on ftp server
+        file (str): path to save file to
+        file_size (int): size of file in bytes
+        hash_obj (hashlib hash object): hash to update with file contents
+        segments (int): number of parallel connections
+        max_retries (int, optional): number of times to resume each range
+            after a connection error. Defaults to 3.
+        block_size (int, optional): bytes requested from the data
+            connection per read. Defaults to 1 MiB.
+        checkpoint (DownloadCheckpoint, optional): checkpoint of the
+            download. Defaults to None.
+        source (str, optional): download link the checkpoint is written
+            for. Defaults to None.
+        checkpoint_interval (int, optional): number of bytes downloaded in
+            a range between checkpoints. Defaults to 64 MiB.
+
+    Returns:
+        int: number of bytes already downloaded by an earlier run
+    """
+    ranges = None
+    if checkpoint is not None and os.path.exists(file) and (
+        os.path.getsize(file) == file_size
+    ):
+        ranges = checkpoint.load_ranges(source, file_size)
+    if ranges is None:
+        segment_size = -(-file_size // segments)
+        ranges = [
+            [start, min(start + segment_size, file_size), start]
+            for start in range(0, file_size, segment_size)
+        ]
+        with open(file, "wb") as localfile:
+            localfile.truncate(file_size)
+    resumed = sum(offset - start for start, _, offset in ranges)
+    # a resumed first range cannot be hashed as it streams, as its start is
+    # not downloaded again
+    stream_hash = ranges[0][2] == 0
+    ranges_lock = threading.Lock()
+
+    def save_range(index, offset):
+        if checkpoint is None:
+            return
+        with ranges_lock:
+            ranges[index][2] = offset
+            checkpoint.save_ranges(source, file_size, ranges)
+
+    if checkpoint is not None:
+        checkpoint.save_ranges(source, file_size, ranges)
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [
+            executor.submit(
+                download_ftp_range, domain, path, website_filename, file,
+                start, end, end == file_size,
+                hash_obj if index == 0 and stream_hash else None,
+                max_retries, block_size, offset,
+                lambda offset, index=index: save_range(index, offset),
+                checkpoint_interval
+            )
+            for index, (start, end, offset) in enumerate(ranges)
+            if offset < end
+        ]
+        for future in futures:
+            future.result()
+
+    with METRICS.stage("hash", file=file) as stage, \
+            open(file, "rb") as localfile:
+        localfile.seek(ranges[0][1] if stream_hash else 0)
+        while block := localfile.read(block_size):
+            hash_obj.update(block)
+            stage["bytes"] += len(block)
+    return resumed
+
+
+def download_ftp_range(
+    domain, path, website_filename, file, start, end, is_last,
+    hash_obj=None, max_retries=3, block_size=DEFAULT_BLOCK_SIZE, offset=None,
+    save_offset=None, checkpoint_interval=64 * 1024 * 1024
+) -> None:
+    """Download byte range of file from ftp server into the same range of
+    a local file
+
+    Args:
+        domain (str): ftp server domain
+        path (str): directory containing file on ftp server
+        website_filename (str): name of file on ftp server
+        file (str): path to preallocated local file
+        start (int): offset of first byte in range
+        end (int): offset after last byte in range
+        is_last (bool): does range end at the end of the file
+        hash_obj (hashlib hash object, optional): hash to update with range
+            contents
+        max_retries (int, optional): number of times to resume range after a
+            connection error. Defaults to 3.
+        block_size (int, optional): bytes requested from the data
+            connection per read. Defaults to 1 MiB.
+        offset (int, optional): offset in range to resume from. Defaults to
+            None, which downloads the whole range.
+        save_offset (function, optional): called with the offset reached
+            once the range is flushed to disk up to it. Defaults to None.
+        checkpoint_interval (int, optional): number of bytes downloaded
+            between calls to save_offset. Defaults to 64 MiB.
+
+    Raises:
+        EOFError: server closed data connection before end of range
+    """
+    if offset is None:
+        offset = start
+    checkpoint_offset = offset
+    retries = 0
+    sources = [(domain, path)] + FTP_MIRRORS.alternatives(domain, path)
+    with METRICS.stage(
+        "download_range", file=website_filename, start=start, end=end
+    ) as stage, open(file, "r+b") as localfile:
+        localfile.seek(offset)
+        while offset < end:
+            domain, path = sources[0]
+            ftp = FTP_POOL.acquire(domain, path)
+            try:
+                ftp.voidcmd("TYPE I")
+                with ftp.transfercmd(
+                    "RETR " + website_filename, rest=offset
+                ) as conn:
+                    while offset < end:
+                        block = conn.recv(min(block_size, end - offset))
+                        if not block:
+                            raise EOFError(
+                                f"Transfer of {website_filename} ended at"
+                                + f" byte {offset}, expected {end}"
+                            )
+                        localfile.write(block)
+                        if hash_obj is not None:
+                            hash_obj.update(block)
+                        offset += len(block)
+                        stage["bytes"] += len(block)
+                        if save_offset is not None and (
+                            offset - checkpoint_offset >= checkpoint_interval
+                            or offset == end
+                        ):
+                            localfile.flush()
+                            os.fsync(localfile.fileno())
+                            save_offset(offset)
+                            checkpoint_offset = offset
+            except all_errors as err:
+                FTP_POOL.discard(ftp)
+                if isinstance(err, error_perm):
+                    raise
+                retries += 1
+                if len(sources) > 1 and (
+                    isinstance(err, TimeoutError) or retries > max_retries
+                ):
+                    # carry on from the same offset on the next mirror
+                    sources.pop(0)
+                    retries = 0
+                    METRICS.count_retry()
+                    print(
+                        f"Download of {website_filename} range {start}-{end}"
+                        + f" from {domain} stalled at byte {offset} ({err}),"
+                        + f" failing over to {sources[0][0]}"
+                    )
+                    continue
+                if retries > max_retries:
+                    raise
+                METRICS.count_retry()
+                if is_throttle_error(err):
+                    RATE_LIMITER.backoff()
+                print(
+                    f"Download of {website_filename} range {start}-{end}"
+                    + f" interrupted at byte {offset} ({err}), resuming"
+                )
+                continue
+
+            if not is_last:
+                # closing the data connection early aborts the transfer, so
+                # the session may have unread replies and is not reused
+                FTP_POOL.discard(ftp)
+                continue
+            try:
+                ftp.voidresp()
+            except all_errors:
+                FTP_POOL.discard(ftp)
+            else:
+                FTP_POOL.release(ftp)
+
+
 def download_file_upload_DNAnexus(
         download_link_file, project_id, proj_folder_path, file_name,
-        download_link_checksum=None
+        download_link_checksum=None, segments=1,
+        block_size=DEFAULT_BLOCK_SIZE, stream_upload=False, verify_bgzf=False,
+        indexed_file=None, manifest=None, downloaded=None,
+        indexed_file_ready=None, checksum_contents=None
 ) -> str:
-    """Download file, compare to checksum (optional), upload to DNAnexus
+    """Download file, compare to checksum (optional), upload to DNAnexus.
+    If a file with the same md5 already exists in the DNAnexus project, its
+    file ID is returned instead of transferring the file again. The md5 and
+    sha256 of the file are recorded as properties of the uploaded file.
+
+    If a run manifest is given, each step the file completes is recorded in
+    it, and steps an earlier run already completed are skipped
 
     Args:
         download_link_file (str): link to download file
@@ -118,30 +532,318 @@ def download_file_upload_DNAnexus(
         file_name (str): name to save file as on DNAnexus
         download_link_checksum (str, optional): link to download checksum for
             file. Defaults to None
+        segments (int, optional): number of parallel connections to
+            download file over. Defaults to 1.
+        block_size (int, optional): bytes requested from the data
+            connection per read. Defaults to 1 MiB.
+        stream_upload (bool, optional): stream file straight into DNAnexus
+            instead of downloading it to local disk first. Defaults to
+            False.
+        verify_bgzf (bool, optional): check the downloaded file is well
+            formed BGZF before uploading it. Streamed files are not written
+            to local disk so are not checked. Defaults to False.
+        indexed_file (str, optional): path to local BGZF VCF the file is a
+            tabix index of. If given, the downloaded index is cross-checked
+            against the VCF and rebuilt from it if they do not match.
+            Defaults to None.
+        manifest (RunManifest, optional): manifest of the update the file
+            belongs to. Defaults to None.
+        downloaded (Future, optional): set to the path of the local file
+            once it is downloaded and checked, before it is uploaded, so a
+            concurrent transfer of its index can be cross-checked against
+            it. Defaults to None.
+        indexed_file_ready (Future, optional): set once indexed_file is on
+            local disk by a concurrent transfer. The index is downloaded
+            while the VCF transfers and only waits for it before the
+            cross-check. Defaults to None.
+        checksum_contents (bytes, optional): contents of the checksum file
+            already fetched, e.g. with other checksums by fetch_ftp_files,
+            used instead of downloading it. Defaults to None.
 
     Raises:
         RuntimeError: File did not match checksum
+        RuntimeError: File is not valid BGZF
+        RuntimeError: Transfer of indexed_file failed
 
     Returns:
-        str: DNAnexus file ID for file uploaded
+        str: DNAnexus file ID for file uploaded, or of the existing file
+            with the same md5
     """
-    # download file
-    file = download_ftp_file(download_link_file, file_name)
+    # an earlier run of this update may have already uploaded the file
+    if manifest is not None:
+        uploaded_file_id = manifest.uploaded_file_id(file_name, project_id)
+        if uploaded_file_id is not None:
+            print(
+                f"{file_name} was uploaded to {project_id} as"
+                + f" {uploaded_file_id} by an earlier run, skipping transfer"
+            )
+            return uploaded_file_id
 
-    # if checksum link is provided, compare to file downloaded
+    # if the published checksum matches a file already in the project,
+    # skip the download entirely. Every build's release shares a checksum
+    # name, so it is saved under file_name for builds run at once
     if download_link_checksum is not None:
-        # download checksum
-        checksum = download_ftp_file(download_link_checksum)
-        if not compare_checksums_md5(file, checksum):
+        checksum = f"{file_name}.md5"
+        if checksum_contents is None:
+            checksum = download_ftp_file(download_link_checksum, checksum)
+        else:
+            with open(checksum, "wb") as checksum_file:
+                checksum_file.write(checksum_contents)
+        existing_file_id = find_file_by_md5(
+            project_id, read_md5_checksum(checksum)
+        )
+        if existing_file_id is not None:
+            print(
+                f"{file_name} already exists in {project_id} as"
+                + f" {existing_file_id}, skipping transfer"
+            )
+            if manifest is not None:
+                manifest.update_file(
+                    file_name, "uploaded", file_id=existing_file_id
+                )
+            return existing_file_id
+
+    # download file, computing every checksum as blocks stream in
+    hash_obj = MultiHash()
+    # or reuse the local copy an earlier run downloaded
+    checksums = None
+    verified = False
+    if manifest is not None and not stream_upload:
+        checksums = manifest.local_checksums(file_name)
+        verified = checksums is not None and manifest.get_file(
+            file_name
+        )["state"] in ("verified", "uploaded")
+    if checksums is not None:
+        file = file_name
+        print(f"{file_name} was downloaded by an earlier run, reusing it")
+    elif stream_upload:
+        file = file_name
+        file_id = stream_ftp_file_DNAnexus(
+            download_link_file, project_id, proj_folder_path, file_name,
+            hash_obj, block_size=block_size
+        )
+    else:
+        file = download_ftp_file(
+            download_link_file, file_name, hash_obj, segments=segments,
+            block_size=block_size
+        )
+    if checksums is None:
+        checksums = hash_obj.hexdigests()
+    file_md5 = checksums["md5"]
+
+    # if checksum link is provided, compare to file downloaded
+    if download_link_checksum is not None and not compare_checksums_md5(
+        file, checksum, file_md5
+    ):
+        if stream_upload:
+            dxpy.DXFile(file_id, project=project_id).remove()
+        raise RuntimeError(
+            f"File {file} did not match checksum {checksum}"
+        )
+    # indexes have no published checksum, so check they match the VCF
+    if (
+        indexed_file is not None and not stream_upload
+        and indexed_file_ready is not None
+    ):
+        try:
+            indexed_file_ready.result()
+        except CancelledError:
             raise RuntimeError(
-                f"File {file} did not match checksum {checksum}"
+                f"{indexed_file} could not be downloaded to check {file}"
+                + " against"
+            )
+    if (
+        indexed_file is not None and not stream_upload
+        and os.path.exists(indexed_file)
+    ):
+        with METRICS.stage("tabix_check", file=file) as stage:
+            problems = check_tabix_index(file, indexed_file)
+            stage["problems"] = len(problems)
+        if problems:
+            print(
+                f"{file} does not match {indexed_file}"
+                + f" ({'; '.join(problems)}), rebuilding index"
             )
-    file_id = upload_file_DNAnexus(file_name, project_id, proj_folder_path)
+            with METRICS.stage("tabix_rebuild", file=file):
+                build_tabix_index(indexed_file, file)
+            checksums = hash_file(file)
+            file_md5 = checksums["md5"]
+    if manifest is not None and not stream_upload and not verified:
+        manifest.update_file(
+            file_name, "downloaded", checksums=checksums,
+            size=os.path.getsize(file)
+        )
+
+    # a checksum match only shows the file is as published, so check the
+    # compressed blocks are intact before the file is used downstream
+    if verify_bgzf and not stream_upload and not verified:
+        with METRICS.stage("bgzf_verify", file=file) as stage:
+            stage["blocks"] = check_bgzf_integrity(file)
+            stage["bytes"] = os.path.getsize(file)
+        if manifest is not None:
+            manifest.update_file(file_name, "verified")
+    if downloaded is not None and not stream_upload:
+        downloaded.set_result(file)
+
+    # files without a published checksum are checked once downloaded
+    existing_file_id = find_file_by_md5(project_id, file_md5)
+    if stream_upload:
+        if existing_file_id is not None:
+            dxpy.DXFile(file_id, project=project_id).remove()
+            file_id = existing_file_id
+        else:
+            dxpy.DXFile(file_id, project=project_id).set_properties(
+                checksums
+            )
+    elif existing_file_id is not None:
+        print(
+            f"{file_name} already exists in {project_id} as"
+            + f" {existing_file_id}, skipping upload"
+        )
+        file_id = existing_file_id
+    else:
+        file_id = upload_file_DNAnexus(
+            file_name, project_id, proj_folder_path, checksums
+        )
+    if manifest is not None:
+        manifest.update_file(
+            file_name, "uploaded", checksums=checksums, file_id=file_id
+        )
+    with MD5_INDEX_LOCK:
+        if project_id in MD5_INDEX:
+            MD5_INDEX[project_id].setdefault(file_md5, file_id)
     return file_id
 
 
+def find_file_by_md5(project_id, file_md5) -> str | None:
+    """Finds file in a DNAnexus project with the given md5. The md5 of
+    every file in the project is fetched with one batched search the first
+    time a project is queried, and later lookups are answered from memory
+
+    Args:
+        project_id (str): DNAnexus project ID
+        file_md5 (str): md5 checksum of file
+
+    Returns:
+        str | None: DNAnexus file ID of file with matching md5, or None if
+            there is no matching file
+    """
+    with MD5_INDEX_LOCK:
+        if project_id not in MD5_INDEX:
+            MD5_INDEX[project_id] = get_project_md5_index(project_id)
+        return MD5_INDEX[project_id].get(file_md5)
+
+
+def get_project_md5_index(project_id) -> dict[str, str]:
+    """Gets md5 property of every closed file in a DNAnexus project
+
+    Args:
+        project_id (str): DNAnexus project ID
+
+    Returns:
+        dict[str, str]: md5 checksum mapped to DNAnexus file ID
+    """
+    md5_index = {}
+    with METRICS.stage("md5_index", project=project_id) as stage:
+        for result in dxpy.find_data_objects(
+            classname="file", state="closed", project=project_id,
+            properties={"md5": True},
+            describe={"fields": {"properties": True}}, first_page_size=1000
+        ):
+            file_md5 = result["describe"]["properties"]["md5"]
+            md5_index.setdefault(file_md5, result["id"])
+        stage["files"] = len(md5_index)
+    return md5_index
+
+
+def stream_ftp_file_DNAnexus(
+    download_link_file, project_id, proj_folder_path, file_name,
+    hash_obj=None, max_retries=3, block_size=DEFAULT_BLOCK_SIZE,
+    buffer_blocks=32
+) -> str:
+    """Stream file from ftp link into a new DNAnexus file without writing it
+    to local disk. Blocks pass through a bounded in-memory queue to a thread
+    writing them to the DNAnexus file as a multipart upload, so the download
+    and upload overlap
+
+    Args:
+        download_link_file (str): ftp download url to file
+        project_id (str): DNAnexus project ID to upload file to
+        proj_folder_path (str): DNAnexus project folder path to upload to
+        file_name (str): name to save file as on DNAnexus
+        hash_obj (hashlib hash object, optional): hash updated with each
+            block as it is received
+        max_retries (int, optional): number of times to resume the
+            transfer after a connection error. Defaults to 3.
+        block_size (int, optional): bytes requested from the data
+            connection per read. Defaults to 1 MiB.
+        buffer_blocks (int, optional): maximum number of blocks held in
+            memory waiting to be uploaded. Defaults to 32.
+
+    Raises:
+        RuntimeError: Upload to DNAnexus failed
+
+    Returns:
+        str: DNAnexus file ID of uploaded file
+    """
+    website_filename = os.path.basename(download_link_file)
+    parsed_url_file = urlparse(download_link_file)
+    domain = parsed_url_file.netloc
+    path = parsed_url_file.path[:-len(website_filename)]
+
+    create_proj_folder_if_missing(project_id, proj_folder_path)
+    dx_file = dxpy.new_dxfile(
+        name=file_name, project=project_id, folder=proj_folder_path or "/"
+    )
+    blocks = queue.Queue(maxsize=buffer_blocks)
+    upload_errors = []
+
+    def upload_blocks():
+        # keep draining the queue after an error so the download never
+        # blocks on a full queue
+        while (block := blocks.get()) is not None:
+            if upload_errors:
+                continue
+            try:
+                dx_file.write(block)
+            except Exception as err:
+                upload_errors.append(err)
+
+    def write_block(block):
+        if upload_errors:
+            raise RuntimeError(
+                f"Upload of {file_name} to DNAnexus failed"
+            ) from upload_errors[0]
+        if hash_obj is not None:
+            hash_obj.update(block)
+        blocks.put(block)
+        stage["bytes"] += len(block)
+
+    uploader = threading.Thread(target=upload_blocks, daemon=True)
+    uploader.start()
+    try:
+        with METRICS.stage("stream_upload", file=file_name) as stage:
+            try:
+                retrieve_ftp_stream(
+                    domain, path, website_filename, write_block,
+                    max_retries=max_retries, block_size=block_size
+                )
+            finally:
+                blocks.put(None)
+                uploader.join()
+            if upload_errors:
+                raise RuntimeError(
+                    f"Upload of {file_name} to DNAnexus failed"
+                ) from upload_errors[0]
+            dx_file.close()
+    except BaseException:
+        dx_file.remove()
+        raise
+    return dx_file.get_id()
+
+
 def upload_file_DNAnexus(
-    file_path, project_id, proj_folder_path=None
+    file_path, project_id, proj_folder_path=None, properties=None
 ) -> str:
     """Uploads local file to DNAnexus and creates folder if needed
 
@@ -149,24 +851,46 @@ def upload_file_DNAnexus(
         file_path (str): path to local file to upload
         project_id (str): DNAnexus project id of project to upload to
         proj_folder_path (str, optional): DNAnexus folder path to upload to
+        properties (dict, optional): DNAnexus properties to set on file
 
     Returns:
         str: DNAnexus file ID of uploaded file
     """
-    # if folder path is None, assume it is created in project root
-    # else, create folder if it does not already exist
-    if proj_folder_path is not None:
-        if not check_proj_folder_exists(project_id, proj_folder_path):
-            # create folder
-            project = DXProject(dxid=project_id)
-            project.new_folder(proj_folder_path, parents=True)
-
-    file_id = dxpy.upload_local_file(
-        filename=file_path, project=project_id, folder=proj_folder_path
-    ).get_id()
+    create_proj_folder_if_missing(project_id, proj_folder_path)
+    with METRICS.stage("upload", file=os.path.basename(file_path)) as stage:
+        file_id = dxpy.upload_local_file(
+            filename=file_path, project=project_id, folder=proj_folder_path,
+            properties=properties
+        ).get_id()
+        stage["bytes"] = os.path.getsize(file_path)
     return file_id
 
 
+def create_proj_folder_if_missing(project_id, proj_folder_path) -> None:
+    """Creates DNAnexus folder if it does not already exist, using the
+    run's cached folder tree so folders already seen cost no API calls
+
+    Args:
+        project_id (str): DNAnexus project ID
+        proj_folder_path (str): DNAnexus folder path. If None, files are
+            assumed to go in the project root
+    """
+    if proj_folder_path is None:
+        return
+    folder_path = normalise_folder_path(proj_folder_path)
+    with METRICS.stage("folder_check", folder=folder_path):
+        folders = get_project_folders(project_id)
+        with PROJECT_FOLDERS_LOCK:
+            if folder_path in folders:
+                return
+            project = DXProject(dxid=project_id)
+            project.new_folder(folder_path, parents=True)
+            # parent folders are created along with the folder
+            while folder_path != "/":
+                folders.add(folder_path)
+                folder_path = os.path.dirname(folder_path)
+
+
 def check_proj_folder_exists(project_id, folder_path) -> bool:
     """Checks if a DNAnexus folder exists in a given project
 
@@ -180,31 +904,47 @@ def check_proj_folder_exists(project_id, folder_path) -> bool:
     Returns:
         bool: does folder exist in project
     """
-    if not check_project_exists(project_id):
-        raise RuntimeError(f"Project {project_id} does not exist")
-
-    try:
-        dxpy.api.project_list_folder(
-            project_id,
-            input_params={"folder": folder_path, "only": "folders"},
-            always_retry=True
-        )
-        return True
-    except dxpy.exceptions.ResourceNotFound:
-        return False
+    return normalise_folder_path(folder_path) in get_project_folders(
+        project_id
+    )
 
 
-def check_project_exists(project_id) -> bool:
-    """Checks if a DNAnexus project exists from project ID
+def get_project_folders(project_id) -> set[str]:
+    """Gets every folder in a DNAnexus project. The project is described
+    once per run, which both checks it exists and lists its whole folder
+    tree, and later lookups are answered from memory
 
     Args:
         project_id (str): DNAnexus project ID
 
+    Raises:
+        RuntimeError: project not found
+
     Returns:
-        bool: does the specified project exist
+        set[str]: paths of folders in project, shared with the cache so
+            folders created later in the run are included
     """
-    try:
-        DXProject(project_id)
-        return True
-    except dxpy.exceptions.DXError:
-        return False
+    with PROJECT_FOLDERS_LOCK:
+        if project_id not in PROJECT_FOLDERS:
+            try:
+                description = dxpy.api.project_describe(
+                    project_id, input_params={"fields": {"folders": True}},
+                    always_retry=True
+                )
+            except dxpy.exceptions.DXError:
+                raise RuntimeError(f"Project {project_id} does not exist")
+            PROJECT_FOLDERS[project_id] = set(description["folders"])
+        return PROJECT_FOLDERS[project_id]
+
+
+def normalise_folder_path(folder_path) -> str:
+    """Normalise DNAnexus folder path to the form DNAnexus lists folders
+    in, with a leading slash and no trailing slash
+
+    Args:
+        folder_path (str): path to DNAnexus folder
+
+    Returns:
+        str: normalised folder path
+    """
+    return "/" + folder_path.strip("/")
@@ -0,0 +1,274 @@
+"""
+Streaming reader for ClinVar VCF files, yielding compact records or batches
+of column arrays without holding the whole file in memory
+"""
+
+from __future__ import annotations
+import gzip
+import io
+from array import array
+from typing import Iterator
+
+# decompressed bytes buffered per chunk
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# records per column batch
+DEFAULT_BATCH_SIZE = 100_000
+# order of chromosomes in ClinVar VCFs, other contigs sort after these
+CHROMOSOME_ORDER = {
+    chrom: rank for rank, chrom in enumerate(
+        [str(number) for number in range(1, 23)] + ["X", "Y", "MT"]
+    )
+}
+
+
+class VCFRecord:
+    """ClinVar variant with the fields Phoenix checks. Slots keep each
+    record small when many are held at once
+    """
+    __slots__ = (
+        "chrom", "pos", "variant_id", "ref", "alt", "clnsig",
+        "review_status"
+    )
+
+    def __init__(
+        self, chrom, pos, variant_id, ref, alt, clnsig, review_status
+    ):
+        """
+        Args:
+            chrom (str): chromosome, e.g. 1 or MT
+            pos (int): 1-based position
+            variant_id (str): ClinVar variation ID
+            ref (str): reference allele
+            alt (str): alternate allele, or "." if there is none
+            clnsig (str | None): clinical significance from CLNSIG
+            review_status (str | None): review status from CLNREVSTAT
+        """
+        self.chrom = chrom
+        self.pos = pos
+        self.variant_id = variant_id
+        self.ref = ref
+        self.alt = alt
+        self.clnsig = clnsig
+        self.review_status = review_status
+
+    def __eq__(self, other):
+        if not isinstance(other, VCFRecord):
+            return NotImplemented
+        return all(
+            getattr(self, slot) == getattr(other, slot)
+            for slot in self.__slots__
+        )
+
+    def __repr__(self):
+        return (
+            f"VCFRecord({self.chrom}:{self.pos} {self.ref}>{self.alt}"
+            + f" id={self.variant_id} clnsig={self.clnsig}"
+            + f" review_status={self.review_status})"
+        )
+
+
+class CodeTable:
+    """Assigns small integer codes to repeated strings, such as CLNSIG
+    values, so they can be stored in arrays. Code 0 is a missing value
+    """
+    __slots__ = ("labels", "codes")
+
+    def __init__(self):
+        self.labels = [None]
+        self.codes = {None: 0}
+
+    def code(self, label) -> int:
+        """Get code for label, assigning the next code if label is new
+
+        Args:
+            label (str | None): string to encode
+
+        Returns:
+            int: code for label
+        """
+        code = self.codes.get(label)
+        if code is None:
+            code = self.codes[label] = len(self.labels)
+            self.labels.append(label)
+        return code
+
+    def label(self, code) -> str | None:
+        """Get label for code
+
+        Args:
+            code (int): code returned by code()
+
+        Returns:
+            str | None: label encoded as code
+        """
+        return self.labels[code]
+
+
+class VCFColumnBatch:
+    """Batch of consecutive records stored as columns. Positions and
+    encoded CLNSIG and review status values are held in typed arrays, with
+    their codes shared by every batch from the same reader
+    """
+    __slots__ = (
+        "chrom", "pos", "variant_id", "ref", "alt", "clnsig",
+        "review_status", "clnsig_codes", "review_status_codes"
+    )
+
+    def __init__(self, clnsig_codes, review_status_codes):
+        """
+        Args:
+            clnsig_codes (CodeTable): codes for CLNSIG values
+            review_status_codes (CodeTable): codes for CLNREVSTAT values
+        """
+        self.chrom = []
+        self.pos = array("I")
+        self.variant_id = []
+        self.ref = []
+        self.alt = []
+        self.clnsig = array("H")
+        self.review_status = array("B")
+        self.clnsig_codes = clnsig_codes
+        self.review_status_codes = review_status_codes
+
+    def __len__(self):
+        return len(self.pos)
+
+    def append(self, record) -> None:
+        """Add record to end of batch
+
+        Args:
+            record (VCFRecord): record to add
+        """
+        self.chrom.append(record.chrom)
+        self.pos.append(record.pos)
+        self.variant_id.append(record.variant_id)
+        self.ref.append(record.ref)
+        self.alt.append(record.alt)
+        self.clnsig.append(self.clnsig_codes.code(record.clnsig))
+        self.review_status.append(
+            self.review_status_codes.code(record.review_status)
+        )
+
+    def record(self, index) -> VCFRecord:
+        """Get record at index in batch
+
+        Args:
+            index (int): index of record in batch
+
+        Returns:
+            VCFRecord: record at index
+        """
+        return VCFRecord(
+            self.chrom[index], self.pos[index], self.variant_id[index],
+            self.ref[index], self.alt[index],
+            self.clnsig_codes.label(self.clnsig[index]),
+            self.review_status_codes.label(self.review_status[index])
+        )
+
+
+def open_vcf(source, chunk_size=DEFAULT_CHUNK_SIZE) -> io.TextIOWrapper:
+    """Open gzip or BGZF compressed VCF for reading as text, decompressing
+    in chunks of chunk_size bytes
+
+    Args:
+        source (str | file object): path to VCF, or binary file object
+            such as an open DNAnexus file
+        chunk_size (int, optional): decompressed bytes buffered per
+            chunk. Defaults to 1 MiB.
+
+    Returns:
+        io.TextIOWrapper: decompressed VCF lines
+    """
+    if isinstance(source, str):
+        compressed = gzip.GzipFile(filename=source, mode="rb")
+    else:
+        # the caller's file object is left open when the reader is closed
+        compressed = gzip.GzipFile(fileobj=source, mode="rb")
+    decompressed = io.BufferedReader(compressed, buffer_size=chunk_size)
+    return io.TextIOWrapper(decompressed, encoding="utf8", newline="\n")
+
+
+def read_vcf_records(
+    source, chunk_size=DEFAULT_CHUNK_SIZE
+) -> Iterator[VCFRecord]:
+    """Stream records from a compressed ClinVar VCF, skipping header lines
+
+    Args:
+        source (str | file object): path to VCF, or binary file object
+        chunk_size (int, optional): decompressed bytes buffered per chunk.
+            Defaults to 1 MiB.
+
+    Raises:
+        RuntimeError: line has fewer than 8 columns
+
+    Yields:
+        VCFRecord: each record in file order
+    """
+    with open_vcf(source, chunk_size) as vcf:
+        for line_number, line in enumerate(vcf, 1):
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t", 8)
+            if len(fields) < 8:
+                raise RuntimeError(
+                    f"VCF line {line_number} has {len(fields)} columns,"
+                    + " expected at least 8"
+                )
+            info = fields[7]
+            yield VCFRecord(
+                fields[0], int(fields[1]), fields[2], fields[3], fields[4],
+                get_info_value(info, "CLNSIG"),
+                get_info_value(info, "CLNREVSTAT")
+            )
+
+
+def read_vcf_batches(
+    source, batch_size=DEFAULT_BATCH_SIZE, chunk_size=DEFAULT_CHUNK_SIZE
+) -> Iterator[VCFColumnBatch]:
+    """Stream records from a compressed ClinVar VCF as column batches, so
+    at most batch_size records are held in memory at once
+
+    Args:
+        source (str | file object): path to VCF, or binary file object
+        batch_size (int, optional): maximum records per batch. Defaults to
+            100,000.
+        chunk_size (int, optional): decompressed bytes buffered per chunk.
+            Defaults to 1 MiB.
+
+    Yields:
+        VCFColumnBatch: consecutive records, with codes shared between
+            batches
+    """
+    clnsig_codes = CodeTable()
+    review_status_codes = CodeTable()
+    batch = VCFColumnBatch(clnsig_codes, review_status_codes)
+    for record in read_vcf_records(source, chunk_size):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = VCFColumnBatch(clnsig_codes, review_status_codes)
+    if len(batch):
+        yield batch
+
+
+def get_info_value(info, key) -> str | None:
+    """Get value of key from a VCF INFO column without splitting the whole
+    column
+
+    Args:
+        info (str): INFO column, e.g. ALLELEID=1;CLNSIG=Benign
+        key (str): INFO key, e.g. CLNSIG
+
+    Returns:
+        str | None: value of key, or None if key is not present
+    """
+    prefix = f"{key}="
+    if info.startswith(prefix):
+        start = len(prefix)
+    else:
+        start = info.find(f";{prefix}")
+        if start == -1:
+            return None
+        start += len(prefix) + 1
+    end = info.find(";", start)
+    return info[start:] if end == -1 else info[start:end]
@@ -0,0 +1,309 @@
+"""
+Updates a VEP config file to use a new ClinVar annotation resource
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import re
+
+import dxpy
+
+from utils.hashing import hash_file
+from utils.telemetry import METRICS
+from utils.util import upload_file_DNAnexus
+
+# DNAnexus file ID, optionally prefixed by the ID of the project holding it
+FILE_ID_REGEX = re.compile(
+    r"^(?:(project-[0-9A-Za-z]{24}):)?(file-[0-9A-Za-z]{24})$"
+)
+# version at the end of a config file name, e.g. _v1.2.0.json
+CONFIG_VERSION_REGEX = re.compile(r"_v([0-9]+(?:\.[0-9]+)*)\.json$")
+# name of the custom annotation holding the ClinVar VCF and index
+CLINVAR_ANNOTATION_NAME = "clinvar"
+# objects described per system_describe_data_objects call
+MAX_DESCRIBE_OBJECTS = 1000
+# seconds to wait for the new ClinVar files to close after upload
+CLOSE_TIMEOUT = 600
+
+
+def update_vep_config(
+    vep_config_file_id, clinvar_file_id, clinvar_index_id, project_id,
+    proj_folder_path
+) -> str:
+    """Write a new version of a VEP config with its ClinVar annotation
+    replaced by a new ClinVar VCF and index, and upload it. The new ClinVar
+    files are waited on until they close after upload, then every file the
+    new config references is checked to exist and be usable, with all files
+    described in one bulk request
+
+    Args:
+        vep_config_file_id (str): DNAnexus file ID of current VEP config, as
+            file-xxxx or project-xxxx:file-xxxx
+        clinvar_file_id (str): DNAnexus file ID of new ClinVar VCF
+        clinvar_index_id (str): DNAnexus file ID of new ClinVar VCF index
+        project_id (str): DNAnexus project ID to upload new config to
+        proj_folder_path (str): DNAnexus folder path to upload new config to
+
+    Raises:
+        RuntimeError: config has no ClinVar annotation
+        RuntimeError: new ClinVar files did not close
+        RuntimeError: file referenced by new config cannot be used
+
+    Returns:
+        str: DNAnexus file ID of new VEP config
+    """
+    config_project, config_id = split_file_id(vep_config_file_id)
+    config = json.loads(dxpy.open_dxfile(
+        config_id, project=config_project, mode="rb"
+    ).read())
+
+    update_clinvar_annotation(
+        config, clinvar_file_id, clinvar_index_id, project_id
+    )
+    config_information = config.setdefault("config_information", {})
+    config_version = bump_config_version(
+        config_information.get("config_version", "1.0.0")
+    )
+    config_information["config_version"] = config_version
+
+    wait_for_files_to_close([clinvar_file_id, clinvar_index_id], project_id)
+    file_ids = get_config_file_ids(config)
+    descriptions = describe_files([vep_config_file_id] + file_ids)
+    problems = check_config_files(file_ids, descriptions)
+    if problems:
+        raise RuntimeError(
+            "New VEP config references files that cannot be used: "
+            + "; ".join(problems)
+        )
+
+    config_name = get_config_file_name(
+        descriptions.get(vep_config_file_id, {}).get(
+            "name", "vep_config.json"
+        ),
+        config_version
+    )
+    with open(config_name, "w", encoding="utf8") as config_file:
+        json.dump(config, config_file, indent=4)
+    new_config_id = upload_file_DNAnexus(
+        config_name, project_id, proj_folder_path, hash_file(config_name)
+    )
+    print(
+        f"New VEP config {config_name} version {config_version} uploaded"
+        + f" as {new_config_id}, referencing {len(file_ids)} files"
+    )
+    return new_config_id
+
+
+def update_clinvar_annotation(
+    config, clinvar_file_id, clinvar_index_id, project_id
+) -> None:
+    """Replace ClinVar VCF and index in a VEP config's custom annotations.
+    IDs keep the form of the IDs they replace, so a config referencing
+    files by project-xxxx:file-xxxx references the new files the same way
+
+    Args:
+        config (dict): VEP config, updated in place
+        clinvar_file_id (str): DNAnexus file ID of new ClinVar VCF
+        clinvar_index_id (str): DNAnexus file ID of new ClinVar VCF index
+        project_id (str): DNAnexus project ID holding the new files
+
+    Raises:
+        RuntimeError: config has no ClinVar annotation
+    """
+    annotations = [
+        annotation for annotation in config.get("custom_annotations", [])
+        if annotation.get("name", "").lower() == CLINVAR_ANNOTATION_NAME
+    ]
+    if not annotations or not annotations[0].get("resource_files"):
+        raise RuntimeError(
+            "VEP config has no ClinVar custom annotation with resource files"
+        )
+    resource_files = annotations[0]["resource_files"][0]
+    for key, new_id in (
+        ("file_id", clinvar_file_id), ("index_id", clinvar_index_id)
+    ):
+        old_project, _ = split_file_id(resource_files.get(key, ""))
+        resource_files[key] = (
+            f"{project_id}:{new_id}" if old_project is not None else new_id
+        )
+
+
+def get_config_file_ids(config) -> list[str]:
+    """Find every DNAnexus file ID referenced anywhere in a VEP config
+
+    Args:
+        config (dict | list | str): VEP config, or part of it
+
+    Returns:
+        list[str]: file IDs in the order they appear, without duplicates
+    """
+    file_ids = {}
+
+    def find_file_ids(value):
+        if isinstance(value, dict):
+            for item in value.values():
+                find_file_ids(item)
+        elif isinstance(value, list):
+            for item in value:
+                find_file_ids(item)
+        elif isinstance(value, str) and FILE_ID_REGEX.match(value):
+            file_ids.setdefault(value, None)
+
+    find_file_ids(config)
+    return list(file_ids)
+
+
+def describe_files(file_ids) -> dict[str, dict]:
+    """Describe many DNAnexus files with one bulk request per
+    MAX_DESCRIBE_OBJECTS files, instead of one request per file
+
+    Args:
+        file_ids (list[str]): file IDs, as file-xxxx or
+            project-xxxx:file-xxxx
+
+    Returns:
+        dict[str, dict]: each file ID mapped to its name, state and
+            archival state, for files that could be described
+    """
+    descriptions = {}
+    with METRICS.stage("describe_files") as stage:
+        for start in range(0, len(file_ids), MAX_DESCRIBE_OBJECTS):
+            batch = file_ids[start:start + MAX_DESCRIBE_OBJECTS]
+            objects = []
+            for file_id in batch:
+                project, object_id = split_file_id(file_id)
+                describe_input = {
+                    "id": object_id,
+                    "describe": {"fields": {
+                        "name": True, "state": True, "archivalState": True
+                    }},
+                }
+                if project is not None:
+                    describe_input["project"] = project
+                objects.append(describe_input)
+            results = dxpy.api.system_describe_data_objects(
+                {"objects": objects}, always_retry=True
+            )["results"]
+            for file_id, result in zip(batch, results):
+                if result.get("describe") is not None:
+                    descriptions[file_id] = result["describe"]
+        stage["files"] = len(file_ids)
+    return descriptions
+
+
+def wait_for_files_to_close(file_ids, project_id) -> None:
+    """Wait for files uploaded by this run to finish closing, so a config
+    only references closed files
+
+    Args:
+        file_ids (list[str]): DNAnexus file IDs of uploaded files
+        project_id (str): DNAnexus project ID holding the files
+
+    Raises:
+        RuntimeError: file is not closing or did not close in time
+    """
+    with METRICS.stage("wait_on_close", files=len(file_ids)):
+        for file_id in file_ids:
+            try:
+                dxpy.DXFile(file_id, project=project_id).wait_on_close(
+                    timeout=CLOSE_TIMEOUT
+                )
+            except dxpy.exceptions.DXError as err:
+                raise RuntimeError(
+                    f"{file_id} did not close after upload: {err}"
+                ) from err
+
+
+def check_config_files(file_ids, descriptions) -> list[str]:
+    """Check every file referenced by a VEP config can be used by VEP
+
+    Args:
+        file_ids (list[str]): file IDs referenced by config
+        descriptions (dict[str, dict]): descriptions from describe_files
+
+    Returns:
+        list[str]: description of each problem found, empty if every file
+            can be used
+    """
+    problems = []
+    for file_id in file_ids:
+        description = descriptions.get(file_id)
+        if description is None:
+            problems.append(f"{file_id} does not exist or is not accessible")
+        elif description.get("state") != "closed":
+            problems.append(f"{file_id} is {description.get('state')}")
+        elif description.get("archivalState", "live") != "live":
+            problems.append(
+                f"{file_id} is {description['archivalState']}, not live"
+            )
+    return problems
+
+
+def bump_config_version(version) -> str:
+    """Increment the last component of a config version
+
+    Args:
+        version (str): config version, e.g. 1.2.0
+
+    Raises:
+        RuntimeError: version is not numbers separated by dots
+
+    Returns:
+        str: next version, e.g. 1.2.1
+    """
+    parts = version.split(".")
+    if not all(part.isdigit() for part in parts):
+        raise RuntimeError(f"VEP config version {version} is not valid")
+    parts[-1] = str(int(parts[-1]) + 1)
+    return ".".join(parts)
+
+
+def get_config_file_name(current_name, config_version) -> str:
+    """Generate file name of a new config version from the current name
+
+    Args:
+        current_name (str): name of current config file, e.g.
+            uranus_vep_config_v1.2.0.json
+        config_version (str): version of new config, e.g. 1.2.1
+
+    Returns:
+        str: name of new config file, e.g. uranus_vep_config_v1.2.1.json
+    """
+    if CONFIG_VERSION_REGEX.search(current_name):
+        return CONFIG_VERSION_REGEX.sub(
+            f"_v{config_version}.json", current_name
+        )
+    root = current_name[:-len(".json")] if current_name.endswith(
+        ".json"
+    ) else current_name
+    return f"{root}_v{config_version}.json"
+
+
+def split_file_id(file_id) -> tuple[str | None, str]:
+    """Split a DNAnexus file ID into its project and file parts
+
+    Args:
+        file_id (str): file ID, as file-xxxx or project-xxxx:file-xxxx
+
+    Returns:
+        tuple[str | None, str]: project ID, or None if file_id has no
+            project, and file ID
+    """
+    project, _, object_id = file_id.rpartition(":")
+    return project or None, object_id
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vep_config', type=str, required=True)
+    parser.add_argument('--clinvar_file', type=str, required=True)
+    parser.add_argument('--clinvar_index', type=str, required=True)
+    parser.add_argument('--project', type=str, required=True)
+    parser.add_argument('--folder', type=str, default="/")
+    args = parser.parse_args()
+
+    update_vep_config(
+        args.vep_config, args.clinvar_file, args.clinvar_index,
+        args.project, args.folder
+    )
@@ -4,20 +4,44 @@ pathToBin = "nextflow-bin"
 pathToInput = "input"
 pathToProjectDir = ""
 
+process listClinvarTargets
+{
+    input:
+        path config_path
+
+    output:
+        stdout
+
+    script:
+
+        """
+        python3 ${pathToBin}/clinvar_annotation_update.py --config_file ${config_path} --list_targets
+        """
+}
+
 process clinvarAnnotationUpdate
 {
+    tag "${target}"
+
     input:
         path config_path
+        val target
 
     script:
         
         """
-        python3 ${pathToBin}/clinvar_annotation_update.py --config_file ${config_path}
+        python3 ${pathToBin}/clinvar_annotation_update.py --config_file ${config_path} --target ${target} ${params.profile ? '--profile' : ''}
         """
 }
 
 workflow 
 {
-    // run phoenix clinvar annotation update
-    clinvarAnnotationUpdate(params.config_path)
+    // get builds to update from config, one per line
+    targets = listClinvarTargets(params.config_path)
+        .splitText()
+        .map { it.trim() }
+        .filter { it }
+
+    // run phoenix clinvar annotation update for each build in parallel
+    clinvarAnnotationUpdate(params.config_path, targets)
 }
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from ftplib import error_perm, error_temp
+
+from benchmarks.local_ftp_server import LocalFTPServer
+from bin.utils.async_ftp import (
+    AsyncFTPClient, AsyncFTPEngine, list_ftp_directories, fetch_ftp_files,
+    split_ftp_link
+)
+from unittest.mock import AsyncMock, Mock, patch
+
+
+class TestAsyncFTPLocal(unittest.TestCase):
+    def setUp(self):
+        self.served_dir = tempfile.TemporaryDirectory()
+        for build in ("GRCh37", "GRCh38"):
+            directory = os.path.join(
+                self.served_dir.name, "pub", "clinvar", build
+            )
+            os.makedirs(directory)
+            for version in ("20240107", "20240114"):
+                with open(os.path.join(
+                    directory, f"clinvar_{version}.vcf.gz.md5"
+                ), "w") as file:
+                    file.write(f"{build}{version}")
+        self.server = LocalFTPServer(self.served_dir.name).start()
+        self.base_link = f"ftp://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.served_dir.cleanup()
+
+    def test_list_ftp_directories(self):
+        """Test several directories are listed at once with their facts
+        """
+        links = [
+            f"{self.base_link}/pub/clinvar/{build}/"
+            for build in ("GRCh37", "GRCh38")
+        ]
+        listings = list_ftp_directories(links, rate_limiter=None)
+        with self.subTest():
+            assert list(listings) == links
+        with self.subTest():
+            assert sorted(name for name, _ in listings[links[0]]) == [
+                "clinvar_20240107.vcf.gz.md5", "clinvar_20240114.vcf.gz.md5"
+            ]
+        with self.subTest():
+            assert listings[links[1]][0][1]["size"] == "14"
+
+    def test_fetch_ftp_files(self):
+        """Test small files are downloaded into memory over at most
+        max_connections_per_host connections
+        """
+        expected = {
+            f"{self.base_link}/pub/clinvar/{build}/clinvar_{version}"
+            + ".vcf.gz.md5": f"{build}{version}".encode()
+            for build in ("GRCh37", "GRCh38")
+            for version in ("20240107", "20240114")
+        }
+        assert fetch_ftp_files(
+            list(expected), rate_limiter=None, max_connections_per_host=2
+        ) == expected
+
+    def test_missing_directory(self):
+        """Test listing a missing directory raises the server's error
+        """
+        with self.assertRaises(error_perm):
+            list_ftp_directories(
+                [f"{self.base_link}/pub/missing/"], rate_limiter=None
+            )
+
+
+class TestAsyncFTPClient(unittest.TestCase):
+    def test_read_reply_multiline(self):
+        """Test a multi-line reply is read up to its last line and error
+        codes are raised
+        """
+        async def read(data):
+            client = AsyncFTPClient()
+            client._reader = asyncio.StreamReader()
+            client._reader.feed_data(data)
+            return await client._read_reply()
+
+        with self.subTest():
+            assert asyncio.run(read(
+                b"211-Features:\r\n MLSD\r\n211 End\r\n220 Next\r\n"
+            )) == "211-Features:\n MLSD\n211 End"
+        with self.subTest():
+            with self.assertRaises(error_temp):
+                asyncio.run(read(b"421 Too many connections\r\n"))
+
+
+class TestAsyncFTPEngine(unittest.TestCase):
+    @patch("bin.utils.async_ftp.AsyncFTPClient")
+    def test_connect_backs_off_when_throttled(self, mock_client):
+        """Test a throttled connection backs off and is retried
+        """
+        client = mock_client.return_value
+        client.connect = AsyncMock(
+            side_effect=[error_temp("421 Too many connections"), "220"]
+        )
+        client.login = AsyncMock()
+        rate_limiter = Mock()
+        rate_limiter.backoff.return_value = 0.0
+        engine = AsyncFTPEngine(rate_limiter=rate_limiter)
+        with self.subTest():
+            assert asyncio.run(engine._connect("127.0.0.1:2121")) == client
+        with self.subTest():
+            assert client.connect.call_args.args == ("127.0.0.1", 2121)
+        with self.subTest():
+            rate_limiter.backoff.assert_called_once()
+        with self.subTest():
+            assert rate_limiter.acquire.call_count == 2
+
+    def test_split_ftp_link(self):
+        """Test link is split into host, with any port, and path
+        """
+        assert split_ftp_link(
+            "https://ftp.ncbi.nlm.nih.gov/pub/clinvar/"
+        ) == ("ftp.ncbi.nlm.nih.gov", "/pub/clinvar/")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+from bin.utils.bgzf import (
+    BGZFWriter, BGZF_EOF, MAX_BLOCK_DATA, check_bgzf_integrity
+)
+from unittest.mock import patch
+
+
+class TestBGZF(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "clinvar.vcf.gz")
+        self.contents = os.urandom(MAX_BLOCK_DATA) + b"chr1\t100\n" * 20000
+        with BGZFWriter(self.path) as writer:
+            writer.write(self.contents)
+        with open(self.path, "rb") as bgzf_file:
+            self.data = bytearray(bgzf_file.read())
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def rewrite(self, data):
+        with open(self.path, "wb") as bgzf_file:
+            bgzf_file.write(data)
+
+    def test_writer(self):
+        """Test written blocks decompress to the data written, with an EOF
+        marker at the end
+        """
+        with gzip.open(self.path, "rb") as bgzf_file:
+            with self.subTest():
+                assert bgzf_file.read() == self.contents
+        with self.subTest():
+            assert self.data.endswith(BGZF_EOF)
+
+    def test_check_bgzf_integrity(self):
+        """Test a valid file passes, with blocks checked in worker processes
+        """
+        with patch("bin.utils.bgzf.BLOCKS_PER_TASK", 1):
+            assert check_bgzf_integrity(self.path, workers=2) == 5
+
+    def test_check_bgzf_integrity_missing_eof(self):
+        """Test a file without the EOF marker fails
+        """
+        self.rewrite(self.data[:-len(BGZF_EOF)])
+        with self.assertRaisesRegex(RuntimeError, "missing the EOF marker"):
+            check_bgzf_integrity(self.path)
+
+    def test_check_bgzf_integrity_truncated(self):
+        """Test a file cut off part way through a block fails
+        """
+        self.rewrite(self.data[:1000])
+        with self.assertRaisesRegex(RuntimeError, "byte 0 is truncated"):
+            check_bgzf_integrity(self.path)
+
+    def test_check_bgzf_integrity_truncated_header(self):
+        """Test a file cut off part way through the header of its last
+        block fails
+        """
+        offset = len(self.data) - len(BGZF_EOF)
+        # cut before the extra field length, and part way through the
+        # extra field
+        for end in (8, 14):
+            with self.subTest(end=end):
+                self.rewrite(self.data[:offset + end])
+                with self.assertRaisesRegex(
+                    RuntimeError, f"header at byte {offset} is truncated"
+                ):
+                    check_bgzf_integrity(self.path)
+
+    def test_check_bgzf_integrity_bad_crc(self):
+        """Test a block that does not match its CRC32 fails
+        """
+        # CRC32 of the first block sits before its 4 byte ISIZE
+        first_block_size = int.from_bytes(self.data[16:18], "little") + 1
+        self.data[first_block_size - 8] ^= 0xFF
+        self.rewrite(self.data)
+        with self.assertRaisesRegex(RuntimeError, "does not match its CRC32"):
+            check_bgzf_integrity(self.path)
+
+    def test_check_bgzf_integrity_not_bgzf(self):
+        """Test a plain gzip file fails
+        """
+        self.rewrite(gzip.compress(self.contents))
+        with self.assertRaisesRegex(RuntimeError, "no block header"):
+            check_bgzf_integrity(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,13 @@
 import unittest
+import datetime
 import sys
 import os
 sys.path.append(os.path.abspath(
     os.path.join(os.path.realpath(__file__), '../../bin')
 ))
 from bin.clinvar_annotation_update import (
-    load_config
+    main, load_config, upload_run_metrics, backfill_clinvar_target,
+    UpdateConfig
 )
 from unittest.mock import Mock, patch, mock_open
 
@@ -20,18 +22,331 @@ class TestClinvarAnnotationUpdate(unittest.TestCase):
 }
 """
         with patch("builtins.open", mock_open(read_data=contents)):
+            config = load_config("")
+        with self.subTest():
+            assert config.clinvar_base_links == [
+                "https://ftp.ncbi.nlm.nih.gov"
+            ]
+        with self.subTest():
+            assert config.clinvar_targets == {
+                "GRCh38": "/pub/clinvar/vcf_GRCh38/weekly/"
+            }
+        with self.subTest():
+            assert config.clinvar_weeks_ago == 8
+        with self.subTest():
+            assert config.update_project_id == "project-xxxx"
+        with self.subTest():
+            assert config.download_segments == 1
+        with self.subTest():
+            assert config.block_size == 1024 * 1024
+        with self.subTest():
+            assert not config.stream_upload
+        with self.subTest():
+            assert config.catalogue_path is None
+        with self.subTest():
+            assert config.production_files == {}
+        with self.subTest():
+            assert config.vep_config_files == {}
+
+    def test_load_config_download_options(self):
+        """Test optional download segment, block size and stream upload keys
+        are read
+        """
+        contents = """{
+"CLINVAR_BASE_LINK": "https://ftp.ncbi.nlm.nih.gov",
+"CLINVAR_DOWNLOAD_SEGMENTS": 4,
+"CLINVAR_DOWNLOAD_BLOCK_SIZE": 65536,
+"CLINVAR_STREAM_UPLOAD": true,
+"CLINVAR_LINK_PATH_B38": "/pub/clinvar/vcf_GRCh38/weekly/",
+"CLINVAR_CHECK_NUM_WEEKS_AGO": 8,
+"UPDATE_PROJECT_ID": "project-xxxx"
+}
+"""
+        with patch("builtins.open", mock_open(read_data=contents)):
+            config = load_config("")
+        with self.subTest():
+            assert config.download_segments == 4
+        with self.subTest():
+            assert config.block_size == 65536
+        with self.subTest():
+            assert config.stream_upload
+
+    def test_load_config_targets(self):
+        """Test each build target in config is read in order
+        """
+        contents = """{
+"CLINVAR_BASE_LINK": "https://ftp.ncbi.nlm.nih.gov",
+"CLINVAR_TARGETS": [
+    {"BUILD": "GRCh38", "CLINVAR_LINK_PATH": "/pub/clinvar/vcf_GRCh38/weekly/",
+     "VEP_CONFIG_FILE": "project-yyyy:file-zzzz"},
+    {"BUILD": "GRCh37", "CLINVAR_LINK_PATH": "/pub/clinvar/vcf_GRCh37/weekly/",
+     "PRODUCTION_CLINVAR_FILE": "project-yyyy:file-yyyy"}
+],
+"CLINVAR_CHECK_NUM_WEEKS_AGO": 8,
+"UPDATE_PROJECT_ID": "project-xxxx"
+}
+"""
+        with patch("builtins.open", mock_open(read_data=contents)):
+            config = load_config("")
+        with self.subTest():
+            assert list(config.clinvar_targets.items()) == [
+                ("GRCh38", "/pub/clinvar/vcf_GRCh38/weekly/"),
+                ("GRCh37", "/pub/clinvar/vcf_GRCh37/weekly/"),
+            ]
+        with self.subTest():
+            assert config.production_files == {
+                "GRCh37": "project-yyyy:file-yyyy"
+            }
+        with self.subTest():
+            assert config.vep_config_files == {
+                "GRCh38": "project-yyyy:file-zzzz"
+            }
+
+    def test_load_config_no_targets(self):
+        """Test error is raised when config has no link path or targets
+        """
+        contents = """{
+"CLINVAR_BASE_LINK": "https://ftp.ncbi.nlm.nih.gov",
+"CLINVAR_CHECK_NUM_WEEKS_AGO": 8,
+"UPDATE_PROJECT_ID": "project-xxxx"
+}
+"""
+        expected_err = "Config file does not contain expected keys"
+        with patch("builtins.open", mock_open(read_data=contents)):
+            with self.assertRaisesRegex(RuntimeError, expected_err):
+                load_config("")
+
+    @patch("bin.clinvar_annotation_update.list_clinvar_directories")
+    @patch("bin.clinvar_annotation_update.prefetch_clinvar_checksums")
+    @patch("bin.clinvar_annotation_update.METRICS")
+    @patch("bin.clinvar_annotation_update.upload_run_metrics")
+    @patch("bin.clinvar_annotation_update.update_clinvar_target")
+    @patch("bin.clinvar_annotation_update.load_config")
+    def test_main_target(
+        self, mock_config, mock_update, mock_upload_metrics, mock_metrics,
+        mock_prefetch, mock_list
+    ):
+        """Test only the selected target is updated, using its directory
+        listing and checksum fetched up front
+        """
+        mock_config.return_value = UpdateConfig(
+            ["https://ftp.ncbi.nlm.nih.gov"],
+            {"GRCh38": "/vcf_GRCh38/weekly/", "GRCh37": "/vcf_GRCh37/weekly/"},
+            8, "project-xxxx", 1, 1024, False, None, {}, {}
+        )
+        mock_update.return_value = "/clinvar_version_20240101_GRCh37"
+        listing = [("clinvar_20240101.vcf.gz", {"type": "file"})]
+        mock_list.return_value = {"/vcf_GRCh37/weekly/": listing}
+        checksums = {"/vcf_GRCh37/weekly/clinvar_20240101.vcf.gz.md5": b"0"}
+        mock_prefetch.return_value = checksums
+        main("", "GRCh37")
+        with self.subTest():
+            mock_upload_metrics.assert_called_once_with(
+                "project-xxxx", ["/clinvar_version_20240101_GRCh37"]
+            )
+        with self.subTest():
+            mock_update.assert_called_once()
+        with self.subTest():
+            assert mock_update.call_args.args[:3] == (
+                "GRCh37", "https://ftp.ncbi.nlm.nih.gov",
+                "/vcf_GRCh37/weekly/"
+            )
+        with self.subTest():
+            mock_list.assert_called_once_with(
+                "https://ftp.ncbi.nlm.nih.gov", ["/vcf_GRCh37/weekly/"]
+            )
+        with self.subTest():
+            assert mock_update.call_args.args[-2:] == (listing, checksums)
+        with self.subTest():
+            mock_prefetch.assert_called_once_with(
+                "https://ftp.ncbi.nlm.nih.gov", mock_list.return_value
+            )
+
+    @patch(
+        "bin.clinvar_annotation_update.list_clinvar_directories",
+        Mock(return_value={})
+    )
+    @patch("bin.clinvar_annotation_update.FTP_POOL")
+    @patch("bin.clinvar_annotation_update.METRICS")
+    @patch("bin.clinvar_annotation_update.upload_run_metrics")
+    @patch("bin.clinvar_annotation_update.backfill_clinvar_target")
+    @patch("bin.clinvar_annotation_update.load_config")
+    def test_main_backfill(
+        self, mock_config, mock_backfill, mock_upload_metrics, mock_metrics,
+        mock_pool
+    ):
+        """Test releases are backfilled from CLINVAR_CHECK_NUM_WEEKS_AGO
+        weeks before the end date when no start date is given, within the
+        same FTP sessions per host as a normal run
+        """
+        mock_config.return_value = UpdateConfig(
+            ["https://ftp.ncbi.nlm.nih.gov"],
+            {"GRCh38": "/vcf_GRCh38/weekly/"},
+            8, "project-xxxx", 4, 1024, False, None, {}, {}
+        )
+        mock_pool.max_sessions_per_host = 3
+        mock_backfill.return_value = [
+            "/clinvar_version_20240101_GRCh38",
+            "/clinvar_version_20240107_GRCh38",
+        ]
+        main("", backfill_end=datetime.date(2024, 1, 31))
+        with self.subTest():
+            assert mock_backfill.call_args.args[3:5] == (
+                datetime.date(2023, 12, 6), datetime.date(2024, 1, 31)
+            )
+        with self.subTest():
+            mock_upload_metrics.assert_called_once_with(
+                "project-xxxx", mock_backfill.return_value
+            )
+        with self.subTest():
+            # a session per segment and one for the index, not per release
+            assert mock_pool.max_sessions_per_host == 5
+
+    @patch(
+        "bin.clinvar_annotation_update.list_clinvar_directories",
+        Mock(return_value={})
+    )
+    @patch("bin.clinvar_annotation_update.upload_profile_reports")
+    @patch("bin.clinvar_annotation_update.StageProfiler")
+    @patch("bin.clinvar_annotation_update.METRICS")
+    @patch("bin.clinvar_annotation_update.upload_run_metrics")
+    @patch("bin.clinvar_annotation_update.update_clinvar_target")
+    @patch("bin.clinvar_annotation_update.load_config")
+    def test_main_profile(
+        self, mock_config, mock_update, mock_upload_metrics, mock_metrics,
+        mock_profiler, mock_upload_reports
+    ):
+        """Test stages are profiled while targets are updated and the
+        reports uploaded to each update folder once profiling stops
+        """
+        mock_config.return_value = UpdateConfig(
+            ["https://ftp.ncbi.nlm.nih.gov"],
+            {"GRCh38": "/vcf_GRCh38/weekly/"},
+            8, "project-xxxx", 1, 1024, False, None, {}, {}
+        )
+        profiler = mock_profiler.return_value
+        profiler.reports = ["phoenix_profile/001_download.pstats"]
+
+        def update_target(*args):
+            # profiler is set on the run's metrics while targets update
+            assert mock_metrics.profiler == profiler
+            return "/clinvar_version_20240107_GRCh38"
+        mock_update.side_effect = update_target
+        main("", profile=True)
+        with self.subTest():
+            profiler.start.assert_called_once()
+        with self.subTest():
+            profiler.stop.assert_called_once()
+        with self.subTest():
+            assert mock_metrics.profiler is None
+        with self.subTest():
+            mock_upload_reports.assert_called_once_with(
+                "project-xxxx", ["/clinvar_version_20240107_GRCh38"],
+                profiler.reports
+            )
+
+    @patch("bin.clinvar_annotation_update.fetch_clinvar_checksums")
+    @patch("bin.clinvar_annotation_update.update_clinvar_release")
+    @patch("bin.clinvar_annotation_update.get_clinvar_releases_in_window")
+    @patch("bin.clinvar_annotation_update.FTP_POOL", Mock())
+    @patch("bin.clinvar_annotation_update.connect_to_website", Mock())
+    def test_backfill_clinvar_target(
+        self, mock_releases, mock_update, mock_checksums
+    ):
+        """Test every release in the window is updated with its checksum
+        fetched up front, and releases already updated by an earlier run
+        are left out of the result
+        """
+        releases = [
             (
-                clinvar_base_link, clinvar_link_path, clinvar_weeks_ago,
-                update_project_id
-            ) = load_config("")
+                f"clinvar_{version}.vcf.gz", f"clinvar_{version}.vcf.gz.tbi",
+                datetime.datetime.strptime(version, "%Y%m%d").date(),
+                version, f"clinvar_{version}.vcf.gz.md5"
+            )
+            for version in ("20240101", "20240107", "20240114")
+        ]
+        mock_releases.return_value = releases
+        mock_checksums.side_effect = lambda base_link, paths: {
+            path: path.encode() for path in paths
+        }
+        # 20240107 was updated by an earlier run
+        mock_update.side_effect = lambda *args, **kwargs: (
+            None if args[4][3] == "20240107"
+            else f"/clinvar_version_{args[4][3]}_GRCh38"
+        )
+        update_folders = backfill_clinvar_target(
+            "GRCh38", "https://ftp.ncbi.nlm.nih.gov", "/vcf_GRCh38/weekly/",
+            datetime.date(2024, 1, 1), datetime.date(2024, 1, 31),
+            "project-xxxx", max_releases=2
+        )
+        with self.subTest():
+            assert update_folders == [
+                "/clinvar_version_20240101_GRCh38",
+                "/clinvar_version_20240114_GRCh38",
+            ]
+        with self.subTest():
+            assert sorted(
+                call.args[4] for call in mock_update.call_args_list
+            ) == releases
+        with self.subTest():
+            mock_checksums.assert_called_once()
         with self.subTest():
-            assert clinvar_base_link == "https://ftp.ncbi.nlm.nih.gov"
+            assert all(
+                call.kwargs["checksum_contents"] == (
+                    f"/vcf_GRCh38/weekly/{call.args[4][4]}".encode()
+                )
+                for call in mock_update.call_args_list
+            )
+
+    @patch("bin.clinvar_annotation_update.load_config")
+    def test_main_unknown_target(self, mock_config):
+        """Test error is raised when selected target is not in config
+        """
+        mock_config.return_value = UpdateConfig(
+            ["https://ftp.ncbi.nlm.nih.gov"],
+            {"GRCh38": "/vcf_GRCh38/weekly/"},
+            8, "project-xxxx", 1, 1024, False, None, {}, {}
+        )
+        with self.assertRaisesRegex(RuntimeError, "Target GRCh37 not found"):
+            main("", "GRCh37")
+
+    @patch(
+        "bin.clinvar_annotation_update.hash_file",
+        Mock(return_value={"md5": "abc", "sha256": "def"})
+    )
+    @patch("bin.clinvar_annotation_update.upload_file_DNAnexus")
+    @patch("bin.clinvar_annotation_update.METRICS")
+    def test_upload_run_metrics(self, mock_metrics, mock_upload):
+        """Test run metrics are uploaded to every update folder with their
+        checksums
+        """
+        mock_metrics.write.return_value = "phoenix_run_metrics.jsonl"
+        checksums = {"md5": "abc", "sha256": "def"}
+        upload_run_metrics("project-xxxx", ["/update_b37", "/update_b38"])
         with self.subTest():
-            assert clinvar_link_path == "/pub/clinvar/vcf_GRCh38/weekly/"
+            mock_metrics.write.assert_called_once()
+        with self.subTest():
+            assert [call.args for call in mock_upload.call_args_list] == [
+                (
+                    "phoenix_run_metrics.jsonl", "project-xxxx",
+                    "/update_b37", checksums
+                ),
+                (
+                    "phoenix_run_metrics.jsonl", "project-xxxx",
+                    "/update_b38", checksums
+                ),
+            ]
+
+    @patch("bin.clinvar_annotation_update.upload_file_DNAnexus")
+    @patch("bin.clinvar_annotation_update.METRICS")
+    def test_upload_run_metrics_no_update(self, mock_metrics, mock_upload):
+        """Test nothing is written or uploaded if no target was updated
+        """
+        upload_run_metrics("project-xxxx", [])
         with self.subTest():
-            assert clinvar_weeks_ago == 8
+            mock_metrics.write.assert_not_called()
         with self.subTest():
-            assert update_project_id == "project-xxxx"
+            mock_upload.assert_not_called()
 
 
 if __name__ == "__main__":
@@ -7,27 +7,29 @@ sys.path.append(os.path.abspath(
 
 from bin.clinvar_file_fetcher import (
     connect_to_website, get_most_recent_clivar_file_info,
-    download_clinvar_dnanexus
+    get_clinvar_releases_in_window, download_clinvar_dnanexus,
+    list_clinvar_directories, select_clinvar_mirror,
+    fetch_clinvar_checksums, prefetch_clinvar_checksums
 )
 from unittest.mock import Mock, patch, mock_open
 from ftplib import error_perm
+import datetime
+import threading
 
 
 class TestClinvarFileFetcher(unittest.TestCase):
-    @patch("bin.clinvar_file_fetcher.time.sleep")
-    @patch("bin.clinvar_file_fetcher.FTP")
-    def test_connect_to_website(self, mock_ftp, mock_sleep):
+    @patch("bin.clinvar_file_fetcher.FTP_POOL")
+    def test_connect_to_website(self, mock_ftp):
         """Test that ftp website can be connected to when a valid link is
         provided
         """
         assert connect_to_website(
             "https://ftp.ncbi.nlm.nih.gov",
             "/pub/clinvar/vcf_GRCh38/weekly/file.txt"
-        ) == mock_ftp.return_value
+        ) == mock_ftp.acquire.return_value
 
-    @patch("bin.clinvar_file_fetcher.time.sleep")
-    @patch("bin.clinvar_file_fetcher.FTP")
-    def test_connect_to_website_invalid_link(self, mock_ftp, mock_sleep):
+    @patch("bin.clinvar_file_fetcher.FTP_POOL")
+    def test_connect_to_website_invalid_link(self, mock_ftp):
         """Test that ftp website connection will fail when invalid link is
         provided
         """
@@ -38,13 +40,12 @@ class TestClinvarFileFetcher(unittest.TestCase):
                 "/pub/clinvar/vcf_GRCh38/weekly/file.txt"
             )
 
-    @patch("bin.clinvar_file_fetcher.time.sleep")
-    @patch("bin.clinvar_file_fetcher.FTP")
-    def test_connect_to_website_cannot_connect(self, mock_ftp, mock_sleep):
+    @patch("bin.clinvar_file_fetcher.FTP_POOL")
+    def test_connect_to_website_cannot_connect(self, mock_ftp):
         """Test that correct error message is returned if ftp website fails to
         connect
         """
-        mock_ftp.side_effect = OSError(
+        mock_ftp.acquire.side_effect = OSError(
             {"error": {"type": "test", "message": "test"}}, ""
         )
         expected_err = "Error: cannot connect to website"
@@ -54,13 +55,12 @@ class TestClinvarFileFetcher(unittest.TestCase):
                 "/pub/clinvar/vcf_GRCh38/weekly/file.txt"
             )
 
-    @patch("bin.clinvar_file_fetcher.time.sleep")
-    @patch("bin.clinvar_file_fetcher.FTP")
-    def test_connect_to_website_cannot_find(self, mock_ftp, mock_sleep):
+    @patch("bin.clinvar_file_fetcher.FTP_POOL")
+    def test_connect_to_website_cannot_find(self, mock_ftp):
         """Test that ftp website connection will fail when file path cannot be
         found on website and return appropriate error emssage
         """
-        mock_ftp.return_value.cwd.side_effect = error_perm(
+        mock_ftp.acquire.side_effect = error_perm(
             {"error": {"type": "test", "message": "test"}}, ""
         )
         path = "/pub/clinvar/vcf_GRCh38/weekly/file.txt"
@@ -71,6 +71,270 @@ class TestClinvarFileFetcher(unittest.TestCase):
                 path
             )
 
+    def test_get_most_recent_clivar_file_info_catalogue(self):
+        """Test most recent clinvar file info is taken from the release
+        catalogue when one is provided
+        """
+        catalogue = Mock()
+        catalogue.newest_complete_release.return_value = {
+            "version": "20240107",
+            "vcf": {"name": "clinvar_20240107.vcf.gz"},
+            "tbi": {"name": "clinvar_20240107.vcf.gz.tbi"},
+            "md5": {"name": "clinvar_20240107.vcf.gz.md5"},
+        }
+        ftp = Mock()
+        (
+            vcf, tbi, version_date, version, checksum
+        ) = get_most_recent_clivar_file_info(ftp, catalogue)
+        with self.subTest():
+            catalogue.refresh.assert_called_once_with(ftp)
+        with self.subTest():
+            assert (vcf, tbi, checksum) == (
+                "clinvar_20240107.vcf.gz", "clinvar_20240107.vcf.gz.tbi",
+                "clinvar_20240107.vcf.gz.md5"
+            )
+        with self.subTest():
+            assert version_date == datetime.date(2024, 1, 7)
+        with self.subTest():
+            assert version == "20240107"
+
+    def test_get_most_recent_clivar_file_info_catalogue_empty(self):
+        """Test error is raised when the catalogue has no complete release
+        """
+        catalogue = Mock()
+        catalogue.newest_complete_release.return_value = None
+        expected_err = (
+            "No ClinVar VCF files with matching index and checksum could be"
+            + " found on ncbi website"
+        )
+        with self.assertRaisesRegex(RuntimeError, expected_err):
+            get_most_recent_clivar_file_info(Mock(), catalogue)
+
+    def test_get_clinvar_releases_in_window(self):
+        """Test every complete release in the date window is returned,
+        listing the directory through a new catalogue if none is provided
+        """
+        ftp = Mock()
+        ftp.mlsd.return_value = [
+            (f"clinvar_{version}.vcf.gz{extension}", {"type": "file"})
+            for version in ("20231231", "20240107", "20240114")
+            for extension in ("", ".tbi", ".md5")
+        ]
+        ftp.sendcmd.side_effect = error_perm("550 not found")
+        releases = get_clinvar_releases_in_window(
+            ftp, datetime.date(2024, 1, 1), datetime.date(2024, 1, 31)
+        )
+        with self.subTest():
+            assert [release[3] for release in releases] == [
+                "20240107", "20240114"
+            ]
+        with self.subTest():
+            assert releases[0] == (
+                "clinvar_20240107.vcf.gz", "clinvar_20240107.vcf.gz.tbi",
+                datetime.date(2024, 1, 7), "20240107",
+                "clinvar_20240107.vcf.gz.md5"
+            )
+
+    def test_get_clinvar_releases_in_window_listing(self):
+        """Test a listing fetched up front is used without touching ftp
+        """
+        ftp = Mock()
+        listing = [
+            (f"clinvar_20240107.vcf.gz{extension}", {})
+            for extension in ("", ".tbi", ".md5")
+        ]
+        releases = get_clinvar_releases_in_window(
+            ftp, datetime.date(2024, 1, 1), datetime.date(2024, 1, 31),
+            listing=listing
+        )
+        with self.subTest():
+            assert [release[3] for release in releases] == ["20240107"]
+        with self.subTest():
+            assert not ftp.mock_calls
+
+    @patch("bin.clinvar_file_fetcher.FTP_MIRRORS")
+    @patch("bin.clinvar_file_fetcher.probe_clinvar_mirror")
+    def test_select_clinvar_mirror(self, mock_probe, mock_mirrors):
+        """Test the fastest mirror holding the newest release is selected,
+        and stale or unreachable mirrors are not failed over to
+        """
+        probes = {
+            "https://ftp.ncbi.nlm.nih.gov": ("20240107", 5e6, None),
+            "https://fast.example.org": ("20240107", 9e6, None),
+            "https://stale.example.org": ("20231231", 20e6, None),
+            "https://down.example.org": (None, None, "cannot connect"),
+        }
+        mock_probe.side_effect = lambda base_link, paths: {
+            "base_link": base_link,
+            "versions": {
+                path: probes[base_link][0] for path in paths
+                if probes[base_link][0]
+            },
+            "listing_seconds": 0.1, "throughput": probes[base_link][1],
+            "error": probes[base_link][2],
+        }
+        with self.subTest():
+            assert select_clinvar_mirror(
+                list(probes), ["/pub/clinvar/vcf_GRCh38/weekly/"]
+            ) == "https://fast.example.org"
+        with self.subTest():
+            mock_mirrors.set_mirrors.assert_called_once_with([
+                "https://fast.example.org", "https://ftp.ncbi.nlm.nih.gov"
+            ])
+
+    @patch("bin.clinvar_file_fetcher.FTP_MIRRORS")
+    @patch("bin.clinvar_file_fetcher.probe_clinvar_mirror")
+    def test_select_clinvar_mirror_stale_target(
+        self, mock_probe, mock_mirrors
+    ):
+        """Test a mirror holding the newest release for one target but not
+        another is not selected
+        """
+        paths = [
+            "/pub/clinvar/vcf_GRCh37/weekly/",
+            "/pub/clinvar/vcf_GRCh38/weekly/",
+        ]
+        probes = {
+            "https://ftp.ncbi.nlm.nih.gov": (
+                {paths[0]: "20240107", paths[1]: "20240107"}, 5e6
+            ),
+            "https://fast.example.org": (
+                {paths[0]: "20231231", paths[1]: "20240107"}, 9e6
+            ),
+        }
+        mock_probe.side_effect = lambda base_link, paths: {
+            "base_link": base_link, "versions": probes[base_link][0],
+            "listing_seconds": 0.1, "throughput": probes[base_link][1],
+            "error": None,
+        }
+        with self.subTest():
+            assert select_clinvar_mirror(
+                list(probes), paths
+            ) == "https://ftp.ncbi.nlm.nih.gov"
+        with self.subTest():
+            mock_probe.assert_any_call("https://fast.example.org", paths)
+        with self.subTest():
+            mock_mirrors.set_mirrors.assert_called_once_with([
+                "https://ftp.ncbi.nlm.nih.gov"
+            ])
+
+    @patch("bin.clinvar_file_fetcher.probe_clinvar_mirror")
+    def test_select_clinvar_mirror_single(self, mock_probe):
+        """Test a single mirror is used without probing it
+        """
+        with self.subTest():
+            assert select_clinvar_mirror(
+                ["https://ftp.ncbi.nlm.nih.gov"], ["/pub/clinvar/"]
+            ) == "https://ftp.ncbi.nlm.nih.gov"
+        with self.subTest():
+            mock_probe.assert_not_called()
+
+    @patch("bin.clinvar_file_fetcher.probe_clinvar_mirror")
+    def test_select_clinvar_mirror_none(self, mock_probe):
+        """Test error is raised when no mirror could be probed
+        """
+        mock_probe.side_effect = lambda base_link, paths: {
+            "base_link": base_link, "versions": {},
+            "listing_seconds": None, "throughput": None,
+            "error": "cannot connect",
+        }
+        with self.assertRaisesRegex(RuntimeError, "No ClinVar mirror"):
+            select_clinvar_mirror(
+                ["https://a.example.org", "https://b.example.org"],
+                ["/pub/clinvar/"]
+            )
+
+    @patch("bin.clinvar_file_fetcher.list_ftp_directories")
+    def test_list_clinvar_directories(self, mock_list):
+        """Test every target directory is listed in one call and only files
+        are returned for each path
+        """
+        mock_list.return_value = {
+            "https://ftp.ncbi.nlm.nih.gov/pub/clinvar/vcf_GRCh38/weekly/": [
+                ("clinvar_20240107.vcf.gz", {"type": "file"}),
+                ("archive", {"type": "dir"}),
+            ],
+            "https://ftp.ncbi.nlm.nih.gov/pub/clinvar/vcf_GRCh37/weekly/": [],
+        }
+        listings = list_clinvar_directories(
+            "https://ftp.ncbi.nlm.nih.gov/", [
+                "/pub/clinvar/vcf_GRCh38/weekly/",
+                "/pub/clinvar/vcf_GRCh37/weekly/",
+            ]
+        )
+        with self.subTest():
+            mock_list.assert_called_once()
+        with self.subTest():
+            assert listings == {
+                "/pub/clinvar/vcf_GRCh38/weekly/": [
+                    ("clinvar_20240107.vcf.gz", {"type": "file"})
+                ],
+                "/pub/clinvar/vcf_GRCh37/weekly/": [],
+            }
+
+    @patch("bin.clinvar_file_fetcher.list_ftp_directories")
+    def test_list_clinvar_directories_cannot_connect(self, mock_list):
+        """Test connection errors are raised as RuntimeError
+        """
+        mock_list.side_effect = OSError("connection refused")
+        with self.assertRaisesRegex(RuntimeError, "cannot list directories"):
+            list_clinvar_directories(
+                "https://ftp.ncbi.nlm.nih.gov", ["/pub/clinvar/"]
+            )
+
+    @patch("bin.clinvar_file_fetcher.fetch_ftp_files")
+    def test_prefetch_clinvar_checksums(self, mock_fetch):
+        """Test the checksums of each directory's newest release are fetched
+        in one call, skipping directories without a complete release
+        """
+        mock_fetch.side_effect = lambda links: {
+            link: b"0" * 32 for link in links
+        }
+        listings = {
+            "/pub/clinvar/vcf_GRCh38/weekly/": [
+                (name, {"type": "file"}) for name in (
+                    "clinvar_20240101.vcf.gz", "clinvar_20240107.vcf.gz",
+                    "clinvar_20240107.vcf.gz.tbi",
+                    "clinvar_20240107.vcf.gz.md5",
+                )
+            ],
+            "/pub/clinvar/vcf_GRCh37/weekly/": [],
+        }
+        checksums = prefetch_clinvar_checksums(
+            "https://ftp.ncbi.nlm.nih.gov/", listings
+        )
+        with self.subTest():
+            mock_fetch.assert_called_once_with([
+                "https://ftp.ncbi.nlm.nih.gov/pub/clinvar/vcf_GRCh38/weekly/"
+                + "clinvar_20240107.vcf.gz.md5"
+            ])
+        with self.subTest():
+            assert checksums == {
+                "/pub/clinvar/vcf_GRCh38/weekly/clinvar_20240107.vcf.gz.md5":
+                    b"0" * 32
+            }
+
+    @patch("bin.clinvar_file_fetcher.fetch_ftp_files")
+    def test_fetch_clinvar_checksums_cannot_connect(self, mock_fetch):
+        """Test no checksums are returned when they cannot be fetched, so
+        each is downloaded with its file instead
+        """
+        mock_fetch.side_effect = OSError("connection refused")
+        assert fetch_clinvar_checksums(
+            "https://ftp.ncbi.nlm.nih.gov", ["/pub/clinvar/clinvar.md5"]
+        ) == {}
+
+    def test_get_clinvar_releases_in_window_empty(self):
+        """Test error is raised when no complete release is in the window
+        """
+        catalogue = Mock()
+        catalogue.complete_releases.return_value = []
+        with self.assertRaisesRegex(RuntimeError, "from 2024-01-01 to"):
+            get_clinvar_releases_in_window(
+                Mock(), datetime.date(2024, 1, 1),
+                datetime.date(2024, 1, 31), catalogue
+            )
+
     @patch("bin.clinvar_file_fetcher.download_file_upload_DNAnexus")
     def test_download_clinvar_dnanexus(self, mock_download):
         """Test that DNAnexus file IDs are returned when files are downloaded
@@ -90,5 +354,58 @@ class TestClinvarFileFetcher(unittest.TestCase):
             assert index == filename
 
 
+    @patch("bin.clinvar_file_fetcher.download_file_upload_DNAnexus")
+    def test_download_clinvar_dnanexus_concurrent_index(self, mock_download):
+        """Test the index is transferred while the VCF is still downloading,
+        and is given the future set once the VCF is on local disk
+        """
+        index_started = threading.Event()
+
+        def transfer(link, *args, **kwargs):
+            if link.endswith(".tbi"):
+                index_started.set()
+                assert kwargs["indexed_file"] == "my_file_GRCh38.vcf.gz"
+                assert kwargs["indexed_file_ready"].result(timeout=5) == (
+                    "my_file_GRCh38.vcf.gz"
+                )
+                return "file-index"
+            # the VCF only finishes once the index transfer has started
+            assert index_started.wait(timeout=5)
+            kwargs["downloaded"].set_result("my_file_GRCh38.vcf.gz")
+            return "file-vcf"
+        mock_download.side_effect = transfer
+        assert download_clinvar_dnanexus(
+            "https://ftp.ncbi.nlm.nih.gov",
+            "/pub/clinvar/vcf_GRCh38/weekly/",
+            "", "/my_folder", "my_file.vcf.gz", "my_checksum.md5",
+            "my_file.vcf.gz.tbi"
+        ) == ("file-vcf", "file-index")
+
+    @patch("bin.clinvar_file_fetcher.download_file_upload_DNAnexus")
+    def test_download_clinvar_dnanexus_vcf_fails(self, mock_download):
+        """Test the index transfer is released from waiting for the VCF when
+        the VCF transfer fails, and the VCF error is raised
+        """
+        index_ready = []
+
+        def transfer(link, *args, **kwargs):
+            if link.endswith(".tbi"):
+                index_ready.append(kwargs["indexed_file_ready"])
+                kwargs["indexed_file_ready"].exception(timeout=5)
+                return "file-index"
+            raise RuntimeError("did not match checksum")
+        mock_download.side_effect = transfer
+        with self.subTest():
+            with self.assertRaisesRegex(RuntimeError, "did not match"):
+                download_clinvar_dnanexus(
+                    "https://ftp.ncbi.nlm.nih.gov",
+                    "/pub/clinvar/vcf_GRCh38/weekly/",
+                    "", "/my_folder", "my_file.vcf.gz", "my_checksum.md5",
+                    "my_file.vcf.gz.tbi"
+                )
+        with self.subTest():
+            assert index_ready[0].cancelled()
+
+
 if __name__ == "__main__":
     unittest.main()
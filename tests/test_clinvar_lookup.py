@@ -0,0 +1,55 @@
+import os
+import sys
+import tempfile
+import unittest
+sys.path.append(os.path.abspath(
+    os.path.join(os.path.realpath(__file__), '../../bin')
+))
+from bin.clinvar_lookup import main, parse_variant
+from bin.utils.lookup_index import build_lookup_index
+from tests.test_lookup_index import make_vcf
+
+
+class TestClinvarLookup(unittest.TestCase):
+    def test_parse_variant(self):
+        """Test variants are parsed with or without alleles
+        """
+        with self.subTest():
+            assert parse_variant("chr1:100:A:G") == ("chr1", 100, "A", "G")
+        with self.subTest():
+            assert parse_variant("X-50") == ("X", 50, None, None)
+        with self.subTest("deletion"):
+            assert parse_variant("1:100:A:-") == ("1", 100, "A", "-")
+        with self.subTest("insertion"):
+            assert parse_variant("1-100---AT") == ("1", 100, "-", "AT")
+        with self.subTest():
+            with self.assertRaisesRegex(RuntimeError, "is not in format"):
+                parse_variant("1:100:A")
+
+    def test_main(self):
+        """Test a TSV row is written for each record found and for each
+        variant not in the release
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index_path = os.path.join(tmp_dir, "lookup.idx")
+            build_lookup_index(make_vcf([
+                ("1", 100, "1", "A", "G", "Pathogenic"),
+            ]), index_path)
+            variants_path = os.path.join(tmp_dir, "variants.txt")
+            with open(variants_path, "w") as variants_file:
+                variants_file.write("# variants\n1:200\n")
+            output_path = os.path.join(tmp_dir, "results.tsv")
+            main(index_path, ["1:100:A:G"], variants_path, output_path)
+            with open(output_path) as output_file:
+                lines = output_file.read().splitlines()
+        with self.subTest():
+            assert lines[1].split("\t") == [
+                "1:100:A:G", "1", "100", "1", "A", "G", "Pathogenic",
+                "single"
+            ]
+        with self.subTest():
+            assert lines[2] == "1:200" + "\t" * 7
+
+
+if __name__ == "__main__":
+    unittest.main()
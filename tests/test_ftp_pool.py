@@ -0,0 +1,152 @@
+import threading
+import unittest
+
+from bin.utils.ftp_pool import FTPSessionPool
+from bin.utils.rate_limiter import RateLimiter
+from unittest.mock import Mock, patch
+from ftplib import error_perm, error_temp
+
+
+class TestFTPSessionPool(unittest.TestCase):
+    @patch("bin.utils.ftp_pool.FTP")
+    def test_acquire_reuses_released_session(self, mock_ftp):
+        """Test a released session is reused rather than reconnecting
+        """
+        pool = FTPSessionPool()
+        ftp = pool.acquire("ftp.ncbi.nlm.nih.gov", "/pub/clinvar/")
+        pool.release(ftp)
+        with self.subTest():
+            assert pool.acquire(
+                "ftp.ncbi.nlm.nih.gov", "/pub/clinvar/"
+            ) == ftp
+        with self.subTest():
+            mock_ftp.assert_called_once()
+        with self.subTest():
+            # directory is unchanged, so cwd should only be sent once
+            ftp.cwd.assert_called_once_with("/pub/clinvar/")
+
+    @patch("bin.utils.ftp_pool.FTP")
+    def test_acquire_reconnects_stale_session(self, mock_ftp):
+        """Test an idle session that no longer responds is replaced with a
+        new connection
+        """
+        stale_ftp = Mock()
+        stale_ftp.voidcmd.side_effect = EOFError()
+        new_ftp = Mock()
+        mock_ftp.side_effect = [stale_ftp, new_ftp]
+        pool = FTPSessionPool()
+        pool.release(pool.acquire("ftp.ncbi.nlm.nih.gov"))
+        with self.subTest():
+            assert pool.acquire("ftp.ncbi.nlm.nih.gov") == new_ftp
+        with self.subTest():
+            stale_ftp.close.assert_called_once()
+
+    @patch("bin.utils.ftp_pool.FTP")
+    def test_acquire_missing_directory(self, mock_ftp):
+        """Test session is discarded and error raised when directory cannot
+        be found
+        """
+        mock_ftp.return_value.cwd.side_effect = error_perm("550")
+        pool = FTPSessionPool()
+        with self.subTest():
+            with self.assertRaises(error_perm):
+                pool.acquire("ftp.ncbi.nlm.nih.gov", "/missing/")
+        with self.subTest():
+            mock_ftp.return_value.close.assert_called_once()
+
+    @patch("bin.utils.ftp_pool.FTP")
+    def test_session_discards_on_error(self, mock_ftp):
+        """Test a session which errors during use is not returned to the
+        pool
+        """
+        pool = FTPSessionPool()
+        with self.assertRaises(error_temp):
+            with pool.session("ftp.ncbi.nlm.nih.gov") as ftp:
+                raise error_temp("421")
+        with self.subTest():
+            ftp.close.assert_called_once()
+        with self.subTest():
+            assert not pool._idle.get("ftp.ncbi.nlm.nih.gov")
+
+    @patch("bin.utils.ftp_pool.FTP")
+    def test_acquire_waits_for_free_session(self, mock_ftp):
+        """Test acquire blocks once the per host session cap is reached
+        and continues when a session is released
+        """
+        pool = FTPSessionPool(max_sessions_per_host=1)
+        ftp = pool.acquire("ftp.ncbi.nlm.nih.gov")
+        acquired = threading.Event()
+        waiting = threading.Thread(target=lambda: (
+            pool.acquire("ftp.ncbi.nlm.nih.gov"), acquired.set()
+        ))
+        waiting.start()
+        with self.subTest():
+            assert not acquired.wait(0.1)
+        pool.release(ftp)
+        waiting.join(1)
+        with self.subTest():
+            assert acquired.is_set()
+
+    @patch("bin.utils.ftp_pool.FTP")
+    def test_acquire_backs_off_when_throttled(self, mock_ftp):
+        """Test a connection refused with 421 backs off on the rate limiter
+        and is retried
+        """
+        throttled_ftp = Mock()
+        throttled_ftp.login.side_effect = error_temp("421 Too many users")
+        new_ftp = Mock()
+        mock_ftp.side_effect = [throttled_ftp, new_ftp]
+        limiter = Mock(**{"backoff.return_value": 1.0})
+        pool = FTPSessionPool(rate_limiter=limiter)
+        with self.subTest():
+            assert pool.acquire("ftp.ncbi.nlm.nih.gov") == new_ftp
+        with self.subTest():
+            assert limiter.acquire.call_count == 2
+        with self.subTest():
+            limiter.backoff.assert_called_once()
+        with self.subTest():
+            limiter.succeeded.assert_called_once()
+
+    @patch("bin.utils.rate_limiter.time.sleep")
+    @patch("bin.utils.rate_limiter.random.uniform", side_effect=max)
+    @patch("bin.utils.rate_limiter.time.monotonic")
+    @patch("bin.utils.ftp_pool.FTP")
+    def test_acquire_idle_session_waits_for_backoff(
+        self, mock_ftp, mock_time, mock_uniform, mock_sleep
+    ):
+        """Test an idle session is not reused until the backoff after a
+        throttled transfer has ended
+        """
+        clock = [100.0]
+        mock_time.side_effect = lambda: clock[0]
+        mock_sleep.side_effect = lambda seconds: clock.__setitem__(
+            0, clock[0] + seconds
+        )
+        pool = FTPSessionPool(rate_limiter=RateLimiter(base_backoff=4))
+        ftp = pool.acquire("ftp.ncbi.nlm.nih.gov")
+        pool.release(ftp)
+        pool.rate_limiter.backoff()
+        with self.subTest():
+            assert pool.acquire("ftp.ncbi.nlm.nih.gov") == ftp
+        with self.subTest():
+            mock_sleep.assert_called_once_with(4)
+        with self.subTest():
+            mock_ftp.assert_called_once()
+
+    @patch("bin.utils.ftp_pool.FTP")
+    def test_acquire_throttled_attempts_exhausted(self, mock_ftp):
+        """Test the throttle error is raised once every attempt to connect
+        has been throttled
+        """
+        mock_ftp.return_value.login.side_effect = error_temp("421 Busy")
+        limiter = Mock(**{"backoff.return_value": 1.0})
+        pool = FTPSessionPool(rate_limiter=limiter, max_connect_attempts=2)
+        with self.subTest():
+            with self.assertRaises(error_temp):
+                pool.acquire("ftp.ncbi.nlm.nih.gov")
+        with self.subTest():
+            assert mock_ftp.call_count == 2
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+from bin.utils.checkpoint import DownloadCheckpoint
+from bin.utils.hashing import MultiHash, hash_file, hash_files
+
+
+class TestHashing(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_file(self, name, contents) -> str:
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, "wb") as f:
+            f.write(contents)
+        return path
+
+    def test_multi_hash(self):
+        """Test every checksum is computed from the same updates
+        """
+        hash_obj = MultiHash()
+        hash_obj.update(b"block_1")
+        hash_obj.update(memoryview(b"block_2"))
+        with self.subTest():
+            assert hash_obj.name == "md5+sha256"
+        with self.subTest():
+            assert hash_obj.hexdigests() == {
+                "md5": hashlib.md5(b"block_1block_2").hexdigest(),
+                "sha256": hashlib.sha256(b"block_1block_2").hexdigest(),
+            }
+
+    def test_multi_hash_copy(self):
+        """Test a copy is not changed by updates to the original
+        """
+        hash_obj = MultiHash()
+        hash_obj.update(b"block_1")
+        copied = hash_obj.copy()
+        hash_obj.update(b"block_2")
+        assert copied.hexdigests()["md5"] == hashlib.md5(
+            b"block_1"
+        ).hexdigest()
+
+    def test_multi_hash_checkpoint_resume(self):
+        """Test a partial download hashed with every algorithm can be
+        resumed from its checkpoint
+        """
+        path = self.write_file("file.vcf.gz", b"block_1partial")
+        checkpoint = DownloadCheckpoint(path)
+        saved = MultiHash()
+        saved.update(b"block_1")
+        checkpoint.save("link", 7, saved)
+        hash_obj = MultiHash()
+        with open(path, "a+b") as localfile:
+            offset = checkpoint.resume(localfile, "link", hash_obj)
+        with self.subTest():
+            assert offset == 7
+        with self.subTest():
+            assert hash_obj.hexdigest() == saved.hexdigest()
+
+    def test_hash_file(self):
+        """Test file is hashed across several buffer reads
+        """
+        contents = os.urandom(10_000)
+        path = self.write_file("file.vcf.gz", contents)
+        assert hash_file(path, buffer_size=4096) == {
+            "md5": hashlib.md5(contents).hexdigest(),
+            "sha256": hashlib.sha256(contents).hexdigest(),
+        }
+
+    def test_hash_file_empty(self):
+        """Test an empty file has the checksums of no data
+        """
+        path = self.write_file("empty.txt", b"")
+        assert hash_file(path, ("md5",)) == {
+            "md5": hashlib.md5().hexdigest()
+        }
+
+    def test_hash_files(self):
+        """Test several files are hashed in parallel and keyed by path
+        """
+        paths = [
+            self.write_file(f"file_{number}.txt", bytes([number]) * 5000)
+            for number in range(5)
+        ]
+        checksums = hash_files(paths, workers=3)
+        with self.subTest():
+            assert list(checksums) == paths
+        with self.subTest():
+            assert all(
+                checksums[path]["sha256"] == hashlib.sha256(
+                    bytes([number]) * 5000
+                ).hexdigest()
+                for number, path in enumerate(paths)
+            )
+
+    def test_hash_files_none(self):
+        """Test no files gives no checksums
+        """
+        assert hash_files([]) == {}
+
+
+if __name__ == "__main__":
+    unittest.main()
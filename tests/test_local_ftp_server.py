@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+from hashlib import md5
+
+from benchmarks.local_ftp_server import LocalFTPServer
+from bin.utils.ftp_pool import FTPSessionPool
+from bin.utils.util import download_ftp_file
+from unittest.mock import patch
+
+
+class TestLocalFTPDownload(unittest.TestCase):
+    def setUp(self):
+        self.served_dir = tempfile.TemporaryDirectory()
+        self.download_dir = tempfile.TemporaryDirectory()
+        self.contents = os.urandom(3 * 1024 * 1024 + 17)
+        file_dir = os.path.join(self.served_dir.name, "pub", "clinvar")
+        os.makedirs(file_dir)
+        with open(os.path.join(file_dir, "clinvar.vcf.gz"), "wb") as file:
+            file.write(self.contents)
+        self.server = LocalFTPServer(self.served_dir.name).start()
+        self.link = (
+            f"ftp://127.0.0.1:{self.server.server_address[1]}"
+            + "/pub/clinvar/clinvar.vcf.gz"
+        )
+        self.pool = FTPSessionPool(timeout=10)
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.server.shutdown()
+        self.server.server_close()
+        self.served_dir.cleanup()
+        self.download_dir.cleanup()
+
+    def download(self, **kwargs):
+        md5_obj = md5()
+        with patch("bin.utils.util.FTP_POOL", self.pool):
+            file = download_ftp_file(
+                self.link,
+                os.path.join(self.download_dir.name, "clinvar.vcf.gz"),
+                md5_obj, **kwargs
+            )
+        with open(file, "rb") as downloaded_file:
+            return downloaded_file.read(), md5_obj.hexdigest()
+
+    def test_download_ftp_file(self):
+        """Test a file served by the local FTP server downloads intact
+        """
+        contents, file_md5 = self.download(block_size=64 * 1024)
+        with self.subTest():
+            assert contents == self.contents
+        with self.subTest():
+            assert file_md5 == md5(self.contents).hexdigest()
+
+    @patch("bin.utils.util.MIN_SEGMENT_SIZE", 1024 * 1024)
+    def test_download_ftp_file_segments(self):
+        """Test a file downloaded in segments over parallel connections to
+        the local FTP server is reassembled intact
+        """
+        contents, file_md5 = self.download(segments=3)
+        with self.subTest():
+            assert contents == self.contents
+        with self.subTest():
+            assert file_md5 == md5(self.contents).hexdigest()
@@ -0,0 +1,168 @@
+import gzip
+import io
+import os
+import tempfile
+import unittest
+
+from bin.utils.lookup_index import (
+    ClinVarLookupIndex, build_lookup_index, build_lookup_index_DNAnexus
+)
+from unittest.mock import patch
+
+VCF_HEADER = "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+
+def make_vcf(records) -> io.BytesIO:
+    """Compress VCF records of (chrom, pos, id, ref, alt, clnsig)"""
+    lines = "".join(
+        f"{chrom}\t{pos}\t{variant_id}\t{ref}\t{alt}\t.\t.\tALLELEID=1"
+        + (f";CLNREVSTAT=single;CLNSIG={clnsig}" if clnsig else "") + "\n"
+        for chrom, pos, variant_id, ref, alt, clnsig in records
+    )
+    return io.BytesIO(gzip.compress((VCF_HEADER + lines).encode()))
+
+
+class TestLookupIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.index_path = os.path.join(self.tmp_dir.name, "lookup.idx")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_lookup(self):
+        """Test records are found by position and alleles, with chr
+        prefixed chromosomes and unsorted records handled
+        """
+        records = build_lookup_index(make_vcf([
+            ("1", 200, "3", "C", "T", "Benign"),
+            ("1", 100, "1", "A", "G", "Pathogenic"),
+            ("1", 100, "2", "A", "C", "Uncertain_significance"),
+            ("X", 50, "4", "G", "A", None),
+            ("MT", 7, "5", "T", "C", "Benign"),
+            ("2", 100, "6", "A", "G", "Benign"),
+        ]), self.index_path)
+        with ClinVarLookupIndex(self.index_path) as lookup_index:
+            with self.subTest():
+                assert records == len(lookup_index) == 6
+            with self.subTest():
+                assert list(lookup_index.chromosomes) == ["1", "2", "X", "MT"]
+            with self.subTest("position"):
+                assert [
+                    record.variant_id
+                    for record in lookup_index.lookup("1", 100)
+                ] == ["1", "2"]
+            with self.subTest("alleles"):
+                record, = lookup_index.lookup("chr1", 100, "A", "C")
+                assert (record.clnsig, record.review_status) == (
+                    "Uncertain_significance", "single"
+                )
+            with self.subTest("missing values"):
+                record, = lookup_index.lookup("X", 50)
+                assert record.clnsig is None
+            with self.subTest("mitochondria"):
+                assert lookup_index.lookup("chrM", 7)[0].variant_id == "5"
+            with self.subTest("not found"):
+                assert lookup_index.lookup_many([
+                    ("1", 150), ("3", 100), ("1", 100, "A", "T")
+                ]) == [[], [], []]
+
+    @patch("bin.utils.lookup_index.COPY_CHUNK_SIZE", 4)
+    def test_lookup_sorted(self):
+        """Test strings of sorted chromosomes are copied in chunks, and
+        records of a chromosome split across the VCF are all indexed
+        """
+        records = build_lookup_index(make_vcf([
+            ("1", 100, "1", "A", "G", "Pathogenic"),
+            ("1", 200, "2", "C", "T", "Benign"),
+            ("2", 100, "3", "A", "G", "Benign"),
+            ("1", 300, "4", "G", "A", "Likely_benign"),
+            ("2", 200, "5", "T", "C", None),
+        ]), self.index_path)
+        with ClinVarLookupIndex(self.index_path) as lookup_index:
+            with self.subTest():
+                assert records == 5
+            with self.subTest():
+                assert lookup_index.chromosomes == {"1": (0, 3), "2": (3, 5)}
+            for chrom, pos, variant_id, clnsig in (
+                ("1", 100, "1", "Pathogenic"), ("1", 200, "2", "Benign"),
+                ("1", 300, "4", "Likely_benign"), ("2", 100, "3", "Benign"),
+                ("2", 200, "5", None),
+            ):
+                with self.subTest(chrom=chrom, pos=pos):
+                    record, = lookup_index.lookup(chrom, pos)
+                    assert (record.variant_id, record.clnsig) == (
+                        variant_id, clnsig
+                    )
+
+    def test_not_lookup_index(self):
+        """Test error is raised for files that are not lookup indexes
+        """
+        with open(self.index_path, "wb") as index_file:
+            index_file.write(b"not an index")
+        with self.assertRaisesRegex(RuntimeError, "is not a ClinVar lookup"):
+            ClinVarLookupIndex(self.index_path)
+
+    @patch("bin.utils.lookup_index.upload_file_DNAnexus")
+    @patch("bin.utils.lookup_index.dxpy.open_dxfile")
+    def test_build_lookup_index_DNAnexus(self, mock_open_dxfile, mock_upload):
+        """Test index is built from the VCF streamed from DNAnexus and
+        uploaded to the update folder
+        """
+        mock_open_dxfile.return_value = make_vcf([
+            ("1", 100, "1", "A", "G", "Benign")
+        ])
+        mock_upload.return_value = "file-index"
+        previous_dir = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+        try:
+            file_id = build_lookup_index_DNAnexus(
+                "file-xxxx", "project-xxxx", "/update",
+                "clinvar_20240107_GRCh38"
+            )
+        finally:
+            os.chdir(previous_dir)
+        with self.subTest():
+            assert file_id == "file-index"
+        with self.subTest():
+            assert mock_upload.call_args.args[:3] == (
+                "clinvar_20240107_GRCh38_lookup.idx", "project-xxxx",
+                "/update"
+            )
+
+
+    @patch("bin.utils.lookup_index.upload_file_DNAnexus")
+    @patch("bin.utils.lookup_index.dxpy.open_dxfile")
+    def test_build_lookup_index_DNAnexus_local(
+        self, mock_open_dxfile, mock_upload
+    ):
+        """Test index is built from the local copy of the VCF when it was
+        downloaded, without streaming it from DNAnexus
+        """
+        vcf_path = os.path.join(self.tmp_dir.name, "clinvar.vcf.gz")
+        with open(vcf_path, "wb") as vcf_file:
+            vcf_file.write(make_vcf([
+                ("1", 100, "1", "A", "G", "Benign")
+            ]).getvalue())
+        previous_dir = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+        try:
+            build_lookup_index_DNAnexus(
+                "file-xxxx", "project-xxxx", "/update",
+                "clinvar_20240107_GRCh38", vcf_path
+            )
+            with ClinVarLookupIndex(
+                "clinvar_20240107_GRCh38_lookup.idx"
+            ) as lookup_index:
+                with self.subTest():
+                    assert len(lookup_index) == 1
+        finally:
+            os.chdir(previous_dir)
+        with self.subTest():
+            mock_open_dxfile.assert_not_called()
+        with self.subTest():
+            mock_upload.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+from benchmarks.local_ftp_server import LocalFTPServer
+from bin.utils.ftp_pool import FTPSessionPool
+from bin.utils.mirrors import MirrorSet, measure_read_throughput
+from unittest.mock import patch
+
+
+class TestMirrorSet(unittest.TestCase):
+    def test_alternatives(self):
+        """Test a directory on one mirror is mapped to the same directory
+        on every other mirror, fastest first
+        """
+        mirrors = MirrorSet()
+        mirrors.set_mirrors([
+            "https://mirror.example.org",
+            "https://ftp.ncbi.nlm.nih.gov/",
+            "https://127.0.0.1:2121",
+        ])
+        with self.subTest():
+            assert mirrors.alternatives(
+                "ftp.ncbi.nlm.nih.gov", "/pub/clinvar/"
+            ) == [
+                ("mirror.example.org", "/pub/clinvar/"),
+                ("127.0.0.1:2121", "/pub/clinvar/"),
+            ]
+        with self.subTest("unknown host"):
+            assert mirrors.alternatives(
+                "ftp.ncbi.nlm.nih.gov.example.org", "/pub/clinvar/"
+            ) == []
+
+
+class TestMeasureReadThroughput(unittest.TestCase):
+    def test_measure_read_throughput(self):
+        """Test only the start of the file is read and the session used is
+        not reused
+        """
+        with tempfile.TemporaryDirectory() as served_dir:
+            with open(os.path.join(served_dir, "file.vcf.gz"), "wb") as f:
+                f.write(os.urandom(1024 * 1024))
+            server = LocalFTPServer(served_dir).start()
+            pool = FTPSessionPool(timeout=10)
+            try:
+                with patch("bin.utils.mirrors.FTP_POOL", pool):
+                    throughput = measure_read_throughput(
+                        f"127.0.0.1:{server.server_address[1]}", "/",
+                        "file.vcf.gz", probe_bytes=64 * 1024
+                    )
+            finally:
+                pool.close_all()
+                server.shutdown()
+                server.server_close()
+        with self.subTest():
+            assert throughput > 0
+        with self.subTest():
+            assert not any(pool._idle.values())
+
+
+if __name__ == "__main__":
+    unittest.main()
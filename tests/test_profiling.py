@@ -0,0 +1,107 @@
+import os
+import pstats
+import tempfile
+import threading
+import unittest
+
+from bin.utils.profiling import StageProfiler
+from bin.utils.telemetry import RunMetrics
+from unittest.mock import patch
+
+
+class TestStageProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.metrics = RunMetrics()
+        self.profiler = StageProfiler(self.tmp_dir.name)
+        self.metrics.profiler = self.profiler
+        self.profiler.start()
+
+    def tearDown(self):
+        self.profiler.stop()
+        self.tmp_dir.cleanup()
+
+    def test_profile_outermost_stage(self):
+        """Test reports are written for the outermost stage only, with the
+        stage's allocations recorded in its metrics
+        """
+        with self.metrics.stage("download", file="clinvar.vcf.gz"):
+            with self.metrics.stage("hash"):
+                kept = [bytes(1024) for _ in range(1000)]
+        names = [os.path.basename(report) for report in self.profiler.reports]
+        with self.subTest():
+            assert names == [
+                "001_download_clinvar.vcf.gz.pstats",
+                "001_download_clinvar.vcf.gz_cpu.txt",
+                "001_download_clinvar.vcf.gz_memory.txt",
+            ]
+        with self.subTest():
+            stats = pstats.Stats(self.profiler.reports[0])
+            assert stats.total_calls > 0
+        with self.subTest():
+            download = self.metrics.records[-1]
+            assert download["allocated_bytes"] >= len(kept) * 1024
+        with self.subTest():
+            assert "allocated_bytes" not in self.metrics.records[0]
+
+    def test_profile_threads(self):
+        """Test stages open at once on different threads each get reports,
+        with CPU reports for those not recorded as unprofiled, as only one
+        profiler can be active at once from Python 3.12
+        """
+        def run_stage(name):
+            with self.metrics.stage("download", file=name):
+                sum(range(10000))
+
+        threads = [
+            threading.Thread(target=run_stage, args=(name,))
+            for name in ("a.vcf.gz", "b.vcf.gz")
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report_files = sorted(
+            os.path.basename(report)[len("001_download_"):-len("_memory.txt")]
+            for report in self.profiler.reports
+            if report.endswith("_memory.txt")
+        )
+        profiled_files = sorted(
+            os.path.basename(report)[len("001_download_"):-len(".pstats")]
+            for report in self.profiler.reports if report.endswith(".pstats")
+        )
+        with self.subTest():
+            assert report_files == ["a.vcf.gz", "b.vcf.gz"]
+        with self.subTest():
+            assert profiled_files == sorted(
+                record["file"] for record in self.metrics.records
+                if record.get("cpu_profiled", True)
+            )
+            assert profiled_files
+
+    @patch("bin.utils.profiling.cProfile.Profile")
+    def test_profile_already_active(self, mock_profile):
+        """Test a stage still runs and gets an allocation report when
+        another profiler is already active, and is recorded as not CPU
+        profiled
+        """
+        mock_profile.return_value.enable.side_effect = ValueError(
+            "Another profiling tool is already active"
+        )
+        with self.metrics.stage("download", file="clinvar.vcf.gz"):
+            kept = [bytes(1024) for _ in range(1000)]
+        names = [os.path.basename(report) for report in self.profiler.reports]
+        with self.subTest():
+            assert names == ["001_download_clinvar.vcf.gz_memory.txt"]
+        with self.subTest():
+            assert self.metrics.records[-1]["cpu_profiled"] is False
+        with self.subTest():
+            assert self.metrics.records[-1]["allocated_bytes"] >= (
+                len(kept) * 1024
+            )
+        with self.subTest():
+            mock_profile.return_value.disable.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
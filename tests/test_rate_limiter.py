@@ -0,0 +1,108 @@
+import unittest
+
+from bin.utils.rate_limiter import RateLimiter, is_throttle_error
+from unittest.mock import patch
+from ftplib import error_perm, error_temp
+
+
+class TestRateLimiter(unittest.TestCase):
+    @patch("bin.utils.rate_limiter.time.sleep")
+    @patch("bin.utils.rate_limiter.time.monotonic", return_value=100.0)
+    def test_acquire_burst(self, mock_time, mock_sleep):
+        """Test connections within the burst do not wait
+        """
+        limiter = RateLimiter(rate=1, burst=3)
+        for _ in range(3):
+            limiter.acquire()
+        mock_sleep.assert_not_called()
+
+    @patch("bin.utils.rate_limiter.time.sleep")
+    @patch("bin.utils.rate_limiter.time.monotonic")
+    def test_acquire_waits_for_refill(self, mock_time, mock_sleep):
+        """Test a connection beyond the burst waits for a token to refill
+        """
+        clock = [100.0]
+        mock_time.side_effect = lambda: clock[0]
+        mock_sleep.side_effect = lambda seconds: clock.__setitem__(
+            0, clock[0] + seconds
+        )
+        limiter = RateLimiter(rate=2, burst=1)
+        limiter.acquire()
+        limiter.acquire()
+        mock_sleep.assert_called_once_with(0.5)
+
+    @patch("bin.utils.rate_limiter.random.uniform", side_effect=max)
+    @patch("bin.utils.rate_limiter.time.monotonic", return_value=100.0)
+    def test_backoff(self, mock_time, mock_uniform):
+        """Test backoff doubles with each throttle up to the maximum, and
+        resets after a successful connection
+        """
+        limiter = RateLimiter(base_backoff=1, max_backoff=5)
+        delays = [limiter.backoff() for _ in range(4)]
+        limiter.succeeded()
+        with self.subTest():
+            assert delays == [1, 2, 4, 5]
+        with self.subTest():
+            assert limiter.backoff() == 1
+
+    @patch("bin.utils.rate_limiter.time.sleep")
+    @patch("bin.utils.rate_limiter.random.uniform", side_effect=max)
+    @patch("bin.utils.rate_limiter.time.monotonic")
+    def test_acquire_waits_for_backoff(
+        self, mock_time, mock_uniform, mock_sleep
+    ):
+        """Test connections wait out the backoff even with tokens available
+        """
+        clock = [100.0]
+        mock_time.side_effect = lambda: clock[0]
+        mock_sleep.side_effect = lambda seconds: clock.__setitem__(
+            0, clock[0] + seconds
+        )
+        limiter = RateLimiter(burst=4, base_backoff=2)
+        limiter.backoff()
+        limiter.acquire()
+        mock_sleep.assert_called_once_with(2)
+
+    @patch("bin.utils.rate_limiter.time.sleep")
+    @patch("bin.utils.rate_limiter.random.uniform", side_effect=max)
+    @patch("bin.utils.rate_limiter.time.monotonic")
+    def test_wait_for_backoff(self, mock_time, mock_uniform, mock_sleep):
+        """Test waiting for the backoff sleeps until it ends without using
+        a token
+        """
+        clock = [100.0]
+        mock_time.side_effect = lambda: clock[0]
+        mock_sleep.side_effect = lambda seconds: clock.__setitem__(
+            0, clock[0] + seconds
+        )
+        limiter = RateLimiter(burst=1, base_backoff=2)
+        limiter.wait_for_backoff()
+        limiter.backoff()
+        limiter.wait_for_backoff()
+        with self.subTest():
+            mock_sleep.assert_called_once_with(2)
+        with self.subTest():
+            assert limiter.backoff_remaining() == 0
+        with self.subTest():
+            # the token was not used, so a connection can open at once
+            limiter.acquire()
+            mock_sleep.assert_called_once()
+
+    def test_is_throttle_error(self):
+        """Test too many connections, login refusal and connection resets
+        are treated as throttling, and other errors are not
+        """
+        with self.subTest():
+            assert is_throttle_error(error_temp("421 Too many connections"))
+        with self.subTest():
+            assert is_throttle_error(error_perm("530 Login incorrect"))
+        with self.subTest():
+            assert is_throttle_error(ConnectionResetError())
+        with self.subTest():
+            assert not is_throttle_error(error_perm("550 No such file"))
+        with self.subTest():
+            assert not is_throttle_error(EOFError())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import os
+import tempfile
+import unittest
+
+from bin.utils.release_catalogue import ReleaseCatalogue
+from unittest.mock import Mock
+from ftplib import error_perm
+
+
+def mock_release_ftp(names, modify="20240108120000", size=1000):
+    """Mock FTP session in a ClinVar release directory
+    """
+    ftp = Mock()
+    ftp.mlsd.return_value = [
+        (name, {"type": "file", "size": "10", "modify": "20240101000000"})
+        for name in names
+    ]
+    ftp.sendcmd.return_value = f"213 {modify}"
+    ftp.size.return_value = size
+    return ftp
+
+
+class TestReleaseCatalogue(unittest.TestCase):
+    def test_refresh_newest_complete(self):
+        """Test newest release with vcf, index and checksum is found and
+        incomplete newer releases are skipped
+        """
+        ftp = mock_release_ftp([
+            "clinvar.vcf.gz",
+            "clinvar_20240101.vcf.gz", "clinvar_20240101.vcf.gz.tbi",
+            "clinvar_20240101.vcf.gz.md5",
+            "clinvar_20240107.vcf.gz", "clinvar_20240107.vcf.gz.md5",
+        ])
+        catalogue = ReleaseCatalogue()
+        with self.subTest():
+            assert catalogue.refresh(ftp)
+        release = catalogue.newest_complete_release()
+        with self.subTest():
+            assert release["version"] == "20240101"
+        with self.subTest():
+            assert release["tbi"]["name"] == "clinvar_20240101.vcf.gz.tbi"
+        with self.subTest():
+            assert release["vcf"]["size"] == 10
+
+    def test_complete_releases(self):
+        """Test complete releases in a date window are returned oldest
+        first
+        """
+        ftp = mock_release_ftp([
+            f"clinvar_{version}.vcf.gz{extension}"
+            for version in ("20231224", "20231231", "20240107")
+            for extension in ("", ".tbi", ".md5")
+        ] + ["clinvar_20240114.vcf.gz"])
+        catalogue = ReleaseCatalogue()
+        catalogue.refresh(ftp)
+        with self.subTest():
+            assert [
+                release["version"]
+                for release in catalogue.complete_releases("20231231")
+            ] == ["20231231", "20240107"]
+        with self.subTest():
+            assert [
+                release["version"]
+                for release in catalogue.complete_releases(end="20231231")
+            ] == ["20231224", "20231231"]
+
+    def test_refresh_unchanged(self):
+        """Test directory is not listed again when latest release alias is
+        unchanged
+        """
+        ftp = mock_release_ftp([
+            "clinvar_20240101.vcf.gz", "clinvar_20240101.vcf.gz.tbi",
+            "clinvar_20240101.vcf.gz.md5",
+        ])
+        catalogue = ReleaseCatalogue()
+        catalogue.refresh(ftp)
+        ftp.mlsd.reset_mock()
+        with self.subTest():
+            assert not catalogue.refresh(ftp)
+        with self.subTest():
+            ftp.mlsd.assert_not_called()
+        with self.subTest():
+            ftp.sendcmd.return_value = "213 20240115120000"
+            assert catalogue.refresh(ftp)
+
+    def test_refresh_list_fallback(self):
+        """Test LIST is parsed when the server does not support MLSD or
+        MDTM
+        """
+        ftp = Mock()
+        ftp.mlsd.side_effect = error_perm("500 MLSD not understood")
+        ftp.sendcmd.side_effect = error_perm("500 MDTM not understood")
+        listing = [
+            "-r--r--r--   1 ftp  anonymous  10 Jan 01 2024 "
+            + name for name in [
+                "clinvar_20240101.vcf.gz", "clinvar_20240101.vcf.gz.tbi",
+                "clinvar_20240101.vcf.gz.md5",
+            ]
+        ]
+        ftp.retrlines.side_effect = lambda cmd, callback: [
+            callback(line) for line in listing
+        ]
+        catalogue = ReleaseCatalogue()
+        catalogue.refresh(ftp)
+        with self.subTest():
+            assert catalogue.newest_complete == "20240101"
+        with self.subTest():
+            assert catalogue.latest_alias is None
+
+    def test_save_load(self):
+        """Test catalogue is persisted and reloaded
+        """
+        catalogue = ReleaseCatalogue()
+        catalogue.refresh(mock_release_ftp([
+            "clinvar_20240101.vcf.gz", "clinvar_20240101.vcf.gz.tbi",
+            "clinvar_20240101.vcf.gz.md5",
+        ]))
+        catalogue.last_processed = "20240101"
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            catalogue.path = os.path.join(tmp_dir, "catalogue.json")
+            catalogue.save()
+            loaded = ReleaseCatalogue.load(catalogue.path)
+        with self.subTest():
+            assert loaded.releases == catalogue.releases
+        with self.subTest():
+            assert loaded.latest_alias == catalogue.latest_alias
+        with self.subTest():
+            assert loaded.last_processed == "20240101"
+
+    def test_load_missing(self):
+        """Test an empty catalogue is returned when no file exists yet
+        """
+        catalogue = ReleaseCatalogue.load("/does/not/exist.json")
+        assert catalogue.newest_complete_release() is None
+
+
+if __name__ == "__main__":
+    unittest.main()
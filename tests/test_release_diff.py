@@ -0,0 +1,162 @@
+import gzip
+import io
+import os
+import tempfile
+import unittest
+
+from bin.utils.release_diff import diff_releases, diff_releases_DNAnexus
+from unittest.mock import patch
+
+VCF_HEADER = "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+
+def make_vcf(records) -> io.BytesIO:
+    """Compress VCF records of (chrom, pos, id, clnsig, review status)"""
+    lines = "".join(
+        f"{chrom}\t{pos}\t{variant_id}\tA\tG\t.\t.\tALLELEID=1;"
+        + f"CLNREVSTAT={review_status};CLNSIG={clnsig}\n"
+        for chrom, pos, variant_id, clnsig, review_status in records
+    )
+    return io.BytesIO(gzip.compress((VCF_HEADER + lines).encode()))
+
+
+class TestReleaseDiff(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.diff_path = os.path.join(self.tmp_dir.name, "diff.tsv")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_diff(self):
+        with open(self.diff_path, encoding="utf8") as diff_file:
+            return [line.rstrip("\n").split("\t") for line in diff_file]
+
+    def test_diff_releases(self):
+        """Test added, removed and reclassified variants are reported,
+        including records sharing a position and chromosomes ordered
+        numerically
+        """
+        previous = make_vcf([
+            ("1", 100, "1", "Benign", "single"),
+            ("1", 200, "2", "Pathogenic", "single"),
+            ("1", 200, "3", "Benign", "single"),
+            ("2", 50, "4", "Benign", "single"),
+            ("10", 10, "5", "Benign", "single"),
+        ])
+        new = make_vcf([
+            ("1", 100, "1", "Benign", "single"),
+            ("1", 200, "3", "Benign", "multiple"),
+            ("1", 200, "6", "Benign", "single"),
+            ("2", 50, "4", "Likely_benign", "single"),
+            ("10", 10, "5", "Benign", "single"),
+            ("X", 5, "7", "Pathogenic", "single"),
+        ])
+        summary = diff_releases(previous, new, self.diff_path)
+        with self.subTest():
+            assert summary == {
+                "previous_records": 5, "new_records": 6, "added": 2,
+                "removed": 1, "reclassified": 2, "clnsig_changed": 1,
+                "review_status_changed": 1, "unchanged": 2
+            }
+        with self.subTest():
+            assert [row[:4] for row in self.read_diff()[1:]] == [
+                ["reclassified", "1", "200", "3"],
+                ["added", "1", "200", "6"],
+                ["removed", "1", "200", "2"],
+                ["reclassified", "2", "50", "4"],
+                ["added", "X", "5", "7"],
+            ]
+        with self.subTest():
+            assert self.read_diff()[4][6:8] == ["Benign", "Likely_benign"]
+
+    def test_diff_releases_unsorted(self):
+        """Test error is raised if a release is not sorted by coordinate
+        """
+        previous = make_vcf([("1", 100, "1", "Benign", "single")])
+        new = make_vcf([
+            ("2", 100, "1", "Benign", "single"),
+            ("1", 100, "2", "Benign", "single"),
+        ])
+        with self.assertRaisesRegex(RuntimeError, "New ClinVar VCF is not"):
+            diff_releases(previous, new, self.diff_path)
+
+    @patch("bin.utils.release_diff.upload_file_DNAnexus")
+    @patch("bin.utils.release_diff.dxpy.open_dxfile")
+    def test_diff_releases_DNAnexus(self, mock_open_dxfile, mock_upload):
+        """Test releases are streamed from DNAnexus and the diff and summary
+        uploaded to the update folder
+        """
+        dx_files = [
+            make_vcf([("1", 100, "1", "Benign", "single")]),
+            make_vcf([("1", 100, "1", "Pathogenic", "single")]),
+        ]
+        mock_open_dxfile.side_effect = dx_files
+        previous_dir = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+        try:
+            summary = diff_releases_DNAnexus(
+                "project-yyyy:file-yyyy", "file-xxxx", "project-xxxx",
+                "/update", "clinvar_20240107_GRCh38"
+            )
+        finally:
+            os.chdir(previous_dir)
+        with self.subTest():
+            assert summary["reclassified"] == 1
+        with self.subTest():
+            assert all(dx_file.closed for dx_file in dx_files)
+        with self.subTest():
+            assert mock_open_dxfile.call_args_list[0].args == ("file-yyyy",)
+        with self.subTest():
+            assert mock_open_dxfile.call_args_list[0].kwargs["project"] == (
+                "project-yyyy"
+            )
+        with self.subTest():
+            assert [call.args[0] for call in mock_upload.call_args_list] == [
+                "clinvar_20240107_GRCh38_diff.tsv",
+                "clinvar_20240107_GRCh38_diff_summary.json",
+            ]
+        with self.subTest():
+            # checksums are recorded as properties of each uploaded file
+            assert all(
+                set(call.args[3]) == {"md5", "sha256"}
+                for call in mock_upload.call_args_list
+            )
+
+    @patch("bin.utils.release_diff.upload_file_DNAnexus")
+    @patch("bin.utils.release_diff.dxpy.open_dxfile")
+    def test_diff_releases_DNAnexus_local(
+        self, mock_open_dxfile, mock_upload
+    ):
+        """Test the new release is read from local disk when it was
+        downloaded there, and only the previous release is streamed
+        """
+        mock_open_dxfile.return_value = make_vcf(
+            [("1", 100, "1", "Benign", "single")]
+        )
+        previous_dir = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+        try:
+            with open("clinvar_20240107_GRCh38.vcf.gz", "wb") as vcf_file:
+                vcf_file.write(make_vcf(
+                    [("1", 100, "1", "Pathogenic", "single")]
+                ).getvalue())
+            summary = diff_releases_DNAnexus(
+                "project-yyyy:file-yyyy", "file-xxxx", "project-xxxx",
+                "/update", "clinvar_20240107_GRCh38",
+                "clinvar_20240107_GRCh38.vcf.gz"
+            )
+        finally:
+            os.chdir(previous_dir)
+        with self.subTest():
+            assert summary["reclassified"] == 1
+        with self.subTest():
+            mock_open_dxfile.assert_called_once()
+        with self.subTest():
+            assert mock_open_dxfile.call_args.args == ("file-yyyy",)
+        with self.subTest():
+            assert mock_open_dxfile.return_value.closed
+
+
+if __name__ == "__main__":
+    unittest.main()
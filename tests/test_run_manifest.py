@@ -0,0 +1,141 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+import dxpy
+
+from bin.utils.run_manifest import RunManifest
+
+
+class TestRunManifest(unittest.TestCase):
+    @patch("bin.utils.run_manifest.create_proj_folder_if_missing", Mock())
+    @patch("bin.utils.run_manifest.dxpy.new_dxrecord")
+    @patch("bin.utils.run_manifest.dxpy.find_one_data_object")
+    def test_load_new(self, mock_find, mock_new):
+        """Test an empty manifest is created in the update folder on the
+        first run for a version
+        """
+        mock_find.return_value = None
+        manifest = RunManifest.load("project-1234", "/update")
+        with self.subTest():
+            assert manifest.record == mock_new.return_value
+        with self.subTest():
+            assert manifest.details == {"files": {}}
+        with self.subTest():
+            assert mock_new.call_args.kwargs["folder"] == "/update"
+        with self.subTest():
+            # details can only be updated while the record is open
+            assert mock_new.call_args.kwargs["close"] is False
+
+    @patch("bin.utils.run_manifest.create_proj_folder_if_missing", Mock())
+    @patch("bin.utils.run_manifest.dxpy.DXRecord")
+    @patch("bin.utils.run_manifest.dxpy.find_one_data_object")
+    def test_load_existing(self, mock_find, mock_record):
+        """Test manifest saved by an earlier run is loaded
+        """
+        mock_find.return_value = {"id": "record-1234"}
+        mock_record.return_value.get_details.return_value = {
+            "files": {}, "completed": True
+        }
+        manifest = RunManifest.load("project-1234", "/update")
+        with self.subTest():
+            assert manifest.completed
+        with self.subTest():
+            mock_record.assert_called_once_with(
+                "record-1234", project="project-1234"
+            )
+
+    def test_update_file(self):
+        """Test every step recorded for a file is saved to the record
+        """
+        record = Mock()
+        manifest = RunManifest(record)
+        manifest.update_file(
+            "clinvar.vcf.gz", "downloaded", checksums={"md5": "abc"}
+        )
+        manifest.update_file("clinvar.vcf.gz", "uploaded", file_id="file-1")
+        with self.subTest():
+            assert manifest.get_file("clinvar.vcf.gz") == {
+                "state": "uploaded", "checksums": {"md5": "abc"},
+                "file_id": "file-1"
+            }
+        with self.subTest():
+            assert record.set_details.call_count == 2
+
+    @patch("bin.utils.run_manifest.dxpy.DXFile")
+    def test_uploaded_file_id(self, mock_file):
+        """Test a recorded upload is only reused while the file is still
+        closed in the project
+        """
+        manifest = RunManifest(Mock(), {"files": {
+            "clinvar.vcf.gz": {"state": "uploaded", "file_id": "file-1"}
+        }})
+        describe = mock_file.return_value.describe
+        with self.subTest("closed"):
+            describe.return_value = {"state": "closed"}
+            assert manifest.uploaded_file_id(
+                "clinvar.vcf.gz", "project-1234"
+            ) == "file-1"
+        with self.subTest("removed"):
+            describe.side_effect = dxpy.exceptions.DXError("removed")
+            assert manifest.uploaded_file_id(
+                "clinvar.vcf.gz", "project-1234"
+            ) is None
+        with self.subTest("not uploaded"):
+            assert manifest.uploaded_file_id(
+                "clinvar.vcf.gz.tbi", "project-1234"
+            ) is None
+
+    def test_local_checksums(self):
+        """Test a downloaded file is only reused if it is unchanged on disk
+        """
+        contents = b"downloaded"
+        checksums = {
+            "md5": hashlib.md5(contents).hexdigest(),
+            "sha256": hashlib.sha256(contents).hexdigest(),
+        }
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "clinvar.vcf.gz")
+            manifest = RunManifest(Mock(), {"files": {path: {
+                "state": "downloaded", "checksums": checksums,
+                "size": len(contents)
+            }}})
+            with self.subTest("missing"):
+                assert manifest.local_checksums(path) is None
+            with open(path, "wb") as f:
+                f.write(contents)
+            with self.subTest("unchanged"):
+                assert manifest.local_checksums(path) == checksums
+            with open(path, "wb") as f:
+                f.write(b"changed!!!")
+            with self.subTest("changed"):
+                assert manifest.local_checksums(path) is None
+
+    def test_local_path(self):
+        """Test a downloaded file's local path is only returned while it is
+        on disk at its recorded size
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "clinvar.vcf.gz")
+            manifest = RunManifest(Mock(), {"files": {path: {
+                "state": "verified", "size": len(b"downloaded")
+            }}})
+            with self.subTest("missing"):
+                assert manifest.local_path(path) is None
+            with open(path, "wb") as f:
+                f.write(b"downloaded")
+            with self.subTest("downloaded"):
+                assert manifest.local_path(path) == path
+            with open(path, "wb") as f:
+                f.write(b"partial")
+            with self.subTest("partial"):
+                assert manifest.local_path(path) is None
+            with self.subTest("not downloaded"):
+                assert manifest.local_path(
+                    os.path.join(tmp_dir, "other.vcf.gz")
+                ) is None
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import mmap
+import os
+import tempfile
+import unittest
+
+from bin.utils.bgzf import BGZFWriter, scan_bgzf_blocks
+from bin.utils.tabix import (
+    PSEUDO_BIN, build_tabix_index, check_tabix_index, iter_vcf_lines,
+    read_line_at, read_tabix_index, reg2bin
+)
+
+VCF_HEADER = "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+
+def write_vcf(path, records) -> None:
+    """Write BGZF VCF with a record for each (chrom, pos)"""
+    with BGZFWriter(path) as writer:
+        writer.write(VCF_HEADER.encode())
+        writer.write("".join(
+            f"{chrom}\t{pos}\t{pos}\tAC\tG\t.\t.\tALLELEID={pos};"
+            + "CLNSIG=Benign\n"
+            for chrom, pos in records
+        ).encode())
+
+
+class TestTabix(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.vcf = os.path.join(self.tmp_dir.name, "clinvar.vcf.gz")
+        self.index = f"{self.vcf}.tbi"
+        # enough records to span several BGZF blocks
+        self.records = [("1", pos) for pos in range(100, 2_000_000, 200)] + [
+            ("X", pos) for pos in range(50, 500_000, 100)
+        ]
+        write_vcf(self.vcf, self.records)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_build_tabix_index(self):
+        """Test a rebuilt index covers each contig and passes cross-check
+        """
+        build_tabix_index(self.vcf, self.index)
+        index = read_tabix_index(self.index)
+        with self.subTest():
+            assert index.names == ["1", "X"]
+        with self.subTest():
+            assert [bins[PSEUDO_BIN][1][0] for bins in index.bins] == [
+                10000, 5000
+            ]
+        with self.subTest():
+            assert check_tabix_index(self.index, self.vcf) == []
+
+    def test_check_tabix_index_stale(self):
+        """Test an index built for a different VCF fails cross-check
+        """
+        other_vcf = os.path.join(self.tmp_dir.name, "other.vcf.gz")
+        write_vcf(other_vcf, [("2", 10)] + self.records[:-1000])
+        build_tabix_index(other_vcf, self.index)
+        assert check_tabix_index(self.index, self.vcf)
+
+    def test_check_tabix_index_invalid(self):
+        """Test a file that is not a tabix index fails cross-check
+        """
+        with BGZFWriter(self.index) as writer:
+            writer.write(b"not an index")
+        assert "is not a valid tabix index" in check_tabix_index(
+            self.index, self.vcf
+        )[0]
+
+    def test_build_tabix_index_unsorted(self):
+        """Test error is raised when a contig's records are not contiguous
+        """
+        write_vcf(self.vcf, [("1", 10), ("2", 10), ("1", 20)])
+        with self.assertRaisesRegex(RuntimeError, "not sorted"):
+            build_tabix_index(self.vcf, self.index)
+
+    def test_iter_vcf_lines(self):
+        """Test virtual offsets of each line point at the line, including
+        lines split across blocks
+        """
+        lines = list(iter_vcf_lines(self.vcf))
+        with open(self.vcf, "rb") as vcf_file, mmap.mmap(
+            vcf_file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            blocks = dict(scan_bgzf_blocks(data, self.vcf))
+            for line, start, end in lines[::500] + lines[-3:]:
+                with self.subTest(start=start):
+                    assert read_line_at(data, start, blocks) == line
+        with self.subTest():
+            assert len(lines) == len(self.records) + 1
+
+    def test_reg2bin(self):
+        """Test bins from the SAM specification binning scheme
+        """
+        with self.subTest():
+            assert reg2bin(0, 1) == 4681
+        with self.subTest():
+            assert reg2bin(16383, 16385) == 585
+        with self.subTest():
+            assert reg2bin(0, 1 << 29) == 0
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import json
+import os
+import tempfile
+import unittest
+
+from bin.utils.telemetry import RunMetrics
+import dxpy
+import dxpy.api
+from unittest.mock import Mock, patch
+
+
+class TestRunMetrics(unittest.TestCase):
+    def test_stage_records_throughput(self):
+        """Test a stage records its duration, bytes and MB/s
+        """
+        metrics = RunMetrics()
+        with patch(
+            "bin.utils.telemetry.time.perf_counter", side_effect=[10, 12]
+        ):
+            with metrics.stage("download", file="clinvar.vcf.gz") as stage:
+                stage["bytes"] = 4 * 1024 * 1024
+        record = metrics.records[0]
+        with self.subTest():
+            assert record["file"] == "clinvar.vcf.gz"
+        with self.subTest():
+            assert record["seconds"] == 2
+        with self.subTest():
+            assert record["mb_per_s"] == 2
+
+    def test_stage_records_error(self):
+        """Test a stage that raises is recorded with the error type
+        """
+        metrics = RunMetrics()
+        with self.assertRaises(EOFError):
+            with metrics.stage("download"):
+                raise EOFError()
+        assert metrics.records[0]["error"] == "EOFError"
+
+    def test_counts_nested_stages(self):
+        """Test retries and API calls count against every open stage and
+        the run totals
+        """
+        metrics = RunMetrics()
+        with metrics.stage("transfer"):
+            with metrics.stage("download"):
+                metrics.count_retry()
+            metrics.count_dx_api_call()
+        download, transfer = metrics.records
+        with self.subTest():
+            assert (download["retries"], download["dx_api_calls"]) == (1, 0)
+        with self.subTest():
+            assert (transfer["retries"], transfer["dx_api_calls"]) == (1, 1)
+        with self.subTest():
+            assert (metrics.retries, metrics.dx_api_calls) == (1, 1)
+
+    def test_count_dx_api_calls(self):
+        """Test requests made through dxpy.api are counted while counting
+        is enabled, and dxpy's request functions restored afterwards
+        """
+        metrics = RunMetrics()
+        mock_request = Mock(return_value={})
+        mock_package_request = Mock()
+        with patch("bin.utils.telemetry.dxpy.api.DXHTTPRequest",
+                   mock_request), \
+                patch("bin.utils.telemetry.dxpy.DXHTTPRequest",
+                      mock_package_request):
+            with metrics.count_dx_api_calls(), \
+                    metrics.count_dx_api_calls():
+                with metrics.stage("upload"):
+                    dxpy.api.DXHTTPRequest("/file/new", {})
+            restored = (
+                dxpy.api.DXHTTPRequest is mock_request
+                and dxpy.DXHTTPRequest is mock_package_request
+            )
+            dxpy.api.DXHTTPRequest("/file/close", {})
+        with self.subTest():
+            assert mock_request.call_count == 2
+        with self.subTest():
+            assert restored
+        with self.subTest():
+            assert metrics.dx_api_calls == 1
+        with self.subTest():
+            assert metrics.records[0]["dx_api_calls"] == 1
+
+    def test_write(self):
+        """Test one JSON line is written per stage, followed by run totals
+        """
+        metrics = RunMetrics()
+        with metrics.stage("connect", build="GRCh38"):
+            pass
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = metrics.write(os.path.join(tmp_dir, "metrics.jsonl"))
+            with open(path, encoding="utf8") as metrics_file:
+                records = [json.loads(line) for line in metrics_file]
+        with self.subTest():
+            assert [record["stage"] for record in records] == [
+                "connect", "run"
+            ]
+        with self.subTest():
+            assert records[0]["build"] == "GRCh38"
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,11 +3,19 @@ import unittest
 from bin.utils.util import (
     is_date_within_n_weeks, compare_checksums_md5, get_file_md5,
     download_ftp_file, download_file_upload_DNAnexus,
-    upload_file_DNAnexus, check_proj_folder_exists, check_project_exists
+    upload_file_DNAnexus, check_proj_folder_exists,
+    stream_ftp_file_DNAnexus, find_file_by_md5, create_proj_folder_if_missing
 )
+from bin.utils.checkpoint import DownloadCheckpoint
+from concurrent.futures import Future
 from unittest.mock import Mock, patch, mock_open
+from ftplib import error_perm
 import dxpy
 import datetime
+import hashlib
+import io
+import os
+import tempfile
 
 
 class TestUtils(unittest.TestCase):
@@ -55,34 +63,40 @@ class TestUtils(unittest.TestCase):
         mock_md5.return_value = "1234567890123456789012345678fail"
         assert not compare_checksums_md5("", "")
 
-    @patch("bin.utils.util.md5")
-    def test_get_file_md5(self, mock_md5):
-        """Test md5 checksum can be obtained from file path
+    @patch("bin.utils.util.get_file_md5")
+    def test_compare_checksums_md5_precalculated(self, mock_md5):
+        """Test md5 checksum check uses md5 calculated during download
+        instead of re-reading the file
         """
         md5 = "12345678901234567890123456789012"
-        mock_md5.return_value.hexdigest.return_value = md5
         with patch("builtins.open", mock_open(read_data=md5)):
-            assert get_file_md5("") == md5
+            assert compare_checksums_md5("", "", md5)
+        mock_md5.assert_not_called()
+
+    @patch("bin.utils.util.hash_file")
+    def test_get_file_md5(self, mock_hash):
+        """Test md5 checksum can be obtained from file path
+        """
+        md5 = "12345678901234567890123456789012"
+        mock_hash.return_value = {"md5": md5}
+        with self.subTest():
+            assert get_file_md5("my_file.vcf.gz") == md5
+        with self.subTest():
+            mock_hash.assert_called_once_with(
+                "my_file.vcf.gz", ("md5",), 1024 * 1024
+            )
 
-    @patch("ftplib.FTP.retrbinary")
-    @patch("ftplib.FTP.cwd")
-    @patch("ftplib.FTP.login")
+    @patch("bin.utils.util.FTP_POOL")
     @patch("builtins.open", new_callable=mock_open)
-    def test_download_ftp_file(
-        self, mocked_open, mock_login, mock_cwd, mock_retr
-    ):
+    def test_download_ftp_file(self, mocked_open, mock_pool):
         """Test ftp file path can be obtained from downloaded file
         """
         download_link_file = "https://ftp.ncbi.nlm.nih.gov/pub/clinvar/vcf_GRCh38/weekly/file.vcf.gz"
         assert download_ftp_file(download_link_file) == "file.vcf.gz"
 
-    @patch("ftplib.FTP.retrbinary")
-    @patch("ftplib.FTP.cwd")
-    @patch("ftplib.FTP.login")
+    @patch("bin.utils.util.FTP_POOL")
     @patch("builtins.open", new_callable=mock_open)
-    def test_download_ftp_file_with_name(
-        self, mocked_open, mock_login, mock_cwd, mock_retr
-    ):
+    def test_download_ftp_file_with_name(self, mocked_open, mock_pool):
         """Test ftp file path can be obtained from downloaded file
         """
         download_link_file = "https://ftp.ncbi.nlm.nih.gov/pub/clinvar/vcf_GRCh38/weekly/file.vcf.gz"
@@ -90,6 +104,333 @@ class TestUtils(unittest.TestCase):
             download_link_file, "my_file.vcf.gz"
         ) == "my_file.vcf.gz"
 
+    @patch("bin.utils.util.FTP_POOL")
+    @patch("builtins.open", new_callable=mock_open)
+    def test_download_ftp_file_hash(self, mocked_open, mock_pool):
+        """Test hash object is updated with each block as it is downloaded
+        """
+        blocks = [b"block_1", b"block_2"]
+
+        def retrbinary(cmd, callback, blocksize, rest=None):
+            for block in blocks:
+                callback(block)
+        mock_ftp = mock_pool.session.return_value.__enter__.return_value
+        mock_ftp.retrbinary.side_effect = retrbinary
+        hash_obj = hashlib.md5()
+        download_link_file = "https://ftp.ncbi.nlm.nih.gov/pub/clinvar/vcf_GRCh38/weekly/file.vcf.gz"
+        download_ftp_file(download_link_file, hash_obj=hash_obj)
+        assert hash_obj.hexdigest() == hashlib.md5(b"".join(blocks)).hexdigest()
+
+    @patch("bin.utils.util.FTP_POOL")
+    def test_download_ftp_file_retry_resumes(self, mock_pool):
+        """Test an interrupted transfer is retried from the byte offset
+        already received rather than from the start of the file
+        """
+        rest_offsets = []
+
+        def retrbinary(cmd, callback, blocksize, rest=None):
+            rest_offsets.append(rest)
+            if rest is None:
+                callback(b"block_1")
+                raise EOFError()
+            callback(b"block_2")
+        mock_ftp = mock_pool.session.return_value.__enter__.return_value
+        mock_ftp.retrbinary.side_effect = retrbinary
+        hash_obj = hashlib.md5()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file = os.path.join(tmp_dir, "file.vcf.gz")
+            download_ftp_file(
+                "https://ftp.ncbi.nlm.nih.gov/weekly/file.vcf.gz", file,
+                hash_obj
+            )
+            with open(file, "rb") as f:
+                contents = f.read()
+        with self.subTest():
+            assert rest_offsets == [None, len(b"block_1")]
+        with self.subTest():
+            assert contents == b"block_1block_2"
+        with self.subTest():
+            assert hash_obj.hexdigest() == hashlib.md5(contents).hexdigest()
+
+    @patch("bin.utils.util.FTP_MIRRORS")
+    @patch("bin.utils.util.FTP_POOL")
+    def test_download_ftp_file_mirror_failover(self, mock_pool, mock_mirrors):
+        """Test a transfer that stalls fails over to the next mirror and
+        carries on from the byte offset already received
+        """
+        domains = []
+        rest_offsets = []
+
+        def session(domain, path):
+            domains.append(domain)
+            return mock_pool.session.return_value
+        mock_pool.session.side_effect = session
+
+        def retrbinary(cmd, callback, blocksize, rest=None):
+            rest_offsets.append(rest)
+            if rest is None:
+                callback(b"block_1")
+                raise TimeoutError("timed out")
+            callback(b"block_2")
+        mock_ftp = mock_pool.session.return_value.__enter__.return_value
+        mock_ftp.retrbinary.side_effect = retrbinary
+        mock_mirrors.alternatives.return_value = [
+            ("mirror.example.org", "/weekly/")
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file = os.path.join(tmp_dir, "file.vcf.gz")
+            download_ftp_file(
+                "https://ftp.ncbi.nlm.nih.gov/weekly/file.vcf.gz", file
+            )
+            with open(file, "rb") as f:
+                contents = f.read()
+        with self.subTest():
+            assert domains == ["ftp.ncbi.nlm.nih.gov", "mirror.example.org"]
+        with self.subTest():
+            assert rest_offsets == [None, len(b"block_1")]
+        with self.subTest():
+            assert contents == b"block_1block_2"
+
+    @patch("bin.utils.util.FTP_POOL")
+    def test_download_ftp_file_resume_checkpoint(self, mock_pool):
+        """Test a partial download left by an earlier run is resumed from
+        its checkpoint
+        """
+        link = "https://ftp.ncbi.nlm.nih.gov/weekly/file.vcf.gz"
+        rest_offsets = []
+
+        def retrbinary(cmd, callback, blocksize, rest=None):
+            rest_offsets.append(rest)
+            callback(b"block_2")
+        mock_ftp = mock_pool.session.return_value.__enter__.return_value
+        mock_ftp.retrbinary.side_effect = retrbinary
+        hash_obj = hashlib.md5()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file = os.path.join(tmp_dir, "file.vcf.gz")
+            # partial file has bytes written after the last checkpoint
+            with open(file, "wb") as f:
+                f.write(b"block_1partial")
+            DownloadCheckpoint(file).save(
+                link, len(b"block_1"), hashlib.md5(b"block_1")
+            )
+            download_ftp_file(link, file, hash_obj)
+            with open(file, "rb") as f:
+                contents = f.read()
+            checkpoint_removed = not os.path.exists(f"{file}.ckpt")
+        with self.subTest():
+            assert rest_offsets == [len(b"block_1")]
+        with self.subTest():
+            assert contents == b"block_1block_2"
+        with self.subTest():
+            assert hash_obj.hexdigest() == hashlib.md5(contents).hexdigest()
+        with self.subTest():
+            assert checkpoint_removed
+
+    @patch("bin.utils.util.MIN_SEGMENT_SIZE", 1)
+    @patch("bin.utils.util.FTP_POOL")
+    def test_download_ftp_file_segments(self, mock_pool):
+        """Test file downloaded over parallel ranged connections is written
+        and hashed in full
+        """
+        data = bytes(range(256)) * 40
+
+        def transfercmd(cmd, rest=None):
+            conn = io.BytesIO(data[rest:])
+            conn.recv = conn.read
+            return conn
+        mock_ftp = Mock()
+        mock_ftp.transfercmd.side_effect = transfercmd
+        mock_pool.acquire.return_value = mock_ftp
+        mock_session = mock_pool.session.return_value.__enter__.return_value
+        mock_session.size.return_value = len(data)
+        hash_obj = hashlib.md5()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file = os.path.join(tmp_dir, "file.vcf.gz")
+            download_ftp_file(
+                "https://ftp.ncbi.nlm.nih.gov/weekly/file.vcf.gz", file,
+                hash_obj, segments=3, block_size=100
+            )
+            with open(file, "rb") as f:
+                contents = f.read()
+        with self.subTest():
+            assert contents == data
+        with self.subTest():
+            assert hash_obj.hexdigest() == hashlib.md5(data).hexdigest()
+        with self.subTest():
+            assert mock_ftp.transfercmd.call_count == 3
+
+    @patch("bin.utils.util.MIN_SEGMENT_SIZE", 1)
+    @patch("bin.utils.util.FTP_POOL")
+    def test_download_ftp_file_segments_resume(self, mock_pool):
+        """Test each range of a partial segmented download left by an
+        earlier run resumes from its checkpointed offset
+        """
+        link = "https://ftp.ncbi.nlm.nih.gov/weekly/file.vcf.gz"
+        data = bytes(range(256)) * 40
+        rest_offsets = []
+
+        def transfercmd(cmd, rest=None):
+            rest_offsets.append(rest)
+            conn = io.BytesIO(data[rest:])
+            conn.recv = conn.read
+            return conn
+        mock_ftp = Mock()
+        mock_ftp.transfercmd.side_effect = transfercmd
+        mock_pool.acquire.return_value = mock_ftp
+        mock_session = mock_pool.session.return_value.__enter__.return_value
+        mock_session.size.return_value = len(data)
+        hash_obj = hashlib.md5()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file = os.path.join(tmp_dir, "file.vcf.gz")
+            with open(file, "wb") as f:
+                f.write(data[:3000] + bytes(2120) + data[5120:8000])
+                f.write(bytes(len(data) - 8000))
+            DownloadCheckpoint(file).save_ranges(
+                link, len(data), [[0, 5120, 3000], [5120, 10240, 8000]]
+            )
+            download_ftp_file(
+                link, file, hash_obj, segments=2, block_size=100
+            )
+            with open(file, "rb") as f:
+                contents = f.read()
+            checkpoint_removed = not os.path.exists(f"{file}.ckpt")
+        with self.subTest():
+            assert sorted(rest_offsets) == [3000, 8000]
+        with self.subTest():
+            assert contents == data
+        with self.subTest():
+            assert hash_obj.hexdigest() == hashlib.md5(data).hexdigest()
+        with self.subTest():
+            assert checkpoint_removed
+
+    @patch("bin.utils.util.MIN_SEGMENT_SIZE", 1)
+    @patch("bin.utils.util.FTP_POOL")
+    def test_download_ftp_file_segments_checkpoint(self, mock_pool):
+        """Test the offset reached in each range is checkpointed, so a
+        failed segmented download is left to resume
+        """
+        link = "https://ftp.ncbi.nlm.nih.gov/weekly/file.vcf.gz"
+        data = bytes(range(256)) * 40
+
+        def transfercmd(cmd, rest=None):
+            if rest >= 5120:
+                # second range fails part way through
+                conn = Mock()
+                conn.__enter__ = Mock(return_value=conn)
+                conn.__exit__ = Mock(return_value=False)
+                conn.recv.side_effect = [
+                    data[rest:rest + 100], data[rest + 100:rest + 200],
+                    error_perm("550 file unavailable")
+                ]
+                return conn
+            conn = io.BytesIO(data[rest:])
+            conn.recv = conn.read
+            return conn
+        mock_ftp = Mock()
+        mock_ftp.transfercmd.side_effect = transfercmd
+        mock_pool.acquire.return_value = mock_ftp
+        mock_session = mock_pool.session.return_value.__enter__.return_value
+        mock_session.size.return_value = len(data)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file = os.path.join(tmp_dir, "file.vcf.gz")
+            with self.assertRaises(error_perm):
+                download_ftp_file(
+                    link, file, segments=2, block_size=100,
+                    checkpoint_interval=100
+                )
+            ranges = DownloadCheckpoint(file).load_ranges(link, len(data))
+            with open(file, "rb") as f:
+                contents = f.read()
+        with self.subTest():
+            assert ranges == [[0, 5120, 5120], [5120, 10240, 5320]]
+        with self.subTest():
+            assert contents[:5320] == data[:5320]
+
+    @patch("bin.utils.util.FTP_POOL")
+    def test_download_ftp_file_segments_unsupported(self, mock_pool):
+        """Test download falls back to a single stream when the server
+        refuses SIZE
+        """
+        mock_ftp = mock_pool.session.return_value.__enter__.return_value
+        mock_ftp.size.side_effect = error_perm("500 SIZE not understood")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file = os.path.join(tmp_dir, "file.vcf.gz")
+            download_ftp_file(
+                "https://ftp.ncbi.nlm.nih.gov/weekly/file.vcf.gz", file,
+                segments=3
+            )
+        with self.subTest():
+            mock_ftp.retrbinary.assert_called_once()
+        with self.subTest():
+            mock_pool.acquire.assert_not_called()
+
+    @patch("bin.utils.util.create_proj_folder_if_missing")
+    @patch("bin.utils.util.dxpy.new_dxfile")
+    @patch("bin.utils.util.FTP_POOL")
+    def test_stream_ftp_file_DNAnexus(
+        self, mock_pool, mock_dxfile, mock_folder
+    ):
+        """Test downloaded blocks are written to DNAnexus file in order and
+        hashed without a local file
+        """
+        blocks = [b"block_1", b"block_2", b"block_3"]
+
+        def retrbinary(cmd, callback, blocksize, rest=None):
+            for block in blocks:
+                callback(block)
+        mock_ftp = mock_pool.session.return_value.__enter__.return_value
+        mock_ftp.retrbinary.side_effect = retrbinary
+        written = []
+        mock_dxfile.return_value.write.side_effect = written.append
+        mock_dxfile.return_value.get_id.return_value = "file-1234"
+        hash_obj = hashlib.md5()
+        with patch("builtins.open") as mocked_open:
+            file_id = stream_ftp_file_DNAnexus(
+                "https://ftp.ncbi.nlm.nih.gov/weekly/file.vcf.gz",
+                "project-1234", "/my_folder", "file.vcf.gz", hash_obj
+            )
+        with self.subTest():
+            assert file_id == "file-1234"
+        with self.subTest():
+            assert written == blocks
+        with self.subTest():
+            assert hash_obj.hexdigest() == hashlib.md5(
+                b"".join(blocks)
+            ).hexdigest()
+        with self.subTest():
+            mock_dxfile.return_value.close.assert_called_once()
+        with self.subTest():
+            mocked_open.assert_not_called()
+
+    @patch("bin.utils.util.create_proj_folder_if_missing")
+    @patch("bin.utils.util.dxpy.new_dxfile")
+    @patch("bin.utils.util.FTP_POOL")
+    def test_stream_ftp_file_DNAnexus_upload_fail(
+        self, mock_pool, mock_dxfile, mock_folder
+    ):
+        """Test partial DNAnexus file is removed when the upload fails
+        """
+        def retrbinary(cmd, callback, blocksize, rest=None):
+            for _ in range(100):
+                callback(b"block")
+        mock_ftp = mock_pool.session.return_value.__enter__.return_value
+        mock_ftp.retrbinary.side_effect = retrbinary
+        mock_dxfile.return_value.write.side_effect = dxpy.exceptions.DXError(
+            {"error": {"type": "test", "message": "test"}}, ""
+        )
+        expected_err = "Upload of file.vcf.gz to DNAnexus failed"
+        with self.subTest():
+            with self.assertRaisesRegex(RuntimeError, expected_err):
+                stream_ftp_file_DNAnexus(
+                    "https://ftp.ncbi.nlm.nih.gov/weekly/file.vcf.gz",
+                    "project-1234", "/my_folder", "file.vcf.gz",
+                    buffer_blocks=2
+                )
+        with self.subTest():
+            mock_dxfile.return_value.remove.assert_called_once()
+
+    @patch("bin.utils.util.find_file_by_md5", Mock(return_value=None))
+    @patch("bin.utils.util.read_md5_checksum", Mock())
     @patch("bin.utils.util.upload_file_DNAnexus")
     @patch("bin.utils.util.compare_checksums_md5")
     @patch("bin.utils.util.download_ftp_file")
@@ -107,6 +448,8 @@ class TestUtils(unittest.TestCase):
             "", "", "", "", ""
         ) == return_file
 
+    @patch("bin.utils.util.find_file_by_md5", Mock(return_value=None))
+    @patch("bin.utils.util.read_md5_checksum", Mock())
     @patch("bin.utils.util.upload_file_DNAnexus")
     @patch("bin.utils.util.compare_checksums_md5")
     @patch("bin.utils.util.download_ftp_file")
@@ -129,24 +472,266 @@ class TestUtils(unittest.TestCase):
                 "", "", "", "", ""
             )
 
+    @patch("bin.utils.util.os.path.getsize", Mock(return_value=1024))
+    @patch("bin.utils.util.find_file_by_md5", Mock(return_value=None))
+    @patch("bin.utils.util.read_md5_checksum", Mock())
+    @patch("bin.utils.util.check_bgzf_integrity")
+    @patch("bin.utils.util.upload_file_DNAnexus")
+    @patch("bin.utils.util.compare_checksums_md5", Mock(return_value=True))
+    @patch("bin.utils.util.download_ftp_file")
+    def test_download_file_upload_DNAnexus_invalid_bgzf(
+        self, mock_ftp, mock_upload, mock_bgzf
+    ):
+        """Test a file that is not valid BGZF is not uploaded
+        """
+        mock_ftp.return_value = "clinvar.vcf.gz"
+        mock_bgzf.side_effect = RuntimeError("missing the EOF marker")
+        with self.subTest():
+            with self.assertRaisesRegex(RuntimeError, "EOF marker"):
+                download_file_upload_DNAnexus(
+                    "", "", "", "", "", verify_bgzf=True
+                )
+        with self.subTest():
+            mock_bgzf.assert_called_once_with("clinvar.vcf.gz")
+        with self.subTest():
+            mock_upload.assert_not_called()
+
+    @patch("bin.utils.util.os.path.exists", Mock(return_value=True))
+    @patch("bin.utils.util.find_file_by_md5", Mock(return_value=None))
+    @patch("bin.utils.util.hash_file")
+    @patch("bin.utils.util.build_tabix_index")
+    @patch("bin.utils.util.check_tabix_index")
+    @patch("bin.utils.util.upload_file_DNAnexus")
+    @patch("bin.utils.util.download_ftp_file")
+    def test_download_file_upload_DNAnexus_stale_index(
+        self, mock_ftp, mock_upload, mock_check, mock_build, mock_hash
+    ):
+        """Test an index that does not match its VCF is rebuilt before it
+        is uploaded
+        """
+        mock_ftp.return_value = "clinvar.vcf.gz.tbi"
+        mock_check.return_value = ["1 has no bin index"]
+        mock_hash.return_value = {"md5": "rebuilt", "sha256": "rebuilt"}
+        mock_upload.return_value = "file-1234"
+        with self.subTest():
+            assert download_file_upload_DNAnexus(
+                "", "project-1234", "/my_folder", "clinvar.vcf.gz.tbi", None,
+                indexed_file="clinvar.vcf.gz"
+            ) == "file-1234"
+        with self.subTest():
+            mock_check.assert_called_once_with(
+                "clinvar.vcf.gz.tbi", "clinvar.vcf.gz"
+            )
+        with self.subTest():
+            mock_build.assert_called_once_with(
+                "clinvar.vcf.gz", "clinvar.vcf.gz.tbi"
+            )
+        with self.subTest():
+            # checksums of the rebuilt index are recorded, not the download
+            mock_upload.assert_called_once_with(
+                "clinvar.vcf.gz.tbi", "project-1234", "/my_folder",
+                {"md5": "rebuilt", "sha256": "rebuilt"}
+            )
+
+    @patch("bin.utils.util.check_tabix_index")
+    @patch("bin.utils.util.upload_file_DNAnexus")
+    @patch("bin.utils.util.download_ftp_file")
+    def test_download_file_upload_DNAnexus_indexed_file_failed(
+        self, mock_ftp, mock_upload, mock_check
+    ):
+        """Test an index is not checked or uploaded when the concurrent
+        transfer of its VCF fails
+        """
+        mock_ftp.return_value = "clinvar.vcf.gz.tbi"
+        vcf_downloaded = Future()
+        vcf_downloaded.cancel()
+        with self.subTest():
+            with self.assertRaisesRegex(RuntimeError, "could not be"):
+                download_file_upload_DNAnexus(
+                    "", "project-1234", "/my_folder", "clinvar.vcf.gz.tbi",
+                    None, indexed_file="clinvar.vcf.gz",
+                    indexed_file_ready=vcf_downloaded
+                )
+        with self.subTest():
+            mock_check.assert_not_called()
+        with self.subTest():
+            mock_upload.assert_not_called()
+
+    @patch("bin.utils.util.upload_file_DNAnexus")
+    @patch("bin.utils.util.download_ftp_file")
+    def test_download_file_upload_DNAnexus_manifest_uploaded(
+        self, mock_ftp, mock_upload
+    ):
+        """Test a file an earlier run uploaded is not transferred again
+        """
+        manifest = Mock()
+        manifest.uploaded_file_id.return_value = "file-earlier"
+        with self.subTest():
+            assert download_file_upload_DNAnexus(
+                "", "project-1234", "/my_folder", "clinvar.vcf.gz", "",
+                manifest=manifest
+            ) == "file-earlier"
+        with self.subTest():
+            mock_ftp.assert_not_called()
+        with self.subTest():
+            mock_upload.assert_not_called()
+
+    @patch("bin.utils.util.os.path.getsize", Mock(return_value=1024))
+    @patch("bin.utils.util.find_file_by_md5", Mock(return_value=None))
+    @patch("bin.utils.util.check_bgzf_integrity")
+    @patch("bin.utils.util.upload_file_DNAnexus")
+    @patch("bin.utils.util.download_ftp_file")
+    def test_download_file_upload_DNAnexus_manifest_resume(
+        self, mock_ftp, mock_upload, mock_bgzf
+    ):
+        """Test a verified file an earlier run left on local disk is
+        uploaded without downloading or verifying it again, and the upload
+        is recorded in the manifest
+        """
+        checksums = {"md5": "abc", "sha256": "def"}
+        manifest = Mock()
+        manifest.uploaded_file_id.return_value = None
+        manifest.local_checksums.return_value = checksums
+        manifest.get_file.return_value = {"state": "verified"}
+        mock_upload.return_value = "file-1234"
+        download_file_upload_DNAnexus(
+            "", "project-1234", "/my_folder", "clinvar.vcf.gz",
+            verify_bgzf=True, manifest=manifest
+        )
+        with self.subTest():
+            mock_ftp.assert_not_called()
+        with self.subTest():
+            mock_bgzf.assert_not_called()
+        with self.subTest():
+            mock_upload.assert_called_once_with(
+                "clinvar.vcf.gz", "project-1234", "/my_folder", checksums
+            )
+        with self.subTest():
+            manifest.update_file.assert_called_once_with(
+                "clinvar.vcf.gz", "uploaded", checksums=checksums,
+                file_id="file-1234"
+            )
+
+    @patch("bin.utils.util.find_file_by_md5")
+    @patch("bin.utils.util.read_md5_checksum")
+    @patch("bin.utils.util.upload_file_DNAnexus")
+    @patch("bin.utils.util.download_ftp_file")
+    def test_download_file_upload_DNAnexus_existing_checksum(
+        self, mock_ftp, mock_upload, mock_read_md5, mock_find
+    ):
+        """Test existing DNAnexus file ID is returned without downloading
+        the file when its published checksum is already in the project
+        """
+        md5 = "12345678901234567890123456789012"
+        mock_ftp.return_value = "my_file.vcf.gz.md5"
+        mock_read_md5.return_value = md5
+        mock_find.return_value = "file-existing"
+        with self.subTest():
+            assert download_file_upload_DNAnexus(
+                "https://ftp.ncbi.nlm.nih.gov/weekly/my_file.vcf.gz",
+                "project-1234", "/my_folder", "my_file.vcf.gz",
+                "https://ftp.ncbi.nlm.nih.gov/weekly/my_file.vcf.gz.md5"
+            ) == "file-existing"
+        with self.subTest():
+            # only the checksum file is downloaded, named after the file
+            mock_ftp.assert_called_once_with(
+                "https://ftp.ncbi.nlm.nih.gov/weekly/my_file.vcf.gz.md5",
+                "my_file.vcf.gz.md5"
+            )
+        with self.subTest():
+            mock_find.assert_called_once_with("project-1234", md5)
+        with self.subTest():
+            mock_upload.assert_not_called()
+
+    @patch("bin.utils.util.find_file_by_md5")
+    @patch("bin.utils.util.upload_file_DNAnexus")
+    @patch("bin.utils.util.download_ftp_file")
+    def test_download_file_upload_DNAnexus_prefetched_checksum(
+        self, mock_ftp, mock_upload, mock_find
+    ):
+        """Test a checksum already fetched is used without downloading it,
+        and saved under the name of the file rather than the shared
+        checksum name
+        """
+        md5 = "12345678901234567890123456789012"
+        mock_find.return_value = "file-existing"
+        previous_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            try:
+                file_id = download_file_upload_DNAnexus(
+                    "https://ftp.ncbi.nlm.nih.gov/weekly/my_file.vcf.gz",
+                    "project-1234", "/my_folder", "my_file_GRCh38.vcf.gz",
+                    "https://ftp.ncbi.nlm.nih.gov/weekly/my_file.vcf.gz.md5",
+                    checksum_contents=f"{md5}  my_file.vcf.gz\n".encode()
+                )
+                checksum_files = os.listdir(tmp_dir)
+            finally:
+                os.chdir(previous_dir)
+        with self.subTest():
+            assert file_id == "file-existing"
+        with self.subTest():
+            assert checksum_files == ["my_file_GRCh38.vcf.gz.md5"]
+        with self.subTest():
+            mock_ftp.assert_not_called()
+        with self.subTest():
+            mock_find.assert_called_once_with("project-1234", md5)
+
+    @patch("bin.utils.util.find_file_by_md5")
+    @patch("bin.utils.util.upload_file_DNAnexus")
+    @patch("bin.utils.util.download_ftp_file")
+    def test_download_file_upload_DNAnexus_existing_file(
+        self, mock_ftp, mock_upload, mock_find
+    ):
+        """Test downloaded file without a published checksum is not
+        uploaded when a file with the same md5 is already in the project
+        """
+        mock_ftp.return_value = "my_file.vcf.gz.tbi"
+        mock_find.return_value = "file-existing"
+        with self.subTest():
+            assert download_file_upload_DNAnexus(
+                "https://ftp.ncbi.nlm.nih.gov/weekly/my_file.vcf.gz.tbi",
+                "project-1234", "/my_folder", "my_file.vcf.gz.tbi"
+            ) == "file-existing"
+        with self.subTest():
+            mock_upload.assert_not_called()
+
+    @patch("bin.utils.util.dxpy.find_data_objects")
+    def test_find_file_by_md5(self, mock_find):
+        """Test project md5 index is fetched once and answers later lookups
+        """
+        mock_find.return_value = [
+            {"id": "file-1", "describe": {"properties": {"md5": "md5_1"}}},
+            {"id": "file-2", "describe": {"properties": {"md5": "md5_2"}}},
+        ]
+        with patch.dict("bin.utils.util.MD5_INDEX", clear=True):
+            with self.subTest():
+                assert find_file_by_md5("project-1234", "md5_2") == "file-2"
+            with self.subTest():
+                assert find_file_by_md5("project-1234", "md5_3") is None
+        with self.subTest():
+            mock_find.assert_called_once()
+
     @patch("bin.utils.util.dxpy.upload_local_file")
     @patch("bin.utils.util.DXProject.new_folder")
     @patch("bin.utils.util.DXProject")
-    @patch("bin.utils.util.check_proj_folder_exists")
+    @patch("bin.utils.util.get_project_folders")
+    @patch("bin.utils.util.os.path.getsize", Mock(return_value=1024))
     def test_upload_file_DNAnexus(
         self, mock_folder, mock_project, mock_new_folder, mock_upload
     ):
         """Test file ID can be obtained from file uploaded to DNAnexus
         """
         file_id = "file-1234"
-        mock_folder.return_value = True
+        mock_folder.return_value = {"/"}
         mock_upload.return_value.get_id.return_value = file_id
         assert upload_file_DNAnexus("", "") == file_id
 
     @patch("bin.utils.util.dxpy.upload_local_file")
     @patch("bin.utils.util.DXProject.new_folder")
     @patch("bin.utils.util.DXProject")
-    @patch("bin.utils.util.check_proj_folder_exists")
+    @patch("bin.utils.util.get_project_folders")
+    @patch("bin.utils.util.os.path.getsize", Mock(return_value=1024))
     def test_upload_file_DNAnexus_path_exists(
         self, mock_folder, mock_project, mock_new_folder, mock_upload
     ):
@@ -154,14 +739,18 @@ class TestUtils(unittest.TestCase):
         when DNAnexus project folder is provided and already exists
         """
         file_id = "file-1234"
-        mock_folder.return_value = True
+        mock_folder.return_value = {"/", "/my_path"}
         mock_upload.return_value.get_id.return_value = file_id
-        assert upload_file_DNAnexus("", "", "/my_path") == file_id
+        with self.subTest():
+            assert upload_file_DNAnexus("", "", "/my_path") == file_id
+        with self.subTest():
+            mock_project.return_value.new_folder.assert_not_called()
 
     @patch("bin.utils.util.dxpy.upload_local_file")
     @patch("bin.utils.util.DXProject.new_folder")
     @patch("bin.utils.util.DXProject")
-    @patch("bin.utils.util.check_proj_folder_exists")
+    @patch("bin.utils.util.get_project_folders")
+    @patch("bin.utils.util.os.path.getsize", Mock(return_value=1024))
     def test_upload_file_DNAnexus_path(
         self, mock_folder, mock_project, mock_new_folder, mock_upload
     ):
@@ -169,66 +758,70 @@ class TestUtils(unittest.TestCase):
         when DNAnexus project folder is provided and does not already exist
         """
         file_id = "file-1234"
-        mock_folder.return_value = False
+        mock_folder.return_value = {"/"}
         mock_project.return_value.new_folder.return_value = None
         mock_upload.return_value.get_id.return_value = file_id
-        assert upload_file_DNAnexus("", "", "/my_path") == file_id
-
-    @patch("bin.utils.util.DXProject")
-    def test_check_project_exists(self, mock_proj):
-        """Test check_project_exists passes for existing id
-        """
-        test_proj_id = "project-1234512345"
-        assert check_project_exists(test_proj_id)
-
-    @patch("bin.utils.util.DXProject")
-    def test_check_project_exists_invalid(self, mock_proj):
-        """Test check_project_exists fails for invalid id
-        """
-        mock_proj.side_effect = dxpy.exceptions.DXError(
-            {"error": {"type": "test", "message": "test"}}, ""
-        )
-        test_proj_id = "project-fail"
-        assert not check_project_exists(test_proj_id)
+        with self.subTest():
+            assert upload_file_DNAnexus("", "", "/my_path") == file_id
+        with self.subTest():
+            mock_project.return_value.new_folder.assert_called_once_with(
+                "/my_path", parents=True
+            )
 
-    @patch("bin.utils.util.check_project_exists")
-    @patch("bin.utils.util.dxpy.api.project_list_folder")
-    def test_check_proj_folder_exists(self, mock_folder, mock_project):
-        """Test check_proj_folder_exists passes for existing folder
+    @patch.dict("bin.utils.util.PROJECT_FOLDERS", clear=True)
+    @patch("bin.utils.util.dxpy.api.project_describe")
+    def test_check_proj_folder_exists(self, mock_describe):
+        """Test check_proj_folder_exists passes for existing folder, listing
+        the project's folders only once
         """
-        mock_project.return_value = True
-        test_proj_id = ""
-        test_folder = ""
-        assert check_proj_folder_exists(test_proj_id, test_folder)
+        mock_describe.return_value = {"folders": ["/", "/my_path"]}
+        with self.subTest():
+            assert check_proj_folder_exists("project-1234", "/my_path/")
+        with self.subTest():
+            assert check_proj_folder_exists("project-1234", "my_path")
+        with self.subTest():
+            mock_describe.assert_called_once()
 
-    @patch("bin.utils.util.check_project_exists")
-    @patch("dxpy.api.project_list_folder")
-    def test_check_proj_folder_exists_invalid_folder(
-        self, mock_folder, mock_project
-    ):
+    @patch.dict("bin.utils.util.PROJECT_FOLDERS", clear=True)
+    @patch("bin.utils.util.dxpy.api.project_describe")
+    def test_check_proj_folder_exists_invalid_folder(self, mock_describe):
         """Test check_proj_folder_exists fails for folder not present
         """
-        mock_folder.side_effect = (
-            Mock(side_effect=dxpy.exceptions.ResourceNotFound(
-                {"error": {"type": "test", "message": "test"}}, "")
-            )
-        )
-        test_proj_id = ""
-        test_folder = ""
-        assert not check_proj_folder_exists(test_proj_id, test_folder)
+        mock_describe.return_value = {"folders": ["/"]}
+        assert not check_proj_folder_exists("project-1234", "/my_path")
 
-    @patch("bin.utils.util.check_project_exists")
-    @patch("bin.utils.util.dxpy.api.project_list_folder")
-    def test_check_proj_folder_exists_no_proj(self, mock_folder, mock_project):
+    @patch.dict("bin.utils.util.PROJECT_FOLDERS", clear=True)
+    @patch("bin.utils.util.dxpy.api.project_describe")
+    def test_check_proj_folder_exists_no_proj(self, mock_describe):
         """Test check_proj_folder_exists raises error if project does not exist
         """
-        mock_project.return_value = False
+        mock_describe.side_effect = dxpy.exceptions.ResourceNotFound(
+            {"error": {"type": "test", "message": "test"}}, ""
+        )
         test_proj_id = "proj-1234"
         test_folder = ""
         expected_err = f"Project {test_proj_id} does not exist"
         with self.assertRaisesRegex(RuntimeError, expected_err):
             check_proj_folder_exists(test_proj_id, test_folder)
 
+    @patch.dict("bin.utils.util.PROJECT_FOLDERS", clear=True)
+    @patch("bin.utils.util.DXProject")
+    @patch("bin.utils.util.dxpy.api.project_describe")
+    def test_create_proj_folder_if_missing(self, mock_describe, mock_project):
+        """Test a missing folder is created once, and it and its parents are
+        then known to exist without further API calls
+        """
+        mock_describe.return_value = {"folders": ["/"]}
+        create_proj_folder_if_missing("project-1234", "/update/clinvar")
+        create_proj_folder_if_missing("project-1234", "/update/clinvar/")
+        with self.subTest():
+            mock_project.return_value.new_folder.assert_called_once_with(
+                "/update/clinvar", parents=True
+            )
+        with self.subTest():
+            assert check_proj_folder_exists("project-1234", "/update")
+        with self.subTest():
+            mock_describe.assert_called_once()
 
 if __name__ == "__main__":
     unittest.main()
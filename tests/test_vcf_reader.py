@@ -0,0 +1,98 @@
+import gzip
+import io
+import os
+import tempfile
+import unittest
+
+from bin.utils.vcf_reader import (
+    VCFRecord, read_vcf_records, read_vcf_batches, get_info_value
+)
+
+VCF_HEADER = (
+    "##fileformat=VCFv4.1\n"
+    "##source=ClinVar\n"
+    "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+)
+VCF_RECORDS = (
+    "1\t69134\t2205837\tA\tG\t.\t.\tALLELEID=2193183;"
+    "CLNREVSTAT=criteria_provided,_single_submitter;"
+    "CLNSIG=Likely_benign;CLNVC=single_nucleotide_variant\n"
+    "1\t69581\t2252161\tC\tG\t.\t.\tALLELEID=2238986;"
+    "CLNREVSTAT=criteria_provided,_single_submitter;"
+    "CLNSIG=Uncertain_significance\n"
+    "2\t1000\t12345\tT\t.\t.\t.\tALLELEID=1;CLNREVSTAT=no_assertion_provided\n"
+)
+
+
+class TestVCFReader(unittest.TestCase):
+    def setUp(self):
+        # two gzip members, as in a BGZF file
+        self.compressed = (
+            gzip.compress(VCF_HEADER.encode())
+            + gzip.compress(VCF_RECORDS.encode())
+        )
+
+    def test_read_vcf_records(self):
+        """Test records are read from a multi-member gzip file object
+        """
+        records = list(read_vcf_records(io.BytesIO(self.compressed)))
+        with self.subTest():
+            assert len(records) == 3
+        with self.subTest():
+            assert records[0] == VCFRecord(
+                "1", 69134, "2205837", "A", "G", "Likely_benign",
+                "criteria_provided,_single_submitter"
+            )
+        with self.subTest():
+            # records without CLNSIG have no clinical significance
+            assert records[2].clnsig is None
+
+    def test_read_vcf_records_path(self):
+        """Test records are read from a path to a compressed VCF
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "clinvar.vcf.gz")
+            with open(path, "wb") as vcf_file:
+                vcf_file.write(self.compressed)
+            records = list(read_vcf_records(path, chunk_size=16))
+        assert [record.pos for record in records] == [69134, 69581, 1000]
+
+    def test_read_vcf_records_invalid(self):
+        """Test error is raised for a line with too few columns
+        """
+        compressed = gzip.compress(f"{VCF_HEADER}1\t100\tA\n".encode())
+        with self.assertRaisesRegex(RuntimeError, "VCF line 4 has 3"):
+            list(read_vcf_records(io.BytesIO(compressed)))
+
+    def test_read_vcf_batches(self):
+        """Test records are batched into columns with codes shared between
+        batches
+        """
+        batches = list(
+            read_vcf_batches(io.BytesIO(self.compressed), batch_size=2)
+        )
+        with self.subTest():
+            assert [len(batch) for batch in batches] == [2, 1]
+        with self.subTest():
+            assert list(batches[0].pos) == [69134, 69581]
+        with self.subTest():
+            assert batches[0].clnsig_codes is batches[1].clnsig_codes
+        with self.subTest():
+            assert list(batches[1].clnsig) == [0]
+        with self.subTest():
+            assert batches[0].record(1).clnsig == "Uncertain_significance"
+
+    def test_get_info_value(self):
+        """Test INFO values are found only for whole keys
+        """
+        info = "ALLELEID=1;CLNSIGCONF=Benign(1);CLNSIG=Pathogenic"
+        with self.subTest():
+            assert get_info_value(info, "CLNSIG") == "Pathogenic"
+        with self.subTest():
+            assert get_info_value(info, "ALLELEID") == "1"
+        with self.subTest():
+            assert get_info_value(info, "CLNREVSTAT") is None
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,253 @@
+import unittest
+import sys
+import os
+import io
+import json
+import tempfile
+
+import dxpy
+sys.path.append(os.path.abspath(
+    os.path.join(os.path.realpath(__file__), '../../bin')
+))
+from bin.vep_config_update import (
+    update_vep_config, update_clinvar_annotation, get_config_file_ids,
+    describe_files, check_config_files, bump_config_version,
+    get_config_file_name
+)
+from unittest.mock import Mock, patch
+
+PROJECT = "project-" + "P" * 24
+CONFIG = "file-" + "C" * 24
+OLD_VCF = "file-" + "V" * 24
+OLD_INDEX = "file-" + "I" * 24
+NEW_VCF = "file-" + "v" * 24
+NEW_INDEX = "file-" + "i" * 24
+CACHE = "file-" + "A" * 24
+
+
+def make_config() -> dict:
+    """VEP config referencing a cache and a ClinVar annotation
+    """
+    return {
+        "config_information": {"config_version": "1.2.0"},
+        "vep_resources": {"vep_cache": CACHE},
+        "custom_annotations": [
+            {
+                "name": "gnomAD",
+                "resource_files": [{"file_id": CACHE, "index_id": CACHE}],
+            },
+            {
+                "name": "ClinVar",
+                "resource_files": [{
+                    "file_id": f"{PROJECT}:{OLD_VCF}",
+                    "index_id": f"{PROJECT}:{OLD_INDEX}",
+                }],
+                "vep_fields": "CLNSIG,CLNREVSTAT",
+            },
+        ],
+    }
+
+
+class TestVepConfigUpdate(unittest.TestCase):
+    def test_update_clinvar_annotation(self):
+        """Test ClinVar files are replaced keeping the form of their IDs
+        """
+        config = make_config()
+        update_clinvar_annotation(config, NEW_VCF, NEW_INDEX, PROJECT)
+        assert config["custom_annotations"][1]["resource_files"] == [{
+            "file_id": f"{PROJECT}:{NEW_VCF}",
+            "index_id": f"{PROJECT}:{NEW_INDEX}",
+        }]
+
+    def test_update_clinvar_annotation_missing(self):
+        """Test error is raised when config has no ClinVar annotation
+        """
+        config = make_config()
+        del config["custom_annotations"][1]
+        with self.assertRaisesRegex(RuntimeError, "no ClinVar custom"):
+            update_clinvar_annotation(config, NEW_VCF, NEW_INDEX, PROJECT)
+
+    def test_get_config_file_ids(self):
+        """Test every file ID in the config is found once, in order
+        """
+        assert get_config_file_ids(make_config()) == [
+            CACHE, f"{PROJECT}:{OLD_VCF}", f"{PROJECT}:{OLD_INDEX}"
+        ]
+
+    @patch("bin.vep_config_update.MAX_DESCRIBE_OBJECTS", 2)
+    @patch("bin.vep_config_update.dxpy.api.system_describe_data_objects")
+    def test_describe_files(self, mock_describe):
+        """Test files are described in bulk, one request per batch, and
+        files that cannot be described are left out
+        """
+        mock_describe.side_effect = [
+            {"results": [
+                {"describe": {"name": "cache.tar.gz", "state": "closed"}},
+                {"describe": {"name": "clinvar.vcf.gz", "state": "closed"}},
+            ]},
+            {"results": [{}]},
+        ]
+        file_ids = [CACHE, f"{PROJECT}:{OLD_VCF}", OLD_INDEX]
+        descriptions = describe_files(file_ids)
+        with self.subTest():
+            assert mock_describe.call_count == 2
+        with self.subTest():
+            assert mock_describe.call_args_list[0].args[0]["objects"][1] == {
+                "id": OLD_VCF, "project": PROJECT,
+                "describe": {"fields": {
+                    "name": True, "state": True, "archivalState": True
+                }},
+            }
+        with self.subTest():
+            assert list(descriptions) == [CACHE, f"{PROJECT}:{OLD_VCF}"]
+
+    def test_check_config_files(self):
+        """Test missing, open, closing and archived files are reported
+        """
+        descriptions = {
+            CACHE: {"state": "closed", "archivalState": "live"},
+            OLD_VCF: {"state": "open"},
+            OLD_INDEX: {"state": "closed", "archivalState": "archived"},
+            NEW_INDEX: {"state": "closing"},
+        }
+        problems = check_config_files(
+            [CACHE, OLD_VCF, OLD_INDEX, NEW_VCF, NEW_INDEX], descriptions
+        )
+        assert problems == [
+            f"{OLD_VCF} is open",
+            f"{OLD_INDEX} is archived, not live",
+            f"{NEW_VCF} does not exist or is not accessible",
+            f"{NEW_INDEX} is closing",
+        ]
+
+    def test_bump_config_version(self):
+        """Test last component of config version is incremented
+        """
+        with self.subTest():
+            assert bump_config_version("1.2.9") == "1.2.10"
+        with self.subTest():
+            with self.assertRaisesRegex(RuntimeError, "is not valid"):
+                bump_config_version("1.2.0-beta")
+
+    def test_get_config_file_name(self):
+        """Test version in config file name is replaced, or appended if
+        the name has no version
+        """
+        with self.subTest():
+            assert get_config_file_name(
+                "uranus_vep_config_v1.2.0.json", "1.2.1"
+            ) == "uranus_vep_config_v1.2.1.json"
+        with self.subTest():
+            assert get_config_file_name(
+                "vep_config.json", "1.0.1"
+            ) == "vep_config_v1.0.1.json"
+
+    @patch("bin.vep_config_update.dxpy.DXFile")
+    @patch("bin.vep_config_update.upload_file_DNAnexus")
+    @patch("bin.vep_config_update.dxpy.api.system_describe_data_objects")
+    @patch("bin.vep_config_update.dxpy.open_dxfile")
+    def test_update_vep_config(
+        self, mock_open_dxfile, mock_describe, mock_upload, mock_dxfile
+    ):
+        """Test new config version referencing the new ClinVar files is
+        uploaded after they close and every file is resolved in one request
+        """
+        mock_open_dxfile.return_value = io.BytesIO(
+            json.dumps(make_config()).encode()
+        )
+        mock_describe.return_value = {"results": [
+            {"describe": {"name": "uranus_vep_config_v1.2.0.json"}},
+            {"describe": {"state": "closed"}},
+            {"describe": {"state": "closed"}},
+            {"describe": {"state": "closed"}},
+        ]}
+        mock_upload.return_value = "file-new-config"
+        previous_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            try:
+                config_id = update_vep_config(
+                    f"{PROJECT}:{CONFIG}", NEW_VCF, NEW_INDEX, PROJECT,
+                    "/update"
+                )
+                with open("uranus_vep_config_v1.2.1.json") as config_file:
+                    config = json.load(config_file)
+            finally:
+                os.chdir(previous_dir)
+        with self.subTest():
+            assert config_id == "file-new-config"
+        with self.subTest():
+            mock_describe.assert_called_once()
+        with self.subTest():
+            assert [
+                call.args[0] for call in mock_dxfile.call_args_list
+            ] == [NEW_VCF, NEW_INDEX]
+        with self.subTest():
+            assert mock_dxfile.return_value.wait_on_close.call_count == 2
+        with self.subTest():
+            assert config["config_information"]["config_version"] == "1.2.1"
+        with self.subTest():
+            assert config["custom_annotations"][1]["resource_files"][0][
+                "file_id"
+            ] == f"{PROJECT}:{NEW_VCF}"
+        with self.subTest():
+            assert mock_upload.call_args.args[:3] == (
+                "uranus_vep_config_v1.2.1.json", PROJECT, "/update"
+            )
+
+    @patch("bin.vep_config_update.dxpy.DXFile")
+    @patch("bin.vep_config_update.upload_file_DNAnexus")
+    @patch("bin.vep_config_update.dxpy.api.system_describe_data_objects")
+    @patch("bin.vep_config_update.dxpy.open_dxfile")
+    def test_update_vep_config_not_closed(
+        self, mock_open_dxfile, mock_describe, mock_upload, mock_dxfile
+    ):
+        """Test config is not uploaded if the new ClinVar files do not close
+        """
+        mock_open_dxfile.return_value = io.BytesIO(
+            json.dumps(make_config()).encode()
+        )
+        mock_dxfile.return_value.wait_on_close.side_effect = (
+            dxpy.exceptions.DXError("Reached timeout")
+        )
+        with self.subTest():
+            with self.assertRaisesRegex(
+                RuntimeError, f"{NEW_VCF} did not close"
+            ):
+                update_vep_config(
+                    CONFIG, NEW_VCF, NEW_INDEX, PROJECT, "/update"
+                )
+        with self.subTest():
+            mock_describe.assert_not_called()
+        with self.subTest():
+            mock_upload.assert_not_called()
+
+    @patch("bin.vep_config_update.dxpy.DXFile", Mock())
+    @patch("bin.vep_config_update.upload_file_DNAnexus")
+    @patch("bin.vep_config_update.dxpy.api.system_describe_data_objects")
+    @patch("bin.vep_config_update.dxpy.open_dxfile")
+    def test_update_vep_config_missing_file(
+        self, mock_open_dxfile, mock_describe, mock_upload
+    ):
+        """Test config is not uploaded if it references a missing file
+        """
+        mock_open_dxfile.return_value = io.BytesIO(
+            json.dumps(make_config()).encode()
+        )
+        mock_describe.return_value = {"results": [
+            {"describe": {"name": "uranus_vep_config_v1.2.0.json"}},
+            {},
+            {"describe": {"state": "closed"}},
+            {"describe": {"state": "closed"}},
+        ]}
+        with self.subTest():
+            with self.assertRaisesRegex(RuntimeError, f"{CACHE} does not"):
+                update_vep_config(
+                    CONFIG, NEW_VCF, NEW_INDEX, PROJECT, "/update"
+                )
+        with self.subTest():
+            mock_upload.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()